@@ -0,0 +1,15 @@
+"""
+Lean settings for API-only processes (JSON API, long-poll events, Celery workers):
+production settings without the admin site and Jazzmin, which these processes
+never serve but would otherwise import at startup.
+
+    DJANGO_SETTINGS_MODULE=django_invoice.api
+"""
+from .production import *
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ('jazzmin', 'django.contrib.admin')]
+
+ROOT_URLCONF = 'django_invoice.api_urls'
+
+# The login page is served by the full (admin) processes
+LOGIN_URL = '/admin/login/'
@@ -0,0 +1,6 @@
+from django.urls import include, path
+
+# URLs of the lean "api" settings profile: no admin site, no SPA pages
+urlpatterns = [
+    path('api/', include('fact_app.api_urls')),
+]
@@ -1,6 +1,7 @@
 import os 
 
-from celery import Celery 
+from celery import Celery
+from celery.schedules import crontab
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_invoice.production')
 
@@ -10,6 +11,45 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
 
+# Periodic tasks, synced into django_celery_beat's tables by its DatabaseScheduler
+app.conf.beat_schedule = {
+    'refresh-invoice-statistics': {
+        'task': 'fact_app.tasks.refresh_invoice_statistics',
+        'schedule': crontab(minute='*/10'),
+    },
+    'reconcile-invoice-totals': {
+        'task': 'fact_app.tasks.reconcile_invoice_totals',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'assign-invoice-numbers': {
+        'task': 'fact_app.tasks.assign_invoice_numbers_task',
+        'schedule': crontab(minute='*/5'),
+    },
+    'archive-paid-invoices': {
+        'task': 'fact_app.tasks.archive_paid_invoices_task',
+        'schedule': crontab(hour=3, minute=15),
+    },
+    # Deliveries left claimed by a worker that died or left pending once retries ran out (fact_app.delivery)
+    'requeue-stale-deliveries': {
+        'task': 'fact_app.tasks.requeue_stale_deliveries_task',
+        'schedule': crontab(minute='*/15'),
+    },
+    'prune-tombstones': {
+        'task': 'fact_app.tasks.prune_tombstones_task',
+        'schedule': crontab(hour=3, minute=45),
+    },
+    'monthly-customer-statements': {
+        'task': 'fact_app.tasks.generate_monthly_statements',
+        'schedule': crontab(day_of_month=1, hour=4, minute=0),
+    },
+    # Bills the subscription periods due today (fact_app.recurring)
+    'recurring-invoices': {
+        'task': 'fact_app.tasks.generate_recurring_invoices_task',
+        'schedule': crontab(hour=0, minute=30),
+    },
+}
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
@@ -7,4 +7,13 @@ DATABASES = {
     }
 }
 
-DEBUG = True
\ No newline at end of file
+DEBUG = True
+
+# No broker needed locally: Celery tasks run inline
+CELERY_TASK_ALWAYS_EAGER = True
+
+# Invoice emails are written to EMAIL_FILE_PATH instead of being sent
+EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+
+# SQLite has no INCLUDE columns: covering indexes become plain composite indexes
+SILENCED_SYSTEM_CHECKS = ['models.W040']
@@ -35,8 +35,23 @@ CACHES = {
     },
 }
 
+# Sessions are read from Redis and only written through to the database
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# Invoice events are shared between gunicorn workers through Redis
+INVOICE_EVENTS_REDIS_URL = config("REDIS_URL", "redis://redis")
+
 DEBUG = False
 
+# Compile each template once per process (explicit loaders replace APP_DIRS)
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+
 
 
 CSRF_TRUSTED_ORIGINS = [
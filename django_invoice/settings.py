@@ -4,6 +4,8 @@ from pathlib import Path
 import os 
 from decouple import config
 
+from logging_config import LOGGING
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -62,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'fact_app.middleware.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,8 +90,24 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'django_invoice.wsgi.application'
 
+# JSON logs written by a background thread (see logging_config.py)
+LOGGING_CONFIG = 'logging_config.configure_logging'
+
+
 
 
+# Authentication
+# Users and their permissions are cached for USER_CACHE_TIMEOUT seconds and
+# invalidated by fact_app.signals when they change.
+
+# ModelBackend stays listed so sessions opened before the cache keep working
+AUTHENTICATION_BACKENDS = [
+    'fact_app.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=60, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -147,6 +166,97 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# ============================================================================
+# INVOICE SETTINGS
+# ============================================================================
+
+# Load invoice lines as flat integer-cents arrays instead of Article instances
+# (detail page, JSON API and PDF). Recommended for invoices with thousands of lines.
+INVOICE_COMPACT_ARTICLES = config('INVOICE_COMPACT_ARTICLES', default=False, cast=bool)
+
+# Currency of reports, dashboards and customer rollups. Invoices in other
+# currencies are converted with the FxRate snapshots (load_fx_rates command).
+BASE_CURRENCY = config('BASE_CURRENCY', default='XAF')
+
+# Rendered invoice PDFs, one file per invoice version
+INVOICE_PDF_CACHE_DIR = os.path.join(MEDIA_ROOT, 'invoices')
+
+# CSV exports generated by fact_app.tasks.generate_invoice_export
+INVOICE_EXPORT_DIR = os.path.join(MEDIA_ROOT, 'exports')
+
+# Customer statements stored by the monthly run (fact_app.statements)
+STATEMENT_DIR = os.path.join(MEDIA_ROOT, 'statements')
+
+# Paid invoices older than this many days are moved to the archive tables
+INVOICE_ARCHIVE_AFTER_DAYS = config('INVOICE_ARCHIVE_AFTER_DAYS', default=730, cast=int)
+
+# Idempotency-Key headers of the invoice creation API are remembered this long (seconds)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=24 * 60 * 60, cast=int)
+# A key whose request is still running (or died) is held this long (seconds)
+IDEMPOTENCY_PENDING_TTL = config('IDEMPOTENCY_PENDING_TTL', default=120, cast=int)
+
+# Country calling code assumed for customer phone numbers written without one
+# (duplicate detection, see fact_app.dedupe)
+CUSTOMER_PHONE_COUNTRY_CODE = config('CUSTOMER_PHONE_COUNTRY_CODE', default='237')
+
+# Change feed (api/changes/): rows younger than this are served on the next call,
+# so a transaction committing late cannot slip behind a client's cursor
+CHANGE_FEED_SETTLE_SECONDS = 2
+# Tombstones of deleted rows are pruned after this many days; change feed
+# cursors older than that are refused (the client starts a full sync)
+TOMBSTONE_RETENTION_DAYS = config('TOMBSTONE_RETENTION_DAYS', default=90, cast=int)
+
+# Live invoice events (api/invoices/events/): Redis stream shared by all web
+# processes; when unset, events stay inside the current process
+INVOICE_EVENTS_REDIS_URL = None
+# Long polls waiting at once per web process, each holding a gunicorn thread:
+# keep it well below --threads (run.sh) so other requests still get one
+INVOICE_EVENTS_MAX_WAITERS = config('INVOICE_EVENTS_MAX_WAITERS', default=4, cast=int)
+
+# Invoice emails (fact_app.delivery). EMAIL_BACKEND may be
+# django.core.mail.backends.locmem.EmailBackend (tests) or
+# django.core.mail.backends.filebased.EmailBackend with EMAIL_FILE_PATH (local checks).
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=30, cast=int)
+EMAIL_FILE_PATH = os.path.join(MEDIA_ROOT, 'emails')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='invoices@localhost')
+# Sending tasks started per minute and worker, each sending up to 100 emails
+INVOICE_EMAIL_RATE_LIMIT = config('INVOICE_EMAIL_RATE_LIMIT', default='60/m')
+
+# ============================================================================
+# CELERY TASKS
+# ============================================================================
+
+# Run tasks inline instead of sending them to the broker (tests, local dev)
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
+
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'fact_app.tasks.render_invoice_pdf_task': {'queue': 'pdf'},
+    'fact_app.tasks.refresh_invoice_statistics': {'queue': 'reports'},
+    'fact_app.tasks.generate_invoice_export': {'queue': 'reports'},
+    'fact_app.tasks.reconcile_invoice_totals': {'queue': 'reports'},
+    'fact_app.tasks.archive_paid_invoices_task': {'queue': 'reports'},
+    'fact_app.tasks.prune_tombstones_task': {'queue': 'reports'},
+    # Monthly statement PDFs stay off the pdf pool serving invoice downloads
+    'fact_app.tasks.generate_monthly_statements': {'queue': 'reports'},
+    'fact_app.tasks.render_customer_statements_task': {'queue': 'reports'},
+}
+
+# Late acknowledgement: a task killed mid-run is redelivered (tasks are idempotent)
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# The periodic tasks are declared in django_invoice/celery.py, next to the app:
+# crontab schedules need Celery, which settings must not import
+
 # ============================================================================
 # JAZZMIN CONFIGURATION (Modern Django Admin)
 # ============================================================================
@@ -2,7 +2,13 @@ from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import Customer, Invoice, Article
+from django.db.models import Count
+from .models import (
+    ApiToken, Customer, Invoice, Article, ArchivedInvoice, ArchivedArticle, AuditEntry, FxRate, InvoiceDelivery,
+    Payment, PaymentBatch, RecurringInvoice, RecurringInvoiceLine,
+)
+from .delivery import queue_invoice_deliveries
+from .money import annotate_totals, currency_symbol, format_amount, from_cents, get_base_currency
 
 
 @admin.register(Customer)
@@ -45,7 +51,7 @@ class CustomerAdmin(admin.ModelAdmin):
     
     def get_invoice_count(self, obj):
         """Display number of invoices"""
-        count = obj.invoices.count()
+        count = obj.invoice_count
         color = 'green' if count > 0 else 'gray'
         return format_html(
             '<span style="color: {}; font-weight: bold;">📋 {}</span>',
@@ -53,23 +59,27 @@ class CustomerAdmin(admin.ModelAdmin):
             count
         )
     get_invoice_count.short_description = _('Invoices')
+    get_invoice_count.admin_order_field = 'invoice_count'
     
     def get_total_amount(self, obj):
         """Display total invoice amount"""
-        total = obj.get_total_invoices()
+        total = obj.total_billed
         color = 'green' if total > 0 else 'gray'
         return format_html(
-            '<span style="color: {}; font-weight: bold;">💰 ${:.2f}</span>',
+            '<span style="color: {}; font-weight: bold;">💰 {}</span>',
             color,
-            total
+            format_amount(total, get_base_currency())
         )
     get_total_amount.short_description = _('Total Amount')
+    get_total_amount.admin_order_field = 'total_billed'
     
     def invoice_stats(self, obj):
         """Display invoice statistics"""
-        total_invoices = obj.invoices.count()
-        paid_invoices = obj.get_paid_invoices()
-        total_amount = obj.get_total_invoices()
+        total_invoices = obj.invoice_count
+        paid_invoices = obj.paid_invoice_count
+        total_amount = obj.total_billed
+        last_invoice = obj.last_invoice_date.strftime('%Y-%m-%d') if obj.last_invoice_date else '-'
+        symbol = currency_symbol(get_base_currency())
         
         html = f"""
         <div style="background-color: #f5f5f5; padding: 15px; border-radius: 5px;">
@@ -89,7 +99,15 @@ class CustomerAdmin(admin.ModelAdmin):
                 </tr>
                 <tr style="background-color: #e8f5e9;">
                     <td style="padding: 8px;"><strong>Total Amount:</strong></td>
-                    <td style="padding: 8px; text-align: right; color: green; font-weight: bold;">💰 ${total_amount:.2f}</td>
+                    <td style="padding: 8px; text-align: right; color: green; font-weight: bold;">💰 {total_amount:.2f} {symbol}</td>
+                </tr>
+                <tr>
+                    <td style="padding: 8px;"><strong>Outstanding:</strong></td>
+                    <td style="padding: 8px; text-align: right; color: red;">{obj.total_outstanding:.2f} {symbol}</td>
+                </tr>
+                <tr>
+                    <td style="padding: 8px;"><strong>Last Invoice:</strong></td>
+                    <td style="padding: 8px; text-align: right;">{last_invoice}</td>
                 </tr>
             </table>
         </div>
@@ -109,14 +127,17 @@ class ArticleInline(admin.TabularInline):
     """
     model = Article
     extra = 1
-    fields = ('name', 'quantity', 'unit_price', 'get_total_display', 'created_at')
+    fields = ('name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp', 'get_total_display', 'created_at')
     readonly_fields = ('get_total_display', 'created_at')
     
     def get_total_display(self, obj):
         """Display formatted total with currency symbol"""
+        if obj.quantity is None or obj.unit_price is None:
+            # Blank extra form
+            return '-'
         return format_html(
-            '<span style="color: green; font-weight: bold;">💰 ${:.2f}</span>',
-            obj.get_total
+            '<span style="color: green; font-weight: bold;">💰 {}</span>',
+            format_amount(obj.get_total, obj.invoice.currency)
         )
     get_total_display.short_description = _('Line Total')
 
@@ -127,21 +148,22 @@ class InvoiceAdmin(admin.ModelAdmin):
     Admin interface for Invoice model - Modernized with advanced features
     """
     list_display = ('get_invoice_display', 'customer_link', 'invoice_date_time', 'get_total_display', 'get_paid_status', 'invoice_type_badge', 'article_count')
-    list_filter = ('paid', 'invoice_type', 'invoice_date_time')
-    search_fields = ('customer__name', 'comments', 'id')
+    list_filter = ('paid', 'invoice_type', 'currency', 'invoice_date_time')
+    search_fields = ('number', 'customer__name', 'comments', 'id')
     readonly_fields = ('invoice_date_time', 'last_updated_date', 'total_display', 'article_summary')
     inlines = [ArticleInline]
     date_hierarchy = 'invoice_date_time'
     ordering = ('-invoice_date_time',)
     list_per_page = 20
+    actions = ['send_by_email']
     
     fieldsets = (
         (_('📋 Invoice Information'), {
-            'fields': ('customer', 'invoice_type', 'invoice_date_time'),
+            'fields': ('customer', 'invoice_type', 'currency', 'invoice_date_time'),
             'description': _('Basic invoice details')
         }),
         (_('💳 Payment Status'), {
-            'fields': ('paid', 'total_display')
+            'fields': ('paid', 'adjustment', 'total_display')
         }),
         (_('📝 Additional Information'), {
             'fields': ('comments', 'save_by', 'last_updated_date', 'article_summary'),
@@ -149,9 +171,14 @@ class InvoiceAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Compute totals and article counts in the list query"""
+        queryset = super().get_queryset(request).select_related('customer')
+        return annotate_totals(queryset).annotate(articles_count=Count('articles'))
+    
     def get_invoice_display(self, obj):
         """Display invoice with formatted ID"""
-        return mark_safe(f'<strong>📄 INV-{obj.id:05d}</strong>')
+        return mark_safe(f'<strong>📄 {obj.reference}</strong>')
     get_invoice_display.short_description = _('Invoice')
     
     def customer_link(self, obj):
@@ -162,10 +189,11 @@ class InvoiceAdmin(admin.ModelAdmin):
     def get_total_display(self, obj):
         """Display formatted total with currency symbol"""
         return format_html(
-            '<span style="color: green; font-weight: bold; font-size: 14px;">💰 ${:.2f}</span>',
-            obj.get_total
+            '<span style="color: green; font-weight: bold; font-size: 14px;">💰 {}</span>',
+            format_amount(obj.get_total, obj.currency)
         )
     get_total_display.short_description = _('Total')
+    get_total_display.admin_order_field = 'articles_total_cents'
     
     def get_paid_status(self, obj):
         """Display payment status with color coding"""
@@ -197,18 +225,23 @@ class InvoiceAdmin(admin.ModelAdmin):
     
     def article_count(self, obj):
         """Display number of articles in invoice"""
-        count = obj.articles.count()
+        count = getattr(obj, 'articles_count', None)
+        if count is None:
+            count = obj.articles.count()
         return format_html(
             '<span style="color: #1976D2; font-weight: bold;">🛒 {}</span>',
             count
         )
     article_count.short_description = _('Items')
+    article_count.admin_order_field = 'articles_count'
     
     def total_display(self, obj):
-        """Display formatted total in detail view"""
+        """Display formatted total in detail view, with its breakdown"""
+        amounts = {name: format_amount(amount, obj.currency) for name, amount in obj.get_pricing().amounts().items()}
         return format_html(
-            '<span style="color: green; font-weight: bold; font-size: 16px;">💰 ${:.2f}</span>',
-            obj.get_total
+            '<span style="color: green; font-weight: bold; font-size: 16px;">💰 {}</span><br/>'
+            '<small>Subtotal {} − discount {} + tax {} + adjustment {}</small>',
+            amounts['total'], amounts['subtotal'], amounts['discount'], amounts['tax'], amounts['adjustment']
         )
     total_display.short_description = _('Invoice Total')
     
@@ -218,12 +251,23 @@ class InvoiceAdmin(admin.ModelAdmin):
         if not articles:
             return mark_safe('<p style="color: #999;"><em>No articles in this invoice</em></p>')
         
-        html = '<table style="width: 100%; border-collapse: collapse;"><tr style="background-color: #f5f5f5;"><th style="padding: 8px; text-align: left;">Product</th><th style="padding: 8px; text-align: right;">Qty</th><th style="padding: 8px; text-align: right;">Price</th><th style="padding: 8px; text-align: right;">Total</th></tr>'
+        html = '<table style="width: 100%; border-collapse: collapse;"><tr style="background-color: #f5f5f5;"><th style="padding: 8px; text-align: left;">Product</th><th style="padding: 8px; text-align: right;">Qty</th><th style="padding: 8px; text-align: right;">Price</th><th style="padding: 8px; text-align: right;">Discount</th><th style="padding: 8px; text-align: right;">Tax</th><th style="padding: 8px; text-align: right;">Total</th></tr>'
+        symbol = currency_symbol(obj.currency)
         for article in articles:
-            html += f'<tr style="border-bottom: 1px solid #ddd;"><td style="padding: 8px;">{article.name}</td><td style="padding: 8px; text-align: right;">{article.quantity}</td><td style="padding: 8px; text-align: right;">${article.unit_price:.2f}</td><td style="padding: 8px; text-align: right; font-weight: bold; color: green;">${article.get_total:.2f}</td></tr>'
+            line = article.get_price()
+            html += f'<tr style="border-bottom: 1px solid #ddd;"><td style="padding: 8px;">{article.name}</td><td style="padding: 8px; text-align: right;">{article.quantity}</td><td style="padding: 8px; text-align: right;">{article.unit_price:.2f} {symbol}</td><td style="padding: 8px; text-align: right;">{from_cents(line.discount):.2f} {symbol}</td><td style="padding: 8px; text-align: right;">{from_cents(line.tax):.2f} {symbol}</td><td style="padding: 8px; text-align: right; font-weight: bold; color: green;">{from_cents(line.total):.2f} {symbol}</td></tr>'
         html += '</table>'
         return mark_safe(html)
     article_summary.short_description = _('Articles Summary')
+
+    def send_by_email(self, request, queryset):
+        """Queue the selected invoices for sending to their customers"""
+        results = queue_invoice_deliveries(queryset, request.user)
+        queued = sum(1 for status in results.values() if status == 'queued')
+        self.message_user(request, _('%(queued)d of %(total)d invoices queued for sending.') % {
+            'queued': queued, 'total': len(results),
+        })
+    send_by_email.short_description = _('Send by email')
     
     def save_model(self, request, obj, form, change):
         if not change:
@@ -245,7 +289,7 @@ class ArticleAdmin(admin.ModelAdmin):
     
     fieldsets = (
         (_('📦 Article Information'), {
-            'fields': ('invoice', 'name', 'quantity', 'unit_price'),
+            'fields': ('invoice', 'name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp'),
             'description': _('Product or service details')
         }),
         (_('💰 Totals'), {
@@ -265,7 +309,7 @@ class ArticleAdmin(admin.ModelAdmin):
     
     def get_invoice_link(self, obj):
         """Display invoice link with customer info"""
-        return mark_safe(f'<strong>INV-{obj.invoice.id:05d}</strong><br/><small>{obj.invoice.customer.name}</small>')
+        return mark_safe(f'<strong>{obj.invoice.reference}</strong><br/><small>{obj.invoice.customer.name}</small>')
     get_invoice_link.short_description = _('Invoice')
     
     def quantity_display(self, obj):
@@ -275,22 +319,25 @@ class ArticleAdmin(admin.ModelAdmin):
     
     def price_display(self, obj):
         """Display unit price"""
-        return format_html('<span style="color: #1976D2; font-weight: bold;">💰 ${:.2f}</span>', obj.unit_price)
+        return format_html(
+            '<span style="color: #1976D2; font-weight: bold;">💰 {}</span>',
+            format_amount(obj.unit_price, obj.invoice.currency)
+        )
     price_display.short_description = _('Unit Price')
     
     def get_line_total(self, obj):
         """Display line total"""
         return format_html(
-            '<span style="color: green; font-weight: bold; font-size: 14px;">💰 ${:.2f}</span>',
-            obj.get_total
+            '<span style="color: green; font-weight: bold; font-size: 14px;">💰 {}</span>',
+            format_amount(obj.get_total, obj.invoice.currency)
         )
     get_line_total.short_description = _('Line Total')
     
     def line_total_display(self, obj):
         """Display line total in detail view"""
         return format_html(
-            '<span style="color: green; font-weight: bold; font-size: 16px;">💰 ${:.2f}</span>',
-            obj.get_total
+            '<span style="color: green; font-weight: bold; font-size: 16px;">💰 {}</span>',
+            format_amount(obj.get_total, obj.invoice.currency)
         )
     line_total_display.short_description = _('Line Total')
     
@@ -299,19 +346,224 @@ class ArticleAdmin(admin.ModelAdmin):
         invoice = obj.invoice
         html = f"""
         <div style="background-color: #f5f5f5; padding: 10px; border-radius: 5px;">
-            <strong>Invoice:</strong> INV-{invoice.id:05d}<br/>
+            <strong>Invoice:</strong> {invoice.reference}<br/>
             <strong>Customer:</strong> {invoice.customer.name}<br/>
-            <strong>Invoice Total:</strong> <span style="color: green; font-weight: bold;">💰 ${invoice.get_total:.2f}</span><br/>
+            <strong>Invoice Total:</strong> <span style="color: green; font-weight: bold;">💰 {format_amount(f'{invoice.get_total:.2f}', invoice.currency)}</span><br/>
             <strong>Status:</strong> {'✓ Paid' if invoice.paid else '✗ Unpaid'}
         </div>
         """
         return mark_safe(html)
     invoice_summary.short_description = _('Invoice Summary')
 
+class RecurringInvoiceLineInline(admin.TabularInline):
+    """
+    Lines copied to every invoice of a recurring template
+    """
+    model = RecurringInvoiceLine
+    extra = 1
+    fields = ('name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp')
+
+
+@admin.register(RecurringInvoice)
+class RecurringInvoiceAdmin(admin.ModelAdmin):
+    """
+    Subscription templates, billed every period by the recurring-invoices beat job
+    """
+    list_display = ('name', 'customer', 'cadence', 'currency', 'next_date', 'billed_periods', 'end_date', 'active')
+    list_filter = ('active', 'cadence', 'currency')
+    search_fields = ('name', 'customer__name', 'customer__email')
+    list_select_related = ('customer',)
+    readonly_fields = ('next_date', 'billed_periods', 'created_at', 'updated_at')
+    inlines = [RecurringInvoiceLineInline]
+    list_per_page = 50
+
+    fieldsets = (
+        (_('🔁 Subscription'), {
+            'fields': ('customer', 'name', 'cadence', 'start_date', 'end_date', 'active'),
+        }),
+        (_('📋 Invoices'), {
+            'fields': ('invoice_type', 'currency', 'adjustment', 'comments'),
+        }),
+        (_('🔧 System Information'), {
+            'fields': ('next_date', 'billed_periods', 'created_at', 'updated_at'),
+            'classes': ('collapse',)
+        }),
+    )
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.save_by = request.user
+        super().save_model(request, obj, form, change)
+
+
+class ArchivedArticleInline(admin.TabularInline):
+    """
+    Read-only line items of an archived invoice
+    """
+    model = ArchivedArticle
+    extra = 0
+    fields = ('name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp', 'created_at')
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedInvoice)
+class ArchivedInvoiceAdmin(admin.ModelAdmin):
+    """
+    Read-only admin for invoices moved to the archive tables
+    """
+    list_display = ('id', 'customer', 'invoice_date_time', 'total', 'currency', 'invoice_type', 'archived_at')
+    list_filter = ('invoice_type', 'currency', 'archived_at')
+    search_fields = ('id', 'customer__name', 'customer__email')
+    date_hierarchy = 'invoice_date_time'
+    list_select_related = ('customer',)
+    inlines = [ArchivedArticleInline]
+    list_per_page = 25
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(FxRate)
+class FxRateAdmin(admin.ModelAdmin):
+    """
+    Read-only exchange rate snapshots, loaded with the load_fx_rates command
+    (which also refreshes the rollups the new rates change)
+    """
+    list_display = ('currency', 'valid_from', 'rate', 'source', 'loaded_at')
+    list_filter = ('currency',)
+    date_hierarchy = 'valid_from'
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(InvoiceDelivery)
+class InvoiceDeliveryAdmin(admin.ModelAdmin):
+    """
+    Read-only log of the invoice emails (queued from the invoice list action,
+    the API or the send_invoices command)
+    """
+    list_display = ('id', 'invoice_id', 'email', 'status', 'attempts', 'created_at', 'sent_at', 'error')
+    list_filter = ('status', 'created_at')
+    search_fields = ('email', 'invoice__id')
+    date_hierarchy = 'created_at'
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AuditEntry)
+class AuditEntryAdmin(admin.ModelAdmin):
+    """
+    Read-only audit trail of customers, invoices and articles (append-only)
+    """
+    list_display = ('created_at', 'object_type', 'object_id', 'action', 'user', 'changes')
+    list_filter = ('object_type', 'action', 'created_at')
+    search_fields = ('=object_id', 'user__username')
+    date_hierarchy = 'created_at'
+    list_select_related = ('user',)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    """
+    Read-only list of payments; unmatched statement lines have no invoice.
+    Payments are recorded through the API or the reconcile_payments command,
+    which keep Invoice.amount_paid up to date.
+    """
+    list_display = ('id', 'received_on', 'amount', 'currency', 'invoice_id', 'match', 'reference', 'batch')
+    list_filter = ('match', 'currency', 'received_on')
+    search_fields = ('reference', 'invoice__id')
+    date_hierarchy = 'received_on'
+    list_select_related = ('batch',)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PaymentBatch)
+class PaymentBatchAdmin(admin.ModelAdmin):
+    """
+    Reconciled bank statements
+    """
+    list_display = (
+        'id', 'name', 'created_at', 'currency', 'line_count', 'matched_count', 'total_amount', 'matched_amount', 'save_by',
+    )
+    date_hierarchy = 'created_at'
+    list_per_page = 25
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # ============================================================================
 # ADMIN SITE CUSTOMIZATION
 # ============================================================================
 
 admin.site.site_title = _("Invoice System Admin")
 admin.site.site_header = _("📊 Invoice System Administration")
-admin.site.index_title = _("Welcome to Invoice System Admin Dashboard")
\ No newline at end of file
+admin.site.index_title = _("Welcome to Invoice System Admin Dashboard")
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    """
+    API tokens, created with the create_api_token command (the key is only
+    shown then); deleting a token revokes it
+    """
+    list_display = ('name', 'user', 'created_date')
+    search_fields = ('name', 'user__username')
+    list_select_related = ('user',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
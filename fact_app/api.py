@@ -1,26 +1,87 @@
 from __future__ import annotations
 
-from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+import datetime
+import json
+import logging
+import re
+
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.views.decorators.http import require_http_methods
+from redis import RedisError
+
+from .archive import get_invoice_or_archived
+from .audit import AUDIT_DEFAULT_LIMIT, AUDIT_MAX_LIMIT, audit_entries
+from .changes import CHANGES_DEFAULT_LIMIT, CHANGES_MAX_LIMIT, get_changes
+from .creation import (
+    CREATE_BATCH_MAX, IDEMPOTENCY_KEY_MAX_LENGTH, IDEMPOTENCY_PENDING, claim_idempotency_key, create_invoices,
+    parse_invoice_payload, release_idempotency_key, request_fingerprint, store_idempotent_response,
+)
+from .decorators import api_login_required
+from .delivery import queue_invoice_deliveries
+from .events import EVENTS_DEFAULT_WAIT, EVENTS_MAX_WAIT, EVENTS_RETRY_AFTER, event_waiter, get_event_bus
+from .fx import convert
+from .models import Invoice, Customer, currency_code_validator
+from .payments import STATEMENT_MAX_LINES, parse_statement_line, reconcile_statement, record_payment
+from .utils import BULK_MAX_IDS, bulk_delete_invoices, bulk_update_invoices, invoices_for_user
+from .lines import get_invoice_lines, use_compact_articles
+from .listing import LISTING_DEFAULT_LIMIT, LISTING_MAX_LIMIT, customer_invoice_page
+from .money import annotate_totals, format_cents, get_base_currency
+from .reports import revenue_series
+from .statements import (
+    Statement, default_statement_currency, get_or_render_statement_pdf, iter_statement_csv, statement_currencies,
+)
 
-from .models import Invoice, Customer
+logger = logging.getLogger(__name__)
 
 
-def _invoice_to_dict(inv: Invoice) -> dict:
+def _invoice_to_dict(inv: Invoice, total=None) -> dict:
+    if total is None:
+        total = inv.get_total
+    # Rates are memoized per request: one query per currency in a list
+    total_base = None
+    if inv.invoice_date_time:
+        total_base = convert(total, inv.currency, timezone.localdate(inv.invoice_date_time))
     return {
         "id": inv.id,
+        "number": inv.reference,
         "customer_id": inv.customer_id,
         "customer_name": inv.customer.name,
         "invoice_date_time": inv.invoice_date_time.isoformat() if inv.invoice_date_time else None,
-        "total": str(inv.get_total),
+        "total": str(total),
+        "currency": inv.currency,
+        "total_base": str(total_base) if total_base is not None else None,
         "paid": inv.paid,
+        "amount_paid": str(inv.amount_paid),
+        "adjustment": str(inv.adjustment),
         "invoice_type": inv.invoice_type,
         "invoice_type_display": inv.get_invoice_type_display() if inv.invoice_type else "",
         "comments": inv.comments,
     }
 
 
+def _article_to_dict(a) -> dict:
+    return {
+        "id": a.id,
+        "name": a.name,
+        "quantity": a.quantity,
+        "unit_price": str(a.unit_price),
+        "discount_bp": a.discount_bp,
+        "tax_rate_bp": a.tax_rate_bp,
+        "total": str(a.get_total),
+    }
+
+
+def _pricing_to_dict(pricing) -> dict:
+    payload = {name: str(amount) for name, amount in pricing.amounts().items()}
+    payload["taxes"] = [
+        {"tax_rate_bp": rate, "tax": format_cents(tax)} for rate, tax in pricing.tax_by_rate.items()
+    ]
+    return payload
+
+
 def _customer_to_dict(c: Customer) -> dict:
     return {
         "id": c.id,
@@ -33,46 +94,368 @@ def _customer_to_dict(c: Customer) -> dict:
         "city": c.city,
         "zip_code": c.zip_code,
         "created_date": c.created_date.isoformat() if c.created_date else None,
+        "invoice_count": c.invoice_count,
+        "paid_invoice_count": c.paid_invoice_count,
+        "currency": get_base_currency(),
+        "total_billed": str(c.total_billed),
+        "total_outstanding": str(c.total_outstanding),
+        "last_invoice_date": c.last_invoice_date.isoformat() if c.last_invoice_date else None,
     }
 
 
-@login_required
-@require_http_methods(["GET"])
+def _error(message: str, status: int = 400) -> JsonResponse:
+    return JsonResponse({"error": message}, status=status)
+
+
+def _parse_json(request) -> dict:
+    """Decode a JSON object request body, raising ValueError when invalid"""
+    try:
+        payload = json.loads(request.body or b"{}")
+    except (TypeError, ValueError):
+        raise ValueError("Request body must be valid JSON.")
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object.")
+    return payload
+
+
+def _parse_ids(payload: dict) -> list:
+    """Return the de-duplicated integer IDs listed in payload['ids']"""
+    ids = payload.get("ids")
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("'ids' must be a non-empty list of invoice IDs.")
+    if len(ids) > BULK_MAX_IDS:
+        raise ValueError(f"At most {BULK_MAX_IDS} IDs can be sent per request.")
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError("'ids' must only contain integers.")
+    return list(dict.fromkeys(ids))
+
+
+def _parse_comments(payload: dict) -> str:
+    comments = payload.get("comments")
+    if not isinstance(comments, str):
+        raise ValueError("'comments' must be a string.")
+    if len(comments) > Invoice._meta.get_field("comments").max_length:
+        raise ValueError("'comments' is too long.")
+    return comments
+
+
+def _bulk_response(results: dict) -> JsonResponse:
+    counts = {}
+    for status in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    return JsonResponse({
+        "results": [{"id": pk, "status": status} for pk, status in results.items()],
+        "counts": counts,
+    })
+
+
+def _created_invoice_dict(invoice, articles) -> dict:
+    payload = _invoice_to_dict(invoice, total=invoice.total)
+    payload["articles"] = [_article_to_dict(a) for a in articles]
+    return payload
+
+
+def _create_invoices_response(request, parse, respond):
+    """
+    Create invoices from the request body, honouring an Idempotency-Key header:
+    a retry with the same key and body replays the first response instead of
+    creating the invoices again.
+
+    Args:
+        parse: payload -> list of parse_invoice_payload() results (raises ValueError)
+        respond: list of (invoice, articles) -> response body
+    """
+    key = request.headers.get("Idempotency-Key")
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        return _error(f"'Idempotency-Key' must have 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters.")
+    fingerprint = request_fingerprint(request.body)
+    if key:
+        entry = claim_idempotency_key(request.user, key)
+        if entry == IDEMPOTENCY_PENDING:
+            return _error("A request with this Idempotency-Key is still in progress.", 409)
+        if entry is not None:
+            if entry["fingerprint"] != fingerprint:
+                return _error("This Idempotency-Key was already used for a different request.", 422)
+            response = HttpResponse(entry["body"], status=entry["status"], content_type="application/json")
+            response["Idempotent-Replayed"] = "true"
+            return response
+
+    try:
+        created = create_invoices(request.user, parse(_parse_json(request)))
+    except ValueError as exc:
+        if key:
+            release_idempotency_key(request.user, key)
+        return _error(str(exc))
+    except Exception:
+        if key:
+            release_idempotency_key(request.user, key)
+        raise
+    body = respond(created)
+    if key:
+        store_idempotent_response(request.user, key, fingerprint, 201, body)
+    return JsonResponse(body, status=201)
+
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
 def invoices_list(request):
+    if request.method == "POST":
+        # Create one invoice with its articles (see fact_app.creation.parse_invoice_payload)
+        return _create_invoices_response(
+            request,
+            lambda payload: [parse_invoice_payload(payload)],
+            lambda created: {"invoice": _created_invoice_dict(*created[0])},
+        )
+
     q = (request.GET.get("q") or "").strip()
 
     qs = Invoice.objects.select_related("customer").order_by("-invoice_date_time")
+    # Optional filters matching the composite/partial indexes on Invoice
+    paid = request.GET.get("paid")
+    if paid in ("true", "false"):
+        qs = qs.filter(paid=paid == "true")
+    customer_id = request.GET.get("customer")
+    if customer_id:
+        if not customer_id.isdigit():
+            return _error("'customer' must be an integer.")
+        qs = qs.filter(customer_id=int(customer_id))
     if q:
         qs = qs.filter(customer__name__icontains=q) | qs.filter(id__icontains=q)
 
-    data = [_invoice_to_dict(i) for i in qs[:200]]
+    data = [_invoice_to_dict(i) for i in annotate_totals(qs)[:200]]
     return JsonResponse({"results": data})
 
 
-@login_required
-@require_http_methods(["GET"])
+def _invoice_detail_payload(pk: int) -> dict:
+    qs = Invoice.objects.select_related("customer")
+    if not use_compact_articles():
+        qs = qs.prefetch_related("articles")
+    inv = get_invoice_or_archived(pk, qs)
+    articles, pricing = get_invoice_lines(inv)
+    payload = _invoice_to_dict(inv, total=pricing.amounts()["total"])
+    payload["pricing"] = _pricing_to_dict(pricing)
+    payload["archived"] = inv.is_archived
+    payload["articles"] = [_article_to_dict(a) for a in articles]
+    return payload
+
+
+@api_login_required
+@require_http_methods(["GET", "PATCH"])
 def invoice_detail(request, pk: int):
-    inv = Invoice.objects.select_related("customer").prefetch_related("articles").get(pk=pk)
-    payload = _invoice_to_dict(inv)
-    payload["articles"] = [
-        {
-            "id": a.id,
-            "name": a.name,
-            "quantity": a.quantity,
-            "unit_price": str(a.unit_price),
-            "total": str(a.get_total),
-        }
-        for a in inv.articles.all()
-    ]
-    return JsonResponse(payload)
+    if request.method == "PATCH":
+        inv = get_object_or_404(invoices_for_user(request.user), pk=pk)
+        try:
+            payload = _parse_json(request)
+            update_fields = []
+            if "paid" in payload:
+                if not isinstance(payload["paid"], bool):
+                    raise ValueError("'paid' must be a boolean.")
+                inv.paid = payload["paid"]
+                update_fields.append("paid")
+            if "comments" in payload:
+                inv.comments = _parse_comments(payload)
+                update_fields.append("comments")
+            if "invoice_type" in payload:
+                if payload["invoice_type"] not in dict(Invoice.INVOICE_TYPE):
+                    raise ValueError("Unknown 'invoice_type'.")
+                inv.invoice_type = payload["invoice_type"]
+                update_fields.append("invoice_type")
+        except ValueError as exc:
+            return _error(str(exc))
+        if update_fields:
+            inv.save(update_fields=update_fields + ["last_updated_date"])
+    return JsonResponse(_invoice_detail_payload(pk))
+
+
+def _payment_to_dict(p) -> dict:
+    return {
+        "id": p.id,
+        "invoice_id": p.invoice_id,
+        "amount": str(p.amount),
+        "currency": p.currency,
+        "received_on": p.received_on.isoformat(),
+        "reference": p.reference,
+        "match": p.match,
+        "batch_id": p.batch_id,
+    }
+
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def invoice_payments(request, pk: int):
+    """Payments of an invoice; POST {"amount", "date", "reference"} records a (partial) payment"""
+    inv = get_object_or_404(invoices_for_user(request.user), pk=pk)
+    if request.method == "POST":
+        try:
+            line = parse_statement_line(_parse_json(request))
+        except ValueError as exc:
+            return _error(f"Invalid payment: {exc}.")
+        payment = record_payment(request.user, inv, line.amount, line.received_on, line.reference)
+        return JsonResponse({"payment": _payment_to_dict(payment)}, status=201)
+    return JsonResponse({"results": [_payment_to_dict(p) for p in inv.payments.order_by("received_on", "id")]})
+
+
+@api_login_required
+@require_http_methods(["POST"])
+def payments_reconcile(request):
+    """
+    Reconcile statement lines against the open invoices in the statement currency:
+    {"name": "...", "currency": "XAF", "lines": [{"amount": "120.00", "reference": "...", "date": "2026-01-31"}]}
+    """
+    try:
+        payload = _parse_json(request)
+        lines = payload.get("lines")
+        if not isinstance(lines, list) or not lines:
+            raise ValueError("'lines' must be a non-empty list of statement lines.")
+        if len(lines) > STATEMENT_MAX_LINES:
+            raise ValueError(f"At most {STATEMENT_MAX_LINES} lines can be sent per request.")
+        name = payload.get("name") or ""
+        if not isinstance(name, str):
+            raise ValueError("'name' must be a string.")
+        currency = payload.get("currency") or get_base_currency()
+        if not isinstance(currency, str) or not currency_code_validator.regex.match(currency.upper()):
+            raise ValueError("'currency' must be an ISO 4217 currency code.")
+        parsed = []
+        for position, line in enumerate(lines):
+            try:
+                parsed.append(parse_statement_line(line))
+            except ValueError as exc:
+                raise ValueError(f"lines[{position}]: {exc}.")
+    except ValueError as exc:
+        return _error(str(exc))
+    # Only the invoices the user may modify are matched
+    batch = reconcile_statement(request.user, parsed, name, currency.upper(), invoices_for_user(request.user))
+    return JsonResponse({
+        "batch_id": batch.id,
+        "currency": batch.currency,
+        "line_count": batch.line_count,
+        "matched_count": batch.matched_count,
+        "total_amount": str(batch.total_amount),
+        "matched_amount": str(batch.matched_amount),
+        "paid_invoice_ids": batch.newly_paid,
+    }, status=201)
+
+
+def _parse_invoice_batch(payload: dict) -> list:
+    invoices = payload.get("invoices")
+    if not isinstance(invoices, list) or not invoices:
+        raise ValueError("'invoices' must be a non-empty list of invoices.")
+    if len(invoices) > CREATE_BATCH_MAX:
+        raise ValueError(f"At most {CREATE_BATCH_MAX} invoices can be sent per request.")
+    parsed = []
+    for position, invoice in enumerate(invoices):
+        try:
+            parsed.append(parse_invoice_payload(invoice))
+        except ValueError as exc:
+            raise ValueError(f"invoices[{position}]: {exc}")
+    return parsed
+
+
+@api_login_required
+@require_http_methods(["POST"])
+def invoices_batch_create(request):
+    """Create many invoices in one transaction: {"invoices": [...]}; all or nothing"""
+    return _create_invoices_response(
+        request,
+        _parse_invoice_batch,
+        lambda created: {"invoices": [_created_invoice_dict(*item) for item in created]},
+    )
+
+
+@api_login_required
+@require_http_methods(["POST"])
+def invoices_bulk_status(request):
+    """Mark many invoices as paid or unpaid: {"ids": [...], "paid": true}"""
+    try:
+        payload = _parse_json(request)
+        ids = _parse_ids(payload)
+        if not isinstance(payload.get("paid"), bool):
+            raise ValueError("'paid' must be a boolean.")
+    except ValueError as exc:
+        return _error(str(exc))
+    return _bulk_response(bulk_update_invoices(request.user, ids, paid=payload["paid"]))
+
 
+@api_login_required
+@require_http_methods(["POST"])
+def invoices_bulk_comment(request):
+    """Set the same comment on many invoices: {"ids": [...], "comments": "..."}"""
+    try:
+        payload = _parse_json(request)
+        ids = _parse_ids(payload)
+        comments = _parse_comments(payload)
+    except ValueError as exc:
+        return _error(str(exc))
+    return _bulk_response(bulk_update_invoices(request.user, ids, comments=comments))
 
-@login_required
+
+@api_login_required
+@require_http_methods(["POST"])
+def invoices_bulk_delete(request):
+    """Delete many invoices with their articles: {"ids": [...]}"""
+    try:
+        ids = _parse_ids(_parse_json(request))
+    except ValueError as exc:
+        return _error(str(exc))
+    return _bulk_response(bulk_delete_invoices(request.user, ids))
+
+
+@api_login_required
+@require_http_methods(["POST"])
+def invoices_bulk_send(request):
+    """Email many invoices to their customers: {"ids": [...]}; sending is queued"""
+    try:
+        ids = _parse_ids(_parse_json(request))
+    except ValueError as exc:
+        return _error(str(exc))
+    results = dict.fromkeys(ids, "not_found")
+    results.update(queue_invoice_deliveries(invoices_for_user(request.user).filter(id__in=ids), request.user))
+    return _bulk_response(results)
+
+
+def _delivery_to_dict(d) -> dict:
+    return {
+        "id": d.id,
+        "email": d.email,
+        "status": d.status,
+        "attempts": d.attempts,
+        "error": d.error,
+        "created_at": d.created_at.isoformat(),
+        "sent_at": _isoformat(d.sent_at),
+    }
+
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def invoice_deliveries(request, pk: int):
+    """Email deliveries of an invoice, newest first; POST queues a new one"""
+    inv = get_object_or_404(invoices_for_user(request.user), pk=pk)
+    status = 200
+    if request.method == "POST":
+        result = queue_invoice_deliveries(Invoice.objects.filter(pk=inv.pk), request.user)[inv.pk]
+        if result == "no_email":
+            return _error("The customer has no email address.")
+        status = 201 if result == "queued" else 200
+    deliveries = inv.deliveries.order_by("-created_at", "-id")[:50]
+    return JsonResponse({"results": [_delivery_to_dict(d) for d in deliveries]}, status=status)
+
+
+CUSTOMER_ORDERINGS = {
+    "recent": ("-created_date",),
+    "revenue": ("-total_billed", "id"),
+}
+
+
+@api_login_required
 @require_http_methods(["GET"])
 def customers_list(request):
     q = (request.GET.get("q") or "").strip()
 
-    qs = Customer.objects.order_by("-created_date")
+    # ?ordering=revenue reads customer_revenue_idx instead of sorting
+    ordering = CUSTOMER_ORDERINGS.get(request.GET.get("ordering") or "recent")
+    if ordering is None:
+        return _error("Unknown 'ordering'.")
+    qs = Customer.objects.order_by(*ordering)
     if q:
         qs = qs.filter(name__icontains=q) | qs.filter(email__icontains=q) | qs.filter(phone__icontains=q)
 
@@ -80,8 +463,323 @@ def customers_list(request):
     return JsonResponse({"results": data})
 
 
-@login_required
+@api_login_required
 @require_http_methods(["GET"])
 def customer_detail(request, pk: int):
     c = Customer.objects.get(pk=pk)
     return JsonResponse(_customer_to_dict(c))
+
+
+@api_login_required
+@require_http_methods(["GET"])
+def customer_invoices(request, pk: int):
+    """
+    A customer's invoices, newest first, with keyset pagination:
+    ?after=<cursor> (from the previous page), ?limit=, ?paid=true|false,
+    ?invoice_type=, ?start=&end= (inclusive dates)
+    """
+    customer = get_object_or_404(Customer, pk=pk)
+    try:
+        limit = int(request.GET.get("limit") or LISTING_DEFAULT_LIMIT)
+        if not 1 <= limit <= LISTING_MAX_LIMIT:
+            raise ValueError
+    except ValueError:
+        return _error(f"'limit' must be an integer between 1 and {LISTING_MAX_LIMIT}.")
+    try:
+        paid = request.GET.get("paid")
+        if paid not in (None, "", "true", "false"):
+            raise ValueError("'paid' must be true or false.")
+        invoice_type = request.GET.get("invoice_type") or None
+        if invoice_type is not None and invoice_type not in dict(Invoice.INVOICE_TYPE):
+            raise ValueError("Unknown 'invoice_type'.")
+        page = customer_invoice_page(
+            customer.pk,
+            after=request.GET.get("after") or None,
+            limit=limit,
+            paid=None if not paid else paid == "true",
+            invoice_type=invoice_type,
+            start=_parse_report_date(request, "start", None),
+            end=_parse_report_date(request, "end", None),
+        )
+    except ValueError as exc:
+        return _error(str(exc))
+
+    types = dict(Invoice.INVOICE_TYPE)
+    return JsonResponse({
+        "customer": _customer_to_dict(customer),
+        "results": [
+            {
+                "id": row["id"],
+                "number": row["number"] or f"INV-{row['id']:05d}",
+                "invoice_date_time": _isoformat(row["invoice_date_time"]),
+                "total": str(row["total"]),
+                "amount_paid": str(row["amount_paid"]),
+                "paid": row["paid"],
+                "invoice_type": row["invoice_type"],
+                "invoice_type_display": str(types.get(row["invoice_type"], "")),
+            }
+            for row in page["invoices"]
+        ],
+        "cursor": page["cursor"],
+        "has_more": page["has_more"],
+    })
+
+
+@api_login_required
+@require_http_methods(["GET"])
+def customer_statement(request, pk: int):
+    """
+    Account statement of a customer: ?start=&end= (inclusive dates, default
+    the current month), ?format=json|csv|pdf (CSV is streamed), ?currency=
+    (default: the base currency, or the customer's only currency)
+    """
+    customer = get_object_or_404(Customer, pk=pk)
+    try:
+        end = _parse_report_date(request, "end", timezone.localdate())
+        start = _parse_report_date(request, "start", end.replace(day=1))
+        if start > end:
+            raise ValueError("'start' must not be after 'end'.")
+        output = request.GET.get("format") or "json"
+        if output not in ("json", "csv", "pdf"):
+            raise ValueError("'format' must be json, csv or pdf.")
+        currencies = statement_currencies(customer.pk)
+        currency = (request.GET.get("currency") or "").upper() or default_statement_currency(currencies)
+        if not currency_code_validator.regex.match(currency):
+            raise ValueError("'currency' must be an ISO 4217 currency code.")
+    except ValueError as exc:
+        return _error(str(exc))
+
+    statement = Statement(customer, start, end, currency)
+    filename = f"statement_{customer.pk}_{currency}_{start.isoformat()}_{end.isoformat()}"
+    if output == "csv":
+        response = StreamingHttpResponse(iter_statement_csv(statement), content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+        return response
+    if output == "pdf":
+        try:
+            pdf = get_or_render_statement_pdf(statement)
+        except OSError as exc:
+            logger.error("Statement PDF failed for customer %s: %s", pk, exc)
+            return _error("The statement PDF could not be generated.", status=503)
+        response = HttpResponse(pdf, content_type="application/pdf")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.pdf"'
+        return response
+
+    entries = [
+        {
+            "date": entry.day.isoformat(),
+            "type": entry.kind,
+            "id": entry.id,
+            "reference": entry.reference,
+            "description": entry.description,
+            "debit": str(entry.debit) if entry.debit is not None else None,
+            "credit": str(entry.credit) if entry.credit is not None else None,
+            "balance": str(entry.balance),
+        }
+        for entry in statement.entries()
+    ]
+    return JsonResponse({
+        "customer_id": customer.pk,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "currency": currency,
+        "currencies": currencies,
+        "opening_balance": str(statement.opening_balance),
+        "closing_balance": entries[-1]["balance"] if entries else str(statement.opening_balance),
+        "entries": entries,
+    })
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+@api_login_required
+@require_http_methods(["GET"])
+def changes_feed(request):
+    """
+    Incremental sync: rows changed since ?since=<cursor> (everything when omitted).
+    Call again with the returned cursor until has_more is false.
+    """
+    try:
+        limit = int(request.GET.get("limit") or CHANGES_DEFAULT_LIMIT)
+        if not 1 <= limit <= CHANGES_MAX_LIMIT:
+            raise ValueError
+    except ValueError:
+        return _error(f"'limit' must be an integer between 1 and {CHANGES_MAX_LIMIT}.")
+    try:
+        changes = get_changes(request.GET.get("since") or None, limit=limit)
+    except ValueError as exc:
+        return _error(str(exc))
+
+    return JsonResponse({
+        "customers": [
+            dict(_customer_to_dict(c), updated_date=_isoformat(c.updated_date))
+            for c in changes["customers"]
+        ],
+        "invoices": [
+            dict(_invoice_to_dict(i), last_updated_date=_isoformat(i.last_updated_date))
+            for i in changes["invoices"]
+        ],
+        "articles": [
+            dict(_article_to_dict(a), invoice_id=a.invoice_id, updated_at=_isoformat(a.updated_at))
+            for a in changes["articles"]
+        ],
+        "deleted": [
+            {"type": t.object_type, "id": t.object_id, "action": t.action, "deleted_at": _isoformat(t.deleted_at)}
+            for t in changes["deleted"]
+        ],
+        "cursor": changes["cursor"],
+        "has_more": changes["has_more"],
+    })
+
+
+@api_login_required
+@require_http_methods(["GET"])
+def audit_log(request):
+    """
+    Audit trail, newest first, with keyset pagination: ?object=invoice:12
+    (or ?object=invoice), ?user=<id>, ?start=&end= (inclusive dates),
+    ?after=<cursor>, ?limit=. Only superusers see the changes of other users.
+    """
+    try:
+        limit = int(request.GET.get("limit") or AUDIT_DEFAULT_LIMIT)
+        if not 1 <= limit <= AUDIT_MAX_LIMIT:
+            raise ValueError
+    except ValueError:
+        return _error(f"'limit' must be an integer between 1 and {AUDIT_MAX_LIMIT}.")
+    try:
+        object_type, _, object_id = (request.GET.get("object") or "").partition(":")
+        if object_id and not object_id.isdigit():
+            raise ValueError("'object' must be <type> or <type>:<id>.")
+        user_id = request.GET.get("user") or None
+        if user_id is not None and not user_id.isdigit():
+            raise ValueError("'user' must be a user ID.")
+        if not request.user.is_superuser:
+            user_id = request.user.pk
+        page = audit_entries(
+            object_type=object_type or None,
+            object_id=int(object_id) if object_id else None,
+            user_id=int(user_id) if user_id is not None else None,
+            start=_parse_report_date(request, "start", None),
+            end=_parse_report_date(request, "end", None),
+            after=request.GET.get("after") or None,
+            limit=limit,
+        )
+    except ValueError as exc:
+        return _error(str(exc))
+
+    return JsonResponse({
+        "results": [
+            {
+                "id": row["id"],
+                "object_type": row["object_type"],
+                "object_id": row["object_id"],
+                "action": row["action"],
+                "changes": row["changes"],
+                "user_id": row["user_id"],
+                "username": row["username"],
+                "created_at": _isoformat(row["created_at"]),
+            }
+            for row in page["entries"]
+        ],
+        "cursor": page["cursor"],
+        "has_more": page["has_more"],
+    })
+
+
+EVENT_CURSOR_RE = re.compile(r"^\d+(-\d+)?$")
+
+
+@api_login_required
+@require_http_methods(["GET"])
+def invoice_events(request):
+    """
+    Long-poll for invoice changes: waits up to ?timeout= seconds for events
+    published after ?after=<cursor> (from now on when omitted).
+
+    Returns {"events": [...], "cursor": ..., "reset": bool}; when reset is true,
+    events were missed and the client should reload its invoice list. When
+    too many polls already wait in this process, answers at once with
+    "retry_after" (seconds) before the next poll.
+    """
+    after = request.GET.get("after") or None
+    if after is not None and not EVENT_CURSOR_RE.match(after):
+        return _error("Invalid cursor.")
+    try:
+        timeout = float(request.GET.get("timeout") or EVENTS_DEFAULT_WAIT)
+    except ValueError:
+        return _error("'timeout' must be a number of seconds.")
+    timeout = min(max(timeout, 0), EVENTS_MAX_WAIT)
+
+    bus = get_event_bus()
+    with event_waiter() as waiting:
+        try:
+            events, cursor, reset = bus.read(after or bus.last_id(), timeout if waiting else 0)
+        except RedisError as exc:
+            logger.warning("Invoice events unavailable: %s", exc)
+            return _error("Invoice events are temporarily unavailable.", status=503)
+    data = {"events": events, "cursor": cursor, "reset": reset}
+    if not waiting:
+        data["retry_after"] = EVENTS_RETRY_AFTER
+    response = JsonResponse(data)
+    if not waiting:
+        response["Retry-After"] = str(EVENTS_RETRY_AFTER)
+    return response
+
+
+def _parse_report_date(request, name, default):
+    value = request.GET.get(name)
+    if not value:
+        return default
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(f"'{name}' must be a date (YYYY-MM-DD).")
+    return day
+
+
+@api_login_required
+@require_http_methods(["GET"])
+def revenue_report(request):
+    """
+    Revenue per period, read from the DailyRevenue rollups:
+    ?start=&end= (inclusive dates, default the last 30 days),
+    ?granularity=day|week|month, optional ?invoice_type= and ?paid=true|false
+    """
+    try:
+        end = _parse_report_date(request, "end", timezone.localdate())
+        start = _parse_report_date(request, "start", end - datetime.timedelta(days=29))
+        if start > end:
+            raise ValueError("'start' must not be after 'end'.")
+        invoice_type = request.GET.get("invoice_type") or None
+        if invoice_type is not None and invoice_type not in dict(Invoice.INVOICE_TYPE):
+            raise ValueError("Unknown 'invoice_type'.")
+        paid = request.GET.get("paid")
+        if paid not in (None, "", "true", "false"):
+            raise ValueError("'paid' must be true or false.")
+        granularity = request.GET.get("granularity") or "day"
+        rows = revenue_series(
+            start, end, granularity,
+            invoice_type=invoice_type,
+            paid=None if not paid else paid == "true",
+        )
+    except ValueError as exc:
+        return _error(str(exc))
+
+    return JsonResponse({
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "granularity": granularity,
+        "currency": get_base_currency(),
+        "results": [
+            {
+                "period": row["period"].isoformat(),
+                "invoice_type": row["invoice_type"],
+                "invoice_count": row["invoice_count"],
+                "total": str(row["total"]),
+                "paid_total": str(row["paid_total"]),
+                "unpaid_total": str(row["unpaid_total"]),
+            }
+            for row in rows
+        ],
+    })
@@ -4,7 +4,21 @@ from . import api
 
 urlpatterns = [
     path('invoices/', api.invoices_list, name='api-invoices-list'),
+    path('invoices/events/', api.invoice_events, name='api-invoice-events'),
     path('invoices/<int:pk>/', api.invoice_detail, name='api-invoice-detail'),
+    path('invoices/<int:pk>/payments/', api.invoice_payments, name='api-invoice-payments'),
+    path('invoices/<int:pk>/deliveries/', api.invoice_deliveries, name='api-invoice-deliveries'),
+    path('invoices/batch/', api.invoices_batch_create, name='api-invoices-batch-create'),
+    path('invoices/bulk/status/', api.invoices_bulk_status, name='api-invoices-bulk-status'),
+    path('invoices/bulk/comment/', api.invoices_bulk_comment, name='api-invoices-bulk-comment'),
+    path('invoices/bulk/delete/', api.invoices_bulk_delete, name='api-invoices-bulk-delete'),
+    path('invoices/bulk/send/', api.invoices_bulk_send, name='api-invoices-bulk-send'),
+    path('payments/reconcile/', api.payments_reconcile, name='api-payments-reconcile'),
+    path('reports/revenue/', api.revenue_report, name='api-revenue-report'),
+    path('changes/', api.changes_feed, name='api-changes'),
+    path('audit/', api.audit_log, name='api-audit'),
     path('customers/', api.customers_list, name='api-customers-list'),
     path('customers/<int:pk>/', api.customer_detail, name='api-customer-detail'),
+    path('customers/<int:pk>/invoices/', api.customer_invoices, name='api-customer-invoices'),
+    path('customers/<int:pk>/statement/', api.customer_statement, name='api-customer-statement'),
 ]
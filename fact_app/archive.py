@@ -0,0 +1,151 @@
+"""
+Invoice archiving
+Moves old paid invoices and their articles out of the hot Invoice/Article
+tables into ArchivedInvoice/ArchivedArticle, in small transactional batches.
+"""
+import datetime
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+
+from .audit import audit_suppressed
+from .changes import record_tombstones, tombstones_suppressed
+from .events import INVOICE_DELETED, invoice_events_suppressed, publish_invoice_event
+from .models import Article, ArchivedArticle, ArchivedInvoice, Invoice, Tombstone
+from .money import annotate_totals, from_cents
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+@contextmanager
+def invoices_archived():
+    """Invoices deleted inside this block are moved to the archive: their payments and deliveries stay"""
+    previous = getattr(_local, 'archiving', False)
+    _local.archiving = True
+    try:
+        yield
+    finally:
+        _local.archiving = previous
+
+
+def is_archiving():
+    """True inside invoices_archived()"""
+    return getattr(_local, 'archiving', False)
+
+
+def get_archive_cutoff():
+    """Paid invoices older than this datetime are archived"""
+    days = getattr(settings, 'INVOICE_ARCHIVE_AFTER_DAYS', 730)
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def archivable_invoices(cutoff=None):
+    """Invoices eligible for archiving"""
+    return Invoice.objects.filter(paid=True, invoice_date_time__lt=cutoff or get_archive_cutoff())
+
+
+@transaction.atomic
+def archive_invoice_batch(invoice_ids):
+    """
+    Copy a batch of invoices and their articles into the archive tables,
+    then delete them from the hot tables.
+
+    Returns:
+        Number of invoices archived
+    """
+    # Lock the rows first: FOR UPDATE cannot be combined with the GROUP BY of annotate_totals()
+    ids = list(
+        Invoice.objects.select_for_update().filter(id__in=invoice_ids, paid=True).values_list('id', flat=True)
+    )
+    if not ids:
+        return 0
+    invoices = annotate_totals(Invoice.objects.filter(id__in=ids)).order_by()
+    # No ignore_conflicts: a row already archived under one of these ids aborts the whole batch
+    ArchivedInvoice.objects.bulk_create([
+        ArchivedInvoice(
+            id=invoice.id,
+            customer_id=invoice.customer_id,
+            save_by_id=invoice.save_by_id,
+            invoice_date_time=invoice.invoice_date_time,
+            total=from_cents(invoice.articles_total_cents),
+            last_updated_date=invoice.last_updated_date,
+            paid=invoice.paid,
+            amount_paid=invoice.amount_paid,
+            adjustment=invoice.adjustment,
+            currency=invoice.currency,
+            invoice_type=invoice.invoice_type,
+            comments=invoice.comments,
+            number=invoice.number,
+        )
+        for invoice in invoices
+    ])
+    articles = [
+        ArchivedArticle(invoice_id=invoice_id, **values)
+        for invoice_id, values in (
+            (row.pop('invoice_id'), row)
+            for row in Article.objects.filter(invoice_id__in=ids).values(
+                'id', 'invoice_id', 'name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp', 'created_at'
+            )
+        )
+    ]
+    ArchivedArticle.objects.bulk_create(articles, batch_size=2000)
+    # Archived invoices keep their history: moving them is not a deletion
+    with tombstones_suppressed(), invoice_events_suppressed(), audit_suppressed(), invoices_archived():
+        Invoice.objects.filter(id__in=ids).delete()
+    publish_invoice_event(INVOICE_DELETED, ids)
+    record_tombstones('invoice', ids, Tombstone.ACTION_ARCHIVED)
+    record_tombstones('article', [article.id for article in articles], Tombstone.ACTION_ARCHIVED)
+    return len(ids)
+
+
+def archive_paid_invoices(cutoff=None, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """
+    Archive paid invoices older than cutoff, batch by batch.
+
+    Each batch commits on its own, so the job can be interrupted and re-run.
+
+    Args:
+        cutoff: Archive invoices dated before this (default: INVOICE_ARCHIVE_AFTER_DAYS ago)
+        batch_size: Invoices moved per transaction
+        max_batches: Stop after this many batches (default: until done)
+
+    Returns:
+        Total number of invoices archived
+    """
+    cutoff = cutoff or get_archive_cutoff()
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(archivable_invoices(cutoff).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        archived += archive_invoice_batch(ids)
+        batches += 1
+    if archived:
+        logger.info("Archived %d paid invoices dated before %s", archived, cutoff.isoformat())
+    return archived
+
+
+def get_invoice_or_archived(pk, queryset=None):
+    """
+    Read-through lookup: the live invoice if it exists, otherwise its archived copy.
+
+    Raises:
+        Http404: If the invoice is neither live nor archived
+    """
+    if queryset is None:
+        queryset = Invoice.objects.select_related('customer', 'save_by')
+    invoice = queryset.filter(pk=pk).first()
+    if invoice is None:
+        invoice = ArchivedInvoice.objects.select_related('customer', 'save_by').filter(pk=pk).first()
+    if invoice is None:
+        raise Http404("No invoice found matching the query")
+    return invoice
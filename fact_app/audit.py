@@ -0,0 +1,267 @@
+"""
+Audit trail
+Every change to a customer, invoice or article is kept as an AuditEntry with
+the old and new value of each audited field ({field: [old, new]}).
+
+Entries are recorded from the model signals and from the bulk helpers that
+bypass them (bulk_create(), QuerySet.update()). They are only kept once their
+transaction commits, so a rolled back change leaves no entry. A request that
+may write (AuditMiddleware, unsafe methods) runs in one transaction whose
+entries are buffered and written with a single bulk INSERT by its last
+on_commit callback: auditing costs at most one INSERT per request, whatever
+the number of rows changed, and a failed write fails the request. Elsewhere
+(safe requests, Celery tasks, commands), entries are written as each
+transaction commits.
+
+The previous values of a saved row are read by one query limited to the
+audited fields, and skipped when save(update_fields=...) touches none of them.
+"""
+import datetime
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Q
+from django.utils import timezone
+
+from .listing import decode_page_cursor, encode_page_cursor
+from .models import Article, AuditEntry, Customer, Invoice
+
+AUDIT_DEFAULT_LIMIT = 100
+AUDIT_MAX_LIMIT = 1000
+
+# Fields whose changes are recorded. Derived and bookkeeping columns (totals,
+# rollups, dedupe keys, numbers, timestamps) are left out.
+AUDITED_FIELDS = {
+    Customer: ('name', 'email', 'phone', 'address', 'sex', 'age', 'city', 'zip_code'),
+    Invoice: ('customer', 'invoice_type', 'paid', 'adjustment', 'currency', 'comments'),
+    Article: ('invoice', 'name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp'),
+}
+OBJECT_TYPES = {model._meta.model_name: model for model in AUDITED_FIELDS}
+
+_local = threading.local()
+
+
+class AuditBuffer:
+    """Audit entries committed while serving a request, written together at the end"""
+
+    def __init__(self, user=None):
+        self.user = user
+        self.entries = []
+
+
+def _attribute(entries, user):
+    """Entries recorded without a user are attributed to the user of the buffer"""
+    if user is not None:
+        for entry in entries:
+            if entry.user_id is None:
+                entry.user = user
+    return entries
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+@contextmanager
+def audit_context(user=None):
+    """
+    Run the block in a transaction and write the entries it commits with one
+    INSERT, attributed to buffer.user (may be set inside the block). The write
+    is the last on_commit callback of the block and its errors propagate.
+    """
+    outer = getattr(_local, 'buffer', None)
+    buffer = _local.buffer = AuditBuffer(user)
+    try:
+        with transaction.atomic():
+            yield buffer
+            transaction.on_commit(partial(_flush, buffer, outer))
+    finally:
+        _local.buffer = outer
+
+
+def _flush(buffer, outer):
+    entries = _attribute(buffer.entries, buffer.user)
+    buffer.entries = []
+    if outer is not None:
+        outer.entries.extend(entries)
+    elif entries:
+        AuditEntry.objects.bulk_create(entries)
+
+
+@contextmanager
+def audit_suppressed():
+    """Changes inside this block are not audited (e.g. invoices moved to the archive)"""
+    previous = getattr(_local, 'suppressed', False)
+    _local.suppressed = True
+    try:
+        yield
+    finally:
+        _local.suppressed = previous
+
+
+def _committed(entries, buffer):
+    if buffer is not None:
+        buffer.entries.extend(entries)
+    else:
+        AuditEntry.objects.bulk_create(entries)
+
+
+def record(entries):
+    """Keep entries once the current transaction commits"""
+    if entries and not getattr(_local, 'suppressed', False):
+        transaction.on_commit(partial(_committed, entries, getattr(_local, 'buffer', None)))
+
+
+def _fields(model, names=None):
+    fields = [model._meta.get_field(name) for name in AUDITED_FIELDS[model]]
+    if names is not None:
+        fields = [field for field in fields if field.name in names or field.attname in names]
+    return fields
+
+
+def _value(field, value):
+    # Values set from forms or payloads may not have their database type yet (e.g. '10.5' for a Decimal)
+    if value is None:
+        return None
+    value = field.to_python(value)
+    if isinstance(field, DecimalField):
+        # As stored: '12.5' reads back as 12.50
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+    return value
+
+
+def _entry(instance, action, changes):
+    return AuditEntry(object_type=instance._meta.model_name, object_id=instance.pk, action=action, changes=changes)
+
+
+def _values(instance, fields, old=False):
+    values = {field.attname: _value(field, getattr(instance, field.attname)) for field in fields}
+    return {name: [value, None] if old else [None, value] for name, value in values.items()}
+
+
+def remember_previous_values(instance, update_fields=None):
+    """
+    Read the stored audited values of an instance about to be saved (pre_save)
+
+    Returns:
+        Dictionary of attname -> stored value (empty for a new row or when
+        update_fields has no audited field)
+    """
+    instance.__dict__.pop('_audit_previous', None)
+    fields = _fields(type(instance), update_fields)
+    if instance._state.adding or instance.pk is None or not fields:
+        return {}
+    previous = type(instance).objects.filter(pk=instance.pk).values(*[field.attname for field in fields]).first()
+    instance._audit_previous = previous or {}
+    return instance._audit_previous
+
+
+def record_saved(instance, created):
+    """Record the creation of an instance, or the audited fields its save changed (post_save)"""
+    model = type(instance)
+    if created:
+        record([_entry(instance, AuditEntry.ACTION_CREATE, _values(instance, _fields(model)))])
+        return
+    previous = instance.__dict__.pop('_audit_previous', None)
+    if not previous:
+        return
+    changes = {}
+    for field in _fields(model, previous):
+        old, new = previous[field.attname], _value(field, getattr(instance, field.attname))
+        if old != new:
+            changes[field.attname] = [old, new]
+    if changes:
+        record([_entry(instance, AuditEntry.ACTION_UPDATE, changes)])
+
+
+def record_deleted(instance):
+    """Record the deletion of an instance with its last values (post_delete)"""
+    record([_entry(instance, AuditEntry.ACTION_DELETE, _values(instance, _fields(type(instance)), old=True))])
+
+
+def record_created(instances):
+    """Record rows inserted with bulk_create(), which sends no signals"""
+    record([
+        _entry(instance, AuditEntry.ACTION_CREATE, _values(instance, _fields(type(instance))))
+        for instance in instances
+    ])
+
+
+def record_queryset_update(queryset, values):
+    """
+    Record QuerySet.update(**values) (plain values, no expressions), which
+    sends no signals. Call it before the update: the current values are read
+    with one query.
+    """
+    model = queryset.model
+    fields = _fields(model, values)
+    if not fields or getattr(_local, 'suppressed', False):
+        return
+    new_values = {field.attname: _value(field, values.get(field.name, values.get(field.attname))) for field in fields}
+    entries = []
+    for row in queryset.order_by().values('pk', *new_values):
+        changes = {name: [row[name], new] for name, new in new_values.items() if row[name] != new}
+        if changes:
+            entries.append(
+                AuditEntry(object_type=model._meta.model_name, object_id=row['pk'],
+                           action=AuditEntry.ACTION_UPDATE, changes=changes)
+            )
+    record(entries)
+
+
+def record_updates(model, ids, changes):
+    """Record the same known change ({attname: [old, new]}) on many rows, without reading them"""
+    record([
+        AuditEntry(object_type=model._meta.model_name, object_id=pk, action=AuditEntry.ACTION_UPDATE, changes=changes)
+        for pk in ids
+    ])
+
+
+def audit_entries(object_type=None, object_id=None, user_id=None, start=None, end=None, after=None,
+                  limit=AUDIT_DEFAULT_LIMIT):
+    """
+    A page of audit entries, newest first, with keyset pagination.
+
+    Args:
+        object_type, object_id: Only the history of these objects ('invoice', 12)
+        user_id: Only the changes made by this user
+        start, end: Only the changes made between these days (inclusive)
+        after: Cursor returned with the previous page (None for the first page)
+
+    Returns:
+        Dictionary with the entry rows (dicts), the next cursor and has_more
+
+    Raises:
+        ValueError: If the object type or the cursor is invalid
+    """
+    queryset = AuditEntry.objects.all()
+    if object_type is not None:
+        if object_type not in OBJECT_TYPES:
+            raise ValueError(f"Unknown object type: {object_type}.")
+        queryset = queryset.filter(object_type=object_type)
+    if object_id is not None:
+        queryset = queryset.filter(object_id=object_id)
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=_day_start(start))
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=_day_start(end + datetime.timedelta(days=1)))
+    if after:
+        timestamp, entry_id = decode_page_cursor(after)
+        queryset = queryset.filter(Q(created_at__lt=timestamp) | Q(created_at=timestamp, id__lt=entry_id))
+    rows = list(
+        queryset.order_by('-created_at', '-id')
+        .values('id', 'object_type', 'object_id', 'action', 'changes', 'user_id', 'created_at',
+                username=F('user__username'))[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'entries': rows,
+        'cursor': encode_page_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None,
+        'has_more': has_more,
+    }
@@ -0,0 +1,51 @@
+"""
+Authentication backend caching the user object and its permissions
+Saves the auth_user lookup (and permission queries) on every authenticated request
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_CACHE_KEY = 'fact_app:auth:user:%s'
+PERMISSIONS_CACHE_KEY = 'fact_app:auth:perms:%s'
+
+
+def get_user_cache_timeout():
+    """TTL in seconds for cached users and permissions"""
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 60)
+
+
+def invalidate_user_cache(user_id):
+    """
+    Drop cached user and permission data for a user.
+    Called from signals whenever the user, its groups or its permissions change.
+    """
+    cache.delete_many([USER_CACHE_KEY % user_id, PERMISSIONS_CACHE_KEY % user_id])
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend keeping users and their permission sets in the cache
+    for USER_CACHE_TIMEOUT seconds
+    """
+
+    def get_user(self, user_id):
+        key = USER_CACHE_KEY % user_id
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, get_user_cache_timeout())
+        return user
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = PERMISSIONS_CACHE_KEY % user_obj.pk
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, get_user_cache_timeout())
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,253 @@
+"""
+Change feed
+Lets the SPA and downstream sync fetch only the customers, invoices and
+articles changed (or deleted) since their last call, instead of re-pulling
+everything.
+
+Each stream is read in (timestamp, id) order from its own index and the
+client keeps its position in an opaque cursor. Rows are served once their
+timestamp is older than the settle delay; rows stamped by a transaction that
+commits later than that are re-stamped at commit time, so they cannot slip
+behind a cursor. Tombstones are kept TOMBSTONE_RETENTION_DAYS: a cursor
+read longer ago is refused and the client starts a full sync.
+"""
+import base64
+import binascii
+import datetime
+import json
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Article, Customer, Invoice, Tombstone
+from .money import sum_cents_expression, to_cents
+
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 2000
+# Rows re-stamped per UPDATE after a late commit
+RESTAMP_CHUNK_SIZE = 500
+# Tombstones deleted per statement when pruning
+TOMBSTONE_PRUNE_BATCH_SIZE = 5000
+
+# Stream name -> (model, timestamp field), in the order streams are read
+STREAMS = {
+    'customers': (Customer, 'updated_date'),
+    'invoices': (Invoice, 'last_updated_date'),
+    'articles': (Article, 'updated_at'),
+    'deleted': (Tombstone, 'deleted_at'),
+}
+
+# Model -> timestamp field
+STAMP_FIELDS = {model: field for model, field in STREAMS.values()}
+
+_local = threading.local()
+
+
+def get_settle_delay():
+    """
+    Rows stamped within this delay are not served yet: a transaction still
+    open may commit a row with a slightly older timestamp
+    """
+    return datetime.timedelta(seconds=getattr(settings, 'CHANGE_FEED_SETTLE_SECONDS', 2))
+
+
+def get_tombstone_cutoff():
+    """Tombstones (and cursors) older than this are pruned (refused)"""
+    return timezone.now() - datetime.timedelta(days=getattr(settings, 'TOMBSTONE_RETENTION_DAYS', 90))
+
+
+class _PendingStamps:
+    """Rows stamped for the change feed in the current transaction"""
+
+    def __init__(self):
+        self.ids = {}
+        self.oldest = None
+        self.flushed = False
+
+    def flush(self):
+        # Registered once per change: only the first call after commit does the work
+        if self.flushed:
+            return
+        self.flushed = True
+        # Committed well within the settle delay: no reader can have moved past these rows
+        if self.oldest is None or timezone.now() - self.oldest < get_settle_delay() / 2:
+            return
+        for model, ids in self.ids.items():
+            ids = sorted(ids)
+            for start in range(0, len(ids), RESTAMP_CHUNK_SIZE):
+                # Each chunk commits on its own, stamped when it runs
+                model.objects.filter(id__in=ids[start:start + RESTAMP_CHUNK_SIZE]).update(
+                    **{STAMP_FIELDS[model]: timezone.now()}
+                )
+
+
+def stamp_on_commit(model, ids, stamped_at):
+    """
+    Re-stamp these rows at commit time if their transaction commits too late
+    for the settle delay (long bulk updates, big imports)
+
+    Args:
+        model: Customer, Invoice, Article or Tombstone
+        ids: Primary keys of the rows stamped
+        stamped_at: Timestamp written in the transaction
+    """
+    if stamped_at is None:
+        return
+    pending = getattr(_local, 'stamps', None)
+    if pending is None or pending.flushed:
+        pending = _local.stamps = _PendingStamps()
+    pending.ids.setdefault(model, set()).update(ids)
+    if pending.oldest is None or stamped_at < pending.oldest:
+        pending.oldest = stamped_at
+    # A rolled back transaction leaves its rows here: they are re-stamped with the
+    # next transaction if it commits late (a harmless extra UPDATE).
+    # Outside a transaction the row is already committed: flush() runs now.
+    transaction.on_commit(pending.flush, robust=True)
+
+
+def encode_cursor(positions, read_at=None):
+    """Opaque cursor from {stream: (timestamp, id)} and the time of the read"""
+    data = {name: [ts.isoformat(), pk] for name, (ts, pk) in positions.items()}
+    if read_at is not None:
+        data['read_at'] = read_at.isoformat()
+    raw = json.dumps(data)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor()
+
+    Returns:
+        Tuple ({stream: (timestamp, id)}, read_at or None)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        read_at = data.pop('read_at', None)
+        if read_at is not None:
+            read_at = parse_datetime(read_at)
+            if read_at is None:
+                raise ValueError
+        positions = {}
+        for name, (ts, pk) in data.items():
+            timestamp = parse_datetime(ts)
+            if name not in STREAMS or timestamp is None or not isinstance(pk, int):
+                raise ValueError
+            positions[name] = (timestamp, pk)
+        return positions, read_at
+    except (binascii.Error, TypeError, ValueError, AttributeError):
+        raise ValueError("Invalid cursor.")
+
+
+def _attach_invoice_totals(invoices):
+    """Set articles_total_cents (lines and adjustment) on a page of invoices with a single aggregate query"""
+    totals = dict(
+        Article.objects.filter(invoice_id__in=[invoice.pk for invoice in invoices])
+        .order_by()
+        .values('invoice_id')
+        .annotate(total_cents=sum_cents_expression())
+        .values_list('invoice_id', 'total_cents')
+    )
+    for invoice in invoices:
+        invoice.articles_total_cents = totals.get(invoice.pk, 0) + to_cents(invoice.adjustment)
+
+
+def get_changes(cursor=None, limit=CHANGES_DEFAULT_LIMIT):
+    """
+    Rows changed since a cursor.
+
+    Args:
+        cursor: Value returned by a previous call (None for a full initial sync)
+        limit: Maximum number of rows per stream
+
+    Returns:
+        Dictionary with one list per stream, the next cursor, and has_more
+        (True when a stream was truncated and the client should call again)
+
+    Raises:
+        ValueError: If the cursor is malformed or older than the tombstones kept
+    """
+    positions, read_at = decode_cursor(cursor) if cursor else ({}, None)
+    if read_at is not None and read_at < get_tombstone_cutoff():
+        # The deletions since then may have been pruned
+        raise ValueError("Cursor expired: start a full sync.")
+    upper = timezone.now() - get_settle_delay()
+    changes = {'has_more': False}
+
+    for name, (model, field) in STREAMS.items():
+        queryset = model.objects.filter(**{f'{field}__lte': upper})
+        if name == 'invoices':
+            queryset = queryset.select_related('customer')
+        if name in positions:
+            timestamp, pk = positions[name]
+            queryset = queryset.filter(Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk}))
+        rows = list(queryset.order_by(field, 'id')[:limit + 1])
+        if len(rows) > limit:
+            rows = rows[:limit]
+            changes['has_more'] = True
+        if rows:
+            positions[name] = (getattr(rows[-1], field), rows[-1].pk)
+        if name == 'invoices' and rows:
+            _attach_invoice_totals(rows)
+        changes[name] = rows
+
+    changes['cursor'] = encode_cursor(positions, upper)
+    return changes
+
+
+@contextmanager
+def tombstones_suppressed():
+    """
+    Deletions inside this block do not record tombstones one by one:
+    the caller writes them in bulk with record_tombstones()
+    """
+    previous = getattr(_local, 'suppressed', False)
+    _local.suppressed = True
+    try:
+        yield
+    finally:
+        _local.suppressed = previous
+
+
+def record_deletion(instance):
+    """Record a tombstone for a deleted row (called from the post_delete receivers)"""
+    if not getattr(_local, 'suppressed', False):
+        tombstone = Tombstone.objects.create(object_type=instance._meta.model_name, object_id=instance.pk)
+        stamp_on_commit(Tombstone, [tombstone.pk], tombstone.deleted_at)
+
+
+def record_tombstones(object_type, ids, action=Tombstone.ACTION_DELETED):
+    """Write tombstones for many rows of one type"""
+    tombstones = Tombstone.objects.bulk_create(
+        [Tombstone(object_type=object_type, object_id=pk, action=action) for pk in ids],
+        batch_size=1000,
+    )
+    if tombstones:
+        stamp_on_commit(Tombstone, [tombstone.pk for tombstone in tombstones], tombstones[0].deleted_at)
+
+
+def prune_tombstones(cutoff=None, batch_size=TOMBSTONE_PRUNE_BATCH_SIZE):
+    """
+    Delete the tombstones older than cutoff (default: TOMBSTONE_RETENTION_DAYS
+    ago), batch by batch. Cursors older than that are refused by get_changes().
+
+    Returns:
+        Number of tombstones deleted
+    """
+    cutoff = cutoff or get_tombstone_cutoff()
+    deleted = 0
+    while True:
+        ids = list(Tombstone.objects.filter(deleted_at__lt=cutoff).order_by('deleted_at', 'id')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Tombstone.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,246 @@
+"""
+Invoice creation API support
+Plain validation of JSON invoice payloads (no Django forms), bulk insertion
+of invoices and their articles in one transaction, and Idempotency-Key
+handling so clients can safely retry a create.
+
+bulk_create() sends no signals: create_invoices() does what the Invoice
+signals would (numbering, rollups, live event, audit trail) for the whole batch
+at once.
+"""
+import hashlib
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .audit import record_created
+from .events import INVOICE_CREATED, publish_invoice_event
+from .models import Article, Customer, Invoice, currency_code_validator
+from .money import from_cents, get_base_currency, to_cents
+from .numbering import number_after_commit
+from .pricing import MAX_RATE_BP, price_rows
+from .rollups import mark_invoice_rows_dirty
+
+logger = logging.getLogger(__name__)
+
+CREATE_BATCH_MAX = 1000
+MAX_ARTICLES = 1000
+# Invoice.total and Article.unit_price have 12 digits, 2 of them decimals
+MAX_AMOUNT_CENTS = 10 ** 12 - 1
+
+IDEMPOTENCY_KEY_PREFIX = 'fact_app:idempotency:%s:%s'
+IDEMPOTENCY_PENDING = 'pending'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+_NAME_MAX_LENGTH = Article._meta.get_field('name').max_length
+_COMMENTS_MAX_LENGTH = Invoice._meta.get_field('comments').max_length
+_INVOICE_TYPES = dict(Invoice.INVOICE_TYPE)
+
+
+def _parse_amount(value, name):
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"{name} must be a decimal string or a number.")
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"{name} must be a decimal string or a number.")
+    if not amount.is_finite() or amount.as_tuple().exponent < -2:
+        raise ValueError(f"{name} must have at most 2 decimal places.")
+    if abs(to_cents(amount)) > MAX_AMOUNT_CENTS:
+        raise ValueError(f"{name} is too large.")
+    return amount
+
+
+def _parse_rate(data, name, where):
+    rate = data.get(name, 0)
+    if not isinstance(rate, int) or isinstance(rate, bool) or not 0 <= rate <= MAX_RATE_BP:
+        raise ValueError(f"{where}.{name} must be an integer number of basis points between 0 and {MAX_RATE_BP}.")
+    return rate
+
+
+def _parse_article(data, position):
+    where = f"articles[{position}]"
+    if not isinstance(data, dict):
+        raise ValueError(f"{where} must be an object.")
+    name = data.get('name')
+    if not isinstance(name, str) or not name.strip() or len(name) > _NAME_MAX_LENGTH:
+        raise ValueError(f"{where}.name must be a non-empty string of at most {_NAME_MAX_LENGTH} characters.")
+    quantity = data.get('quantity')
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise ValueError(f"{where}.quantity must be a positive integer.")
+    unit_price = _parse_amount(data.get('unit_price'), f"{where}.unit_price")
+    if unit_price < 0:
+        raise ValueError(f"{where}.unit_price must be positive.")
+    return (
+        name.strip(), quantity, unit_price,
+        _parse_rate(data, 'discount_bp', where), _parse_rate(data, 'tax_rate_bp', where),
+    )
+
+
+def parse_invoice_payload(data):
+    """
+    Validate one invoice:
+    {"customer_id": 1, "invoice_type": "I", "paid": false, "currency": "XAF", "comments": "...", "adjustment": "-5.00",
+     "articles": [{"name": "...", "quantity": 2, "unit_price": "10.50", "discount_bp": 0, "tax_rate_bp": 1925}]}
+
+    Returns:
+        Dictionary of clean values (articles as (name, quantity, unit_price,
+        discount_bp, tax_rate_bp) tuples)
+
+    Raises:
+        ValueError: With a message naming the invalid field
+    """
+    if not isinstance(data, dict):
+        raise ValueError("An invoice must be a JSON object.")
+    customer_id = data.get('customer_id')
+    if not isinstance(customer_id, int) or isinstance(customer_id, bool):
+        raise ValueError("'customer_id' must be an integer.")
+    invoice_type = data.get('invoice_type')
+    if invoice_type is not None and invoice_type not in _INVOICE_TYPES:
+        raise ValueError("Unknown 'invoice_type'.")
+    paid = data.get('paid', False)
+    if not isinstance(paid, bool):
+        raise ValueError("'paid' must be a boolean.")
+    currency = data.get('currency', get_base_currency())
+    if not isinstance(currency, str) or not currency_code_validator.regex.match(currency):
+        raise ValueError("'currency' must be an ISO 4217 code such as \"XAF\".")
+    comments = data.get('comments')
+    if comments is not None and (not isinstance(comments, str) or len(comments) > _COMMENTS_MAX_LENGTH):
+        raise ValueError(f"'comments' must be a string of at most {_COMMENTS_MAX_LENGTH} characters.")
+    articles = data.get('articles', [])
+    if not isinstance(articles, list) or len(articles) > MAX_ARTICLES:
+        raise ValueError(f"'articles' must be a list of at most {MAX_ARTICLES} articles.")
+    articles = [_parse_article(article, position) for position, article in enumerate(articles)]
+    adjustment = _parse_amount(data.get('adjustment', 0), "'adjustment'")
+    pricing = price_rows(
+        ((quantity, to_cents(price), discount_bp, tax_rate_bp)
+         for _name, quantity, price, discount_bp, tax_rate_bp in articles),
+        to_cents(adjustment),
+    )
+    if pricing.total > MAX_AMOUNT_CENTS:
+        raise ValueError("The invoice total is too large.")
+    if pricing.total < 0:
+        raise ValueError("The 'adjustment' cannot make the invoice total negative.")
+    return {
+        'customer_id': customer_id,
+        'invoice_type': invoice_type,
+        'paid': paid,
+        'currency': currency,
+        'comments': comments,
+        'adjustment': adjustment,
+        'articles': articles,
+        'total': from_cents(pricing.total),
+    }
+
+
+def create_invoices(user, invoices):
+    """
+    Insert validated invoices (parse_invoice_payload() output) and their articles
+    with two bulk INSERTs in a single transaction. Invoices generated from a
+    recurring template also carry recurring_id and period_start.
+
+    Returns:
+        List of (invoice, articles) tuples, invoices numbered
+
+    Raises:
+        ValueError: If a customer does not exist (nothing is created)
+    """
+    customer_ids = {data['customer_id'] for data in invoices}
+    customers = Customer.objects.only('id', 'name').in_bulk(customer_ids)
+    missing = sorted(customer_ids - set(customers))
+    if missing:
+        raise ValueError(f"Unknown customer_id: {', '.join(map(str, missing))}.")
+
+    with transaction.atomic():
+        created = Invoice.objects.bulk_create([
+            Invoice(
+                customer=customers[data['customer_id']],
+                save_by=user,
+                invoice_type=data['invoice_type'],
+                paid=data['paid'],
+                currency=data['currency'],
+                comments=data['comments'],
+                adjustment=data['adjustment'],
+                total=data['total'],
+                recurring_id=data.get('recurring_id'),
+                period_start=data.get('period_start'),
+            )
+            for data in invoices
+        ])
+        articles = [
+            [Article(invoice=invoice, name=name, quantity=quantity, unit_price=price,
+                     discount_bp=discount_bp, tax_rate_bp=tax_rate_bp)
+             for name, quantity, price, discount_bp, tax_rate_bp in data['articles']]
+            for invoice, data in zip(created, invoices)
+        ]
+        Article.objects.bulk_create([article for lines in articles for article in lines], batch_size=2000)
+        record_created(created)
+        record_created([article for lines in articles for article in lines])
+        invoice_ids = [invoice.pk for invoice in created]
+        number_after_commit(invoice_ids)
+        mark_invoice_rows_dirty(created)
+        publish_invoice_event(INVOICE_CREATED, invoice_ids)
+
+    # Numbers were assigned when the transaction committed
+    numbers = dict(Invoice.objects.filter(id__in=invoice_ids).values_list('id', 'number'))
+    for invoice in created:
+        invoice.number = numbers.get(invoice.pk)
+    logger.info("Created %d invoices for %s", len(created), user)
+    return list(zip(created, articles))
+
+
+def get_idempotency_timeout():
+    """IDEMPOTENCY_KEY_TTL setting (seconds): how long a stored response is replayed"""
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def get_idempotency_pending_timeout():
+    """
+    IDEMPOTENCY_PENDING_TTL setting (seconds): how long a claimed key blocks
+    retries when its request dies without storing a response or releasing it
+    """
+    return getattr(settings, 'IDEMPOTENCY_PENDING_TTL', 120)
+
+
+def request_fingerprint(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def _idempotency_cache_key(user, key):
+    # Keys are scoped per user and hashed: clients choose them freely
+    return IDEMPOTENCY_KEY_PREFIX % (user.pk, hashlib.sha256(key.encode()).hexdigest())
+
+
+def claim_idempotency_key(user, key):
+    """
+    Reserve an Idempotency-Key before running the request.
+
+    Returns:
+        None when the caller may proceed, otherwise the stored entry:
+        IDEMPOTENCY_PENDING while the first request runs, or a dict with
+        the fingerprint, status and body of its response
+    """
+    cache_key = _idempotency_cache_key(user, key)
+    # Short-lived: a worker killed mid-request must not block the key for a whole TTL
+    if cache.add(cache_key, IDEMPOTENCY_PENDING, get_idempotency_pending_timeout()):
+        return None
+    entry = cache.get(cache_key)
+    if entry is None:
+        # Expired meanwhile, or the cache is unavailable: run the request
+        logger.warning("Idempotency key of %s could not be checked", user)
+    return entry
+
+
+def store_idempotent_response(user, key, fingerprint, status, body):
+    """Remember the response of a successful request for replays"""
+    entry = {'fingerprint': fingerprint, 'status': status, 'body': json.dumps(body)}
+    cache.set(_idempotency_cache_key(user, key), entry, get_idempotency_timeout())
+
+
+def release_idempotency_key(user, key):
+    """Forget a key whose request failed, so the client can retry it"""
+    cache.delete(_idempotency_cache_key(user, key))
@@ -1,9 +1,28 @@
 """
 Decorators and mixins for authentication and authorization
+
+The checks only read flags on request.user, which CachedModelBackend
+(fact_app/backends.py) serves from the cache, so they cost no query. API
+token requests cost one query, reading the token with its user.
 """
+from functools import wraps
+
 from django.contrib.auth import REDIRECT_FIELD_NAME
-from django.contrib.admin.views.decorators import user_passes_test
+from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+
+from .tokens import TOKEN_KEYWORD, get_token_user
+
+# Runs the CSRF checks of session requests inside api_login_required
+_csrf_check = CsrfViewMiddleware(lambda request: None)
+
+
+def is_active_superuser(user):
+    """Check that the user is an active superuser"""
+    return user.is_active and user.is_superuser
 
 
 def superuser_required(
@@ -22,7 +41,7 @@ def superuser_required(
         Decorated function that checks superuser status
     """
     actual_decorator = user_passes_test(
-        lambda u: u.is_active and u.is_superuser,
+        is_active_superuser,
         login_url=login_url,
         redirect_field_name=redirect_field_name,
     )
@@ -31,6 +50,39 @@ def superuser_required(
     return actual_decorator
 
 
+def api_login_required(view):
+    """
+    Decorator for API views: requests with an Authorization header are
+    authenticated by their API token (fact_app.tokens) and skip the CSRF
+    check, no cookie being involved; other requests need a session and pass
+    the CSRF check. Failures answer 401 or 403 JSON instead of redirecting
+    to the login page.
+    """
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        header = request.META.get('HTTP_AUTHORIZATION')
+        if header:
+            user = get_token_user(header)
+            if user is None:
+                return _unauthorized("Invalid API token.")
+            request.user = user
+        elif not request.user.is_authenticated:
+            return _unauthorized("Authentication required.")
+        elif _csrf_check.process_view(request, None, (), {}) is not None:
+            return JsonResponse({"error": "CSRF verification failed."}, status=403)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _unauthorized(message):
+    response = JsonResponse({"error": message}, status=401)
+    response['WWW-Authenticate'] = TOKEN_KEYWORD
+    return response
+
+
 class SuperuserRequiredMixin(UserPassesTestMixin):
     """
     Mixin for class-based views that require superuser status
@@ -38,7 +90,7 @@ class SuperuserRequiredMixin(UserPassesTestMixin):
 
     def test_func(self):
         """Check if user is a superuser"""
-        return self.request.user.is_superuser
+        return is_active_superuser(self.request.user)
     
     def handle_no_permission(self):
         """Handle when user doesn't have permission"""
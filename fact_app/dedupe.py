@@ -0,0 +1,216 @@
+"""
+Customer deduplication
+Each customer stores normalized keys (email_key, phone_key, name_key) so
+near-duplicates (case, phone formats, accents) share a key:
+
+- imports and forms look them up through the key indexes
+- the dedupe tool finds duplicate candidates by grouping on a key
+  (blocking) instead of comparing every pair of customers
+
+No phone number library is used: phone_key is a light E.164 normalization
+that assumes CUSTOMER_PHONE_COUNTRY_CODE for numbers written without one.
+"""
+import logging
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .audit import record_updates
+from .changes import stamp_on_commit
+from .events import INVOICE_UPDATED, publish_invoice_event
+from .models import ArchivedInvoice, Customer, Invoice, RecurringInvoice
+from .rollups import mark_customers_dirty
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_BATCH_SIZE = 2000
+MIN_PHONE_DIGITS = 7
+
+# Blocking key name -> Customer field
+DEDUPE_KEYS = {
+    'email': 'email_key',
+    'phone': 'phone_key',
+    'name': 'name_key',
+}
+# Customer fields the keys are computed from
+DEDUPE_SOURCE_FIELDS = {'email', 'phone', 'name', 'zip_code'}
+
+_NON_DIGITS = re.compile(r'\D')
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_email(email):
+    """Lower-cased, trimmed email"""
+    return (email or '').strip().lower()
+
+
+def normalize_phone(phone, country_code=None):
+    """
+    E.164 form of a phone number ('+237699000000'), or '' when too short.
+
+    Numbers starting with + or 00 keep their country code; others get
+    CUSTOMER_PHONE_COUNTRY_CODE after dropping a national trunk 0.
+    """
+    phone = (phone or '').strip()
+    digits = _NON_DIGITS.sub('', phone)
+    if phone.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    else:
+        country_code = country_code or getattr(settings, 'CUSTOMER_PHONE_COUNTRY_CODE', '237')
+        national = digits.lstrip('0')
+        digits = national if national.startswith(country_code) and len(national) > 10 else country_code + national
+    if len(digits) < MIN_PHONE_DIGITS:
+        return ''
+    return '+' + digits[:15]
+
+
+def fold_name(name, zip_code=''):
+    """
+    Accent- and case-insensitive name with its words sorted, plus the zip code:
+    'Élise  Dupont', '75001' and 'DUPONT elise', '75 001' give 'dupont elise|75001'
+    """
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char)).casefold()
+    words = sorted(word for word in _NON_WORD.split(name) if word)
+    if not words:
+        return ''
+    zip_code = _NON_WORD.sub('', (zip_code or '').casefold())
+    return f"{' '.join(words)}|{zip_code}"[:200]
+
+
+def set_dedupe_keys(customer):
+    """Compute the customer's normalized keys (save() does it through a pre_save signal)"""
+    customer.email_key = normalize_email(customer.email)
+    customer.phone_key = normalize_phone(customer.phone)
+    customer.name_key = fold_name(customer.name, customer.zip_code)
+    return customer
+
+
+def rebuild_dedupe_keys(batch_size=DEDUPE_BATCH_SIZE):
+    """
+    Recompute the keys of every customer (after changing the normalization rules).
+
+    Returns:
+        Number of customers whose keys changed
+    """
+    changed = 0
+    fields = list(DEDUPE_KEYS.values())
+    batch = []
+    queryset = Customer.objects.order_by().only('id', 'email', 'phone', 'name', 'zip_code', *fields)
+    for customer in queryset.iterator(chunk_size=batch_size):
+        before = [getattr(customer, field) for field in fields]
+        set_dedupe_keys(customer)
+        if before != [getattr(customer, field) for field in fields]:
+            batch.append(customer)
+        if len(batch) >= batch_size:
+            Customer.objects.bulk_update(batch, fields)
+            changed += len(batch)
+            batch = []
+    if batch:
+        Customer.objects.bulk_update(batch, fields)
+        changed += len(batch)
+    return changed
+
+
+def find_duplicate_clusters(keys=('email', 'phone')):
+    """
+    Groups of customers sharing at least one of the given keys.
+
+    Each key is a single GROUP BY over its index, so the cost grows with
+    the number of customers, not with the number of pairs. Groups from
+    different keys are joined (a shares a phone with b, b an email with c:
+    one cluster a, b, c).
+
+    Args:
+        keys: Names from DEDUPE_KEYS
+
+    Returns:
+        List of sorted customer id lists, oldest customer first
+    """
+    parent = {}
+
+    def find(pk):
+        root = pk
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[pk] != root:
+            parent[pk], pk = root, parent[pk]
+        return root
+
+    for key in keys:
+        field = DEDUPE_KEYS[key]
+        duplicated = (
+            Customer.objects.exclude(**{field: ''}).order_by()
+            .values(field).annotate(customers=Count('id')).filter(customers__gt=1).values(field)
+        )
+        rows = (
+            Customer.objects.filter(**{f'{field}__in': duplicated})
+            .order_by(field, 'id').values_list(field, 'id')
+        )
+        first_id = current = None
+        for value, pk in rows.iterator(chunk_size=DEDUPE_BATCH_SIZE):
+            if value != current:
+                current, first_id = value, pk
+            else:
+                parent[find(pk)] = find(first_id)
+
+    clusters = {}
+    for pk in parent:
+        clusters.setdefault(find(pk), []).append(pk)
+    return sorted(sorted(ids) for ids in clusters.values() if len(ids) > 1)
+
+
+@transaction.atomic
+def merge_customers(target_id, duplicate_ids):
+    """
+    Move the (live and archived) invoices and the recurring templates of
+    duplicate_ids to target_id, then delete the duplicates.
+
+    Returns:
+        Number of invoices moved
+    """
+    duplicate_ids = [pk for pk in duplicate_ids if pk != target_id]
+    if not duplicate_ids:
+        return 0
+    # Lock the customers so no invoice is added to a duplicate meanwhile
+    list(Customer.objects.select_for_update().filter(id__in=[target_id, *duplicate_ids]).values_list('id'))
+    moved = {}
+    for invoice_id, customer_id in Invoice.objects.filter(customer_id__in=duplicate_ids).values_list('id', 'customer_id'):
+        moved.setdefault(customer_id, []).append(invoice_id)
+    invoice_ids = [invoice_id for ids in moved.values() for invoice_id in ids]
+    # QuerySet.update() bypasses auto_now and signals: stamp the change feed, audit, publish, refresh rollups
+    now = timezone.now()
+    Invoice.objects.filter(id__in=invoice_ids).update(customer_id=target_id, last_updated_date=now)
+    stamp_on_commit(Invoice, invoice_ids, now)
+    for customer_id, ids in moved.items():
+        record_updates(Invoice, ids, {'customer_id': [customer_id, target_id]})
+    ArchivedInvoice.objects.filter(customer_id__in=duplicate_ids).update(customer_id=target_id)
+    RecurringInvoice.objects.filter(customer_id__in=duplicate_ids).update(customer_id=target_id)
+    Customer.objects.filter(id__in=duplicate_ids).delete()
+    mark_customers_dirty([target_id])
+    if invoice_ids:
+        publish_invoice_event(INVOICE_UPDATED, invoice_ids)
+    logger.info("Merged customers %s into %s (%d invoices moved)", duplicate_ids, target_id, len(invoice_ids))
+    return len(invoice_ids)
+
+
+def merge_duplicate_clusters(clusters):
+    """
+    Merge each cluster into its oldest customer, one transaction per cluster.
+
+    Returns:
+        Dictionary with the number of clusters merged, customers removed and invoices moved
+    """
+    merged = {'clusters': 0, 'customers': 0, 'invoices': 0}
+    for ids in clusters:
+        target_id, *duplicate_ids = sorted(ids)
+        merged['invoices'] += merge_customers(target_id, duplicate_ids)
+        merged['customers'] += len(duplicate_ids)
+        merged['clusters'] += 1
+    return merged
@@ -0,0 +1,257 @@
+"""
+Invoice email delivery
+Invoices are sent to Customer.email with their PDF attached. Sending is
+queued: queue_invoice_deliveries() stores pending InvoiceDelivery rows and,
+once they are committed, spreads them over Celery tasks of
+DELIVERY_BATCH_SIZE deliveries (fact_app.tasks.send_invoice_deliveries_task,
+rate limited per worker).
+
+A task claims its deliveries in a short transaction (status sending), then
+sends them over one connection to the email backend (get_connection()),
+outside any transaction, and records each result as soon as it is known.
+PDFs come from the cache and are only rendered when missing. Failed
+deliveries go back to pending and the task raises so Celery retries it with
+backoff; a delivery is marked failed after DELIVERY_MAX_ATTEMPTS attempts.
+A worker killed mid-batch leaves its unrecorded deliveries claimed: they are
+requeued once the claim is DELIVERY_CLAIM_TIMEOUT old, so only the email
+being sent at that moment can go out twice. Pending deliveries left without
+an attempt for as long (the Celery retries ran out during a mail server
+outage) are requeued the same way, by the requeue-stale-deliveries beat task.
+
+EMAIL_BACKEND selects the transport: SMTP in production, locmem in tests and
+filebased (EMAIL_FILE_PATH) to inspect the messages locally.
+"""
+import datetime
+import logging
+import smtplib
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import InvoiceDelivery
+from .money import format_amount
+from .pdf import get_cached_invoice_pdf, render_invoice_pdf, store_invoice_pdf
+
+logger = logging.getLogger(__name__)
+
+# Deliveries per sending task, all sent over one connection
+DELIVERY_BATCH_SIZE = 100
+DELIVERY_QUEUE_CHUNK = 2000
+DELIVERY_MAX_ATTEMPTS = 5
+# A claim older than this was left by a worker that died
+DELIVERY_CLAIM_TIMEOUT = datetime.timedelta(minutes=15)
+_ERROR_MAX_LENGTH = InvoiceDelivery._meta.get_field('error').max_length
+
+# The connection is lost: the rest of the batch waits for the retry
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+def _dispatch(delivery_ids):
+    from .tasks import send_invoice_deliveries_task
+
+    for start in range(0, len(delivery_ids), DELIVERY_BATCH_SIZE):
+        send_invoice_deliveries_task.delay(delivery_ids[start:start + DELIVERY_BATCH_SIZE])
+
+
+def queue_invoice_deliveries(invoices, user=None):
+    """
+    Queue the sending of invoices to their customer's email.
+
+    Args:
+        invoices: Invoice queryset
+        user: User requesting the sending
+
+    Returns:
+        Dictionary mapping each invoice ID to 'queued', 'already_queued'
+        (a delivery is pending or being sent) or 'no_email'
+    """
+    results = {}
+    queued = []
+    rows = list(invoices.order_by('id').values_list('id', 'customer__email'))
+    with transaction.atomic():
+        for start in range(0, len(rows), DELIVERY_QUEUE_CHUNK):
+            chunk = rows[start:start + DELIVERY_QUEUE_CHUNK]
+            pending = set(
+                InvoiceDelivery.objects.filter(
+                    invoice_id__in=[invoice_id for invoice_id, _email in chunk],
+                    status__in=[InvoiceDelivery.STATUS_PENDING, InvoiceDelivery.STATUS_SENDING],
+                ).values_list('invoice_id', flat=True)
+            )
+            deliveries = []
+            for invoice_id, email in chunk:
+                if invoice_id in pending:
+                    results[invoice_id] = 'already_queued'
+                elif not email:
+                    results[invoice_id] = 'no_email'
+                else:
+                    results[invoice_id] = 'queued'
+                    deliveries.append(InvoiceDelivery(invoice_id=invoice_id, email=email, requested_by=user))
+            queued.extend(delivery.pk for delivery in InvoiceDelivery.objects.bulk_create(deliveries))
+        transaction.on_commit(lambda: _dispatch(queued))
+    logger.info("Queued %d invoice deliveries (%d invoices) for %s", len(queued), len(results), user)
+    return results
+
+
+def _stale_claims():
+    return Q(status=InvoiceDelivery.STATUS_SENDING, claimed_at__lt=timezone.now() - DELIVERY_CLAIM_TIMEOUT)
+
+
+def _stale_pending():
+    # No attempt (claim) since the timeout, or none at all since queued that long ago
+    cutoff = timezone.now() - DELIVERY_CLAIM_TIMEOUT
+    return Q(status=InvoiceDelivery.STATUS_PENDING) & (
+        Q(claimed_at__lt=cutoff) | Q(claimed_at__isnull=True, created_at__lt=cutoff)
+    )
+
+
+def queue_pending_deliveries():
+    """
+    Queue tasks again for every pending delivery and stale claim (after a
+    mail server outage). Returns their number
+    """
+    pending = InvoiceDelivery.objects.filter(Q(status=InvoiceDelivery.STATUS_PENDING) | _stale_claims())
+    delivery_ids = list(pending.order_by('id').values_list('id', flat=True))
+    _dispatch(delivery_ids)
+    return len(delivery_ids)
+
+
+def queue_stale_deliveries():
+    """
+    Queue tasks again for the deliveries claimed by a worker that died and
+    the pending ones no task attempted for DELIVERY_CLAIM_TIMEOUT (their
+    retries ran out). Returns their number
+    """
+    stale = InvoiceDelivery.objects.filter(_stale_claims() | _stale_pending())
+    delivery_ids = list(stale.order_by('id').values_list('id', flat=True))
+    _dispatch(delivery_ids)
+    return len(delivery_ids)
+
+
+def delete_invoice_deliveries(invoice_ids):
+    """Delete the deliveries of deleted invoices (archived ones keep theirs)"""
+    InvoiceDelivery.objects.filter(invoice_id__in=invoice_ids).delete()
+
+
+def get_invoice_pdf(invoice):
+    """The cached PDF of an invoice, rendered and cached when missing"""
+    pdf = get_cached_invoice_pdf(invoice)
+    if pdf is None:
+        pdf = render_invoice_pdf(invoice)
+        store_invoice_pdf(invoice, pdf)
+    return pdf
+
+
+def build_invoice_message(delivery, connection=None):
+    """EmailMessage of a delivery, with the invoice PDF attached"""
+    invoice = delivery.invoice
+    context = {
+        'invoice': invoice,
+        'customer': invoice.customer,
+        'total': format_amount(invoice.total, invoice.currency),
+    }
+    message = EmailMessage(
+        subject=f"{invoice.get_invoice_type_display() or 'Invoice'} {invoice.reference}",
+        body=render_to_string('invoice-email.txt', context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[delivery.email],
+        connection=connection,
+    )
+    message.attach(f"{invoice.reference}.pdf", get_invoice_pdf(invoice), 'application/pdf')
+    return message
+
+
+def claim_deliveries(delivery_ids):
+    """
+    Claim the pending deliveries among delivery_ids (and stale claims) for
+    sending, in a short transaction.
+
+    Claimed rows are skipped by other tasks (SKIP LOCKED on PostgreSQL while
+    claiming, then their sending status).
+
+    Returns:
+        List of the claimed deliveries, in id order
+    """
+    with transaction.atomic():
+        claimed = list(
+            InvoiceDelivery.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=InvoiceDelivery.STATUS_PENDING) | _stale_claims(), id__in=list(delivery_ids))
+            .order_by('id').values_list('id', flat=True)
+        )
+        InvoiceDelivery.objects.filter(id__in=claimed).update(
+            status=InvoiceDelivery.STATUS_SENDING, claimed_at=timezone.now()
+        )
+    deliveries = list(InvoiceDelivery.objects.filter(id__in=claimed).select_related('invoice__customer').order_by('id'))
+    gone = set(claimed) - {delivery.pk for delivery in deliveries}
+    if gone:
+        # The invoice was archived since it was queued
+        InvoiceDelivery.objects.filter(id__in=gone).update(
+            status=InvoiceDelivery.STATUS_FAILED, error="The invoice was archived."
+        )
+    return deliveries
+
+
+def _record(delivery):
+    InvoiceDelivery.objects.filter(pk=delivery.pk).update(
+        status=delivery.status, attempts=delivery.attempts, error=delivery.error, sent_at=delivery.sent_at,
+    )
+
+
+def send_deliveries(delivery_ids):
+    """
+    Claim and send pending deliveries over a single connection, recording
+    each result as it is known.
+
+    Returns:
+        Dictionary with the number of deliveries sent and failed
+
+    Raises:
+        OSError: The last sending error when deliveries remain pending, so the task is retried
+    """
+    sent = failed = 0
+    error = None
+    deliveries = claim_deliveries(delivery_ids)
+    if not deliveries:
+        return {'sent': 0, 'failed': 0}
+    recorded = set()
+    try:
+        # Opening the connection may fail too: nothing is attempted and the task is retried
+        with get_connection() as connection:
+            for delivery in deliveries:
+                delivery.attempts += 1
+                try:
+                    connection.send_messages([build_invoice_message(delivery, connection)])
+                except OSError as exc:  # smtplib errors, wkhtmltopdf failures
+                    error = exc
+                    delivery.error = f"{type(exc).__name__}: {exc}"[:_ERROR_MAX_LENGTH]
+                    if delivery.attempts >= DELIVERY_MAX_ATTEMPTS:
+                        delivery.status = InvoiceDelivery.STATUS_FAILED
+                        failed += 1
+                    else:
+                        delivery.status = InvoiceDelivery.STATUS_PENDING
+                    _record(delivery)
+                    recorded.add(delivery.pk)
+                    if isinstance(exc, CONNECTION_ERRORS):
+                        break
+                else:
+                    delivery.status = InvoiceDelivery.STATUS_SENT
+                    delivery.sent_at = timezone.now()
+                    delivery.error = ''
+                    _record(delivery)
+                    recorded.add(delivery.pk)
+                    sent += 1
+    finally:
+        # Claimed but not recorded (connection lost, unexpected error): back to pending.
+        # claimed_at stays: queue_stale_deliveries() picks them up if the retries run out
+        InvoiceDelivery.objects.filter(
+            id__in=[delivery.pk for delivery in deliveries if delivery.pk not in recorded],
+            status=InvoiceDelivery.STATUS_SENDING,
+        ).update(status=InvoiceDelivery.STATUS_PENDING)
+
+    logger.info("Sent %d invoice deliveries, %d failed, %d to retry", sent, failed, len(deliveries) - sent - failed)
+    if sent + failed < len(deliveries):
+        raise error
+    return {'sent': sent, 'failed': failed}
@@ -0,0 +1,266 @@
+"""
+Invoice events
+Signals publish invoice changes on a small event bus; the long-poll endpoint
+(api/invoices/events/) hands them to open SPA tabs, which then update their
+list instead of re-polling api/invoices/.
+
+Events are coalesced per transaction and published once it commits: saving
+an invoice and its 50 articles publishes one event, not 51.
+
+Two backends:
+- Redis stream (INVOICE_EVENTS_REDIS_URL set): shared by all web processes
+- In-process buffer: single process only, used locally and in tests
+
+A waiting long poll holds a gunicorn thread: at most INVOICE_EVENTS_MAX_WAITERS
+wait per process, further polls get the pending events at once and a
+retry_after delay.
+"""
+import collections
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+EVENTS_DEFAULT_WAIT = 25
+EVENTS_MAX_WAIT = 55
+EVENTS_BATCH_SIZE = 100
+EVENTS_MAX_LENGTH = 10000
+# Seconds a client waits before polling again when every waiting slot is taken
+EVENTS_RETRY_AFTER = 5
+
+INVOICE_CREATED = 'invoice.created'
+INVOICE_UPDATED = 'invoice.updated'
+INVOICE_DELETED = 'invoice.deleted'
+
+
+class LocalEventBus:
+    """In-process event buffer, only visible to threads of the same process"""
+
+    def __init__(self, maxlen=EVENTS_MAX_LENGTH):
+        self._events = collections.deque(maxlen=maxlen)
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    def publish(self, event):
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event))
+            self._condition.notify_all()
+
+    def last_id(self):
+        return str(self._last_id)
+
+    def read(self, after, timeout):
+        """
+        Events published after the given id, waiting up to timeout seconds for one.
+
+        Returns:
+            Tuple (events, cursor, reset). reset is True when events after the
+            cursor were already dropped from the buffer.
+        """
+        after = int(after)
+        with self._condition:
+            if after > self._last_id:
+                # Cursor issued before a restart of this process
+                return [], str(self._last_id), True
+            if not self._condition.wait_for(lambda: self._last_id > after, timeout):
+                return [], str(after), False
+            reset = self._events[0][0] > after + 1
+            events = [(event_id, event) for event_id, event in self._events if event_id > after]
+        events = events[:EVENTS_BATCH_SIZE]
+        return [dict(event, id=str(event_id)) for event_id, event in events], str(events[-1][0]), reset
+
+
+class RedisEventBus:
+    """Events in a capped Redis stream, read with a blocking XREAD"""
+
+    key = 'fact_app:invoice_events'
+
+    def __init__(self, url, maxlen=EVENTS_MAX_LENGTH):
+        self._redis = redis.Redis.from_url(url, socket_timeout=EVENTS_MAX_WAIT + 5)
+        self._maxlen = maxlen
+
+    def publish(self, event):
+        self._redis.xadd(self.key, {'data': json.dumps(event)}, maxlen=self._maxlen, approximate=True)
+
+    def last_id(self):
+        latest = self._redis.xrevrange(self.key, count=1)
+        return latest[0][0].decode() if latest else '0-0'
+
+    def read(self, after, timeout):
+        # BLOCK 0 would wait forever: a zero timeout is a plain non-blocking read
+        block = int(timeout * 1000) or None
+        response = self._redis.xread({self.key: after}, count=EVENTS_BATCH_SIZE, block=block)
+        if not response:
+            return [], after, False
+        entries = response[0][1]
+        # Entries after the cursor may have been trimmed by MAXLEN
+        first = self._redis.xrange(self.key, count=1)
+        reset = after != '0-0' and bool(first) and _stream_id(first[0][0]) > _stream_id(after)
+        events = [dict(json.loads(fields[b'data']), id=entry_id.decode()) for entry_id, fields in entries]
+        return events, entries[-1][0].decode(), reset
+
+
+def _stream_id(value):
+    if isinstance(value, bytes):
+        value = value.decode()
+    milliseconds, _, sequence = value.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_event_bus():
+    """The configured event bus (created on first use)"""
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                url = getattr(settings, 'INVOICE_EVENTS_REDIS_URL', None)
+                _bus = RedisEventBus(url) if url else LocalEventBus()
+    return _bus
+
+
+_waiters = 0
+_waiters_lock = threading.Lock()
+
+
+def get_max_waiters():
+    return getattr(settings, 'INVOICE_EVENTS_MAX_WAITERS', 4)
+
+
+@contextmanager
+def event_waiter():
+    """
+    Take one of the long-poll slots of this process for the block.
+    Yields False when they are all taken: the caller must not wait.
+    """
+    global _waiters
+    with _waiters_lock:
+        acquired = _waiters < get_max_waiters()
+        if acquired:
+            _waiters += 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with _waiters_lock:
+                _waiters -= 1
+
+
+@contextmanager
+def invoice_events_suppressed():
+    """
+    Invoice signals publish nothing inside this block:
+    the caller publishes a single event for the whole batch afterwards
+    """
+    previous = getattr(_local, 'suppressed', False)
+    _local.suppressed = True
+    try:
+        yield
+    finally:
+        _local.suppressed = previous
+
+
+def _publish(event):
+    try:
+        get_event_bus().publish(event)
+    except redis.RedisError as exc:
+        # Live updates are best effort: never fail the request that changed the data
+        logger.warning("Could not publish %s event: %s", event['type'], exc)
+
+
+class _PendingEvents:
+    """Invoice events of the current transaction, merged per invoice"""
+
+    def __init__(self):
+        # Dicts used as ordered sets / maps: events keep the order of the first change
+        self.created = {}
+        # Invoice id -> field values changed, or None when clients should reload it
+        self.updated = {}
+        self.deleted = {}
+        self.flushed = False
+
+    def add(self, event_type, invoice_ids, changes):
+        for invoice_id in invoice_ids:
+            if event_type == INVOICE_CREATED:
+                self.created[invoice_id] = None
+            elif event_type == INVOICE_DELETED:
+                self.created.pop(invoice_id, None)
+                self.updated.pop(invoice_id, None)
+                self.deleted[invoice_id] = None
+            elif invoice_id not in self.created and invoice_id not in self.deleted:
+                # A new invoice is loaded whole, and a reload covers any field change
+                if changes and (invoice_id not in self.updated or self.updated[invoice_id] is not None):
+                    self.updated[invoice_id] = dict(self.updated.get(invoice_id) or {}, **changes)
+                else:
+                    self.updated[invoice_id] = None
+
+    def events(self):
+        """One event per type and set of changes"""
+        events = []
+        if self.created:
+            events.append({'type': INVOICE_CREATED, 'invoice_ids': list(self.created)})
+        groups = {}
+        for invoice_id, changes in self.updated.items():
+            key = tuple(sorted(changes.items())) if changes else None
+            groups.setdefault(key, []).append(invoice_id)
+        for key, invoice_ids in groups.items():
+            event = {'type': INVOICE_UPDATED, 'invoice_ids': invoice_ids}
+            if key:
+                event['changes'] = dict(key)
+            events.append(event)
+        if self.deleted:
+            events.append({'type': INVOICE_DELETED, 'invoice_ids': list(self.deleted)})
+        return events
+
+    def flush(self):
+        if self.flushed:
+            return
+        self.flushed = True
+        for event in self.events():
+            _publish(event)
+
+
+def _pending_events():
+    """The events of the current transaction (a new batch after a commit or a rollback)"""
+    pending = getattr(_local, 'pending', None)
+    connection = transaction.get_connection()
+    # A rolled back transaction drops the batch's callback: its events are never published
+    if pending is None or pending.flushed or not any(
+        callback == pending.flush for _sids, callback, _robust in connection.run_on_commit
+    ):
+        pending = _local.pending = _PendingEvents()
+        transaction.on_commit(pending.flush)
+    return pending
+
+
+def publish_invoice_event(event_type, invoice_ids, changes=None):
+    """
+    Publish an invoice event once the current transaction commits, merged
+    with the other events of the transaction.
+
+    Args:
+        event_type: INVOICE_CREATED, INVOICE_UPDATED or INVOICE_DELETED
+        invoice_ids: Affected invoice ids
+        changes: Field values now shared by all these invoices, e.g. {'paid': True};
+            None when clients should reload the invoices
+    """
+    if getattr(_local, 'suppressed', False):
+        return
+    if not transaction.get_connection().in_atomic_block:
+        event = {'type': event_type, 'invoice_ids': list(invoice_ids)}
+        if changes:
+            event['changes'] = changes
+        _publish(event)
+        return
+    _pending_events().add(event_type, invoice_ids, changes)
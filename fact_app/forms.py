@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.forms import formset_factory
 from .models import Customer, Invoice, Article
+from .dedupe import normalize_email
 
 
 class CustomerForm(forms.ModelForm):
@@ -57,9 +58,9 @@ class CustomerForm(forms.ModelForm):
         }
 
     def clean_email(self):
-        """Validate email is unique"""
+        """Validate email is unique (ignoring case and surrounding spaces)"""
         email = self.cleaned_data.get('email')
-        if email and Customer.objects.filter(email=email).exclude(pk=self.instance.pk).exists():
+        if email and Customer.objects.filter(email_key=normalize_email(email)).exclude(pk=self.instance.pk).exists():
             raise ValidationError("A customer with this email already exists.")
         return email
 
@@ -78,7 +79,7 @@ class InvoiceForm(forms.ModelForm):
     
     class Meta:
         model = Invoice
-        fields = ['customer', 'invoice_type', 'comments']
+        fields = ['customer', 'invoice_type', 'currency', 'comments']
         widgets = {
             'customer': forms.Select(attrs={
                 'class': 'form-control',
@@ -88,6 +89,12 @@ class InvoiceForm(forms.ModelForm):
                 'class': 'form-control',
                 'required': True
             }),
+            'currency': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'XAF',
+                'maxlength': '3',
+                'style': 'text-transform: uppercase;'
+            }),
             'comments': forms.Textarea(attrs={
                 'class': 'form-control',
                 'placeholder': 'Additional notes or comments',
@@ -96,6 +103,10 @@ class InvoiceForm(forms.ModelForm):
             }),
         }
 
+    def clean_currency(self):
+        """Accept lowercase currency codes"""
+        return self.cleaned_data['currency'].upper()
+
 
 class ArticleForm(forms.ModelForm):
     """
@@ -0,0 +1,206 @@
+"""
+Exchange rates
+Invoices are billed in their own currency; reports, dashboards and customer
+rollups are in the base currency (BASE_CURRENCY setting). An invoice amount
+is converted with the FxRate snapshot of its currency in effect on the
+invoice day and rounded half-up to the cent, invoice by invoice.
+
+Aggregates convert in SQL: every invoice row is joined to its snapshot
+through the (currency, valid_from) unique index, so a converted sum over any
+number of invoices stays a single query. Lookups from Python (one invoice
+at a time: API rows, detail pages) are memoized per request: the snapshots of
+a currency are read once and searched in memory.
+
+Invoices in a currency without a snapshot on their day cannot be converted:
+SQL sums leave them out and count them as unconverted.
+"""
+import bisect
+import csv
+import threading
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import (
+    BigIntegerField, Case, Count, DateTimeField, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum,
+    Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Round, TruncDate
+from django.utils.dateparse import parse_date
+
+from .models import FxRate, currency_code_validator
+from .money import TWO_PLACES, annotate_totals, get_base_currency
+
+FX_BATCH_SIZE = 1000
+RATE_FIELD = DecimalField(max_digits=18, decimal_places=8)
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+ONE = Decimal(1)
+
+RateRow = namedtuple('RateRow', ['currency', 'valid_from', 'rate'])
+
+_local = threading.local()
+
+
+def rate_expression(prefix=''):
+    """
+    SQL expression for the value of one unit of an invoice's currency in the
+    base currency on the invoice day (NULL when there is no snapshot)
+
+    Args:
+        prefix: Lookup prefix to reach the invoice fields
+    """
+    snapshot = FxRate.objects.filter(
+        currency=OuterRef(f'{prefix}currency'),
+        # The wrapper gives TruncDate the field type an OuterRef lacks
+        valid_from__lte=TruncDate(
+            ExpressionWrapper(OuterRef(f'{prefix}invoice_date_time'), output_field=DateTimeField())
+        ),
+    ).order_by('-valid_from').values('rate')[:1]
+    return Case(
+        When(**{f'{prefix}currency': get_base_currency()}, then=Value(ONE)),
+        default=Subquery(snapshot),
+        output_field=RATE_FIELD,
+    )
+
+
+def converted_expression(amount):
+    """
+    SQL expression converting an invoice amount (field name or expression)
+    to the base currency, rounded to the cent
+    """
+    if isinstance(amount, str):
+        amount = F(amount)
+    return Round(amount * rate_expression(), 2, output_field=AMOUNT_FIELD)
+
+
+def aggregate_converted_total_cents(invoices):
+    """
+    Sum the totals of an Invoice queryset (computed from their articles) in
+    base currency cents, with one query
+
+    Returns:
+        Tuple (total cents, number of invoices left out for lack of a rate)
+    """
+    rows = annotate_totals(invoices.order_by()).annotate(fx_rate=rate_expression())
+    result = rows.aggregate(
+        total=Coalesce(
+            Sum(Cast(Round(F('articles_total_cents') * F('fx_rate')), BigIntegerField())),
+            0,
+            output_field=BigIntegerField(),
+        ),
+        unconverted=Count('id', filter=Q(fx_rate__isnull=True)),
+    )
+    return result['total'], result['unconverted']
+
+
+def aggregate_converted_archived_cents(invoices):
+    """
+    aggregate_converted_total_cents() for an ArchivedInvoice queryset, from
+    their stored total
+
+    Returns:
+        Tuple (total cents, number of invoices left out for lack of a rate)
+    """
+    rows = invoices.order_by().annotate(fx_rate=rate_expression())
+    result = rows.aggregate(
+        total=Coalesce(
+            Sum(Cast(Round(F('total') * 100 * F('fx_rate')), BigIntegerField())),
+            0,
+            output_field=BigIntegerField(),
+        ),
+        unconverted=Count('id', filter=Q(fx_rate__isnull=True)),
+    )
+    return result['total'], result['unconverted']
+
+
+def start_rate_cache(**kwargs):
+    """Memoize rate lookups until end_rate_cache() (connected to request_started)"""
+    _local.rates = {}
+
+
+def end_rate_cache(**kwargs):
+    _local.rates = None
+
+
+def _lookup_rate(currency, day):
+    return (
+        FxRate.objects.filter(currency=currency, valid_from__lte=day)
+        .order_by('-valid_from').values_list('rate', flat=True).first()
+    )
+
+
+def get_rate(currency, day):
+    """Value of one unit of currency in the base currency on day, or None without a snapshot"""
+    if currency == get_base_currency():
+        return ONE
+    cache = getattr(_local, 'rates', None)
+    if cache is None:
+        return _lookup_rate(currency, day)
+    if currency not in cache:
+        snapshots = list(FxRate.objects.filter(currency=currency).order_by('valid_from').values_list('valid_from', 'rate'))
+        cache[currency] = ([valid_from for valid_from, _ in snapshots], [rate for _, rate in snapshots])
+    days, rates = cache[currency]
+    index = bisect.bisect_right(days, day)
+    return rates[index - 1] if index else None
+
+
+def convert(amount, currency, day):
+    """amount in the base currency, rounded half-up to the cent (None without a rate)"""
+    rate = get_rate(currency, day)
+    if rate is None:
+        return None
+    return (amount * rate).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+
+
+def read_rate_file(source):
+    """
+    Read snapshots from a CSV file with columns date,currency,rate
+    (rate: value of one unit of currency in the base currency)
+
+    Raises:
+        ValueError: With the number of the first invalid row
+    """
+    reader = csv.DictReader(source)
+    missing = {'date', 'currency', 'rate'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+    rows = []
+    for row_number, row in enumerate(reader, start=2):
+        currency = (row['currency'] or '').strip().upper()
+        try:
+            valid_from = parse_date((row['date'] or '').strip())
+            rate = Decimal((row['rate'] or '').strip())
+        except (ValueError, InvalidOperation):
+            valid_from = rate = None
+        valid = currency_code_validator.regex.match(currency) and valid_from is not None
+        if not valid or rate is None or not rate.is_finite() or rate <= 0:
+            raise ValueError(f"Row {row_number}: invalid date, currency or rate.")
+        rows.append(RateRow(currency, valid_from, rate))
+    return rows
+
+
+@transaction.atomic
+def store_rates(rows, source=''):
+    """
+    Insert or replace snapshots (one per currency and day: the last row wins).
+
+    Returns:
+        Dictionary of currency -> earliest day loaded, the first day whose
+        converted amounts may have changed
+    """
+    # A single INSERT ... ON CONFLICT cannot update the same row twice
+    rows = list({(row.currency, row.valid_from): row for row in rows}.values())
+    FxRate.objects.bulk_create(
+        [FxRate(currency=row.currency, valid_from=row.valid_from, rate=row.rate, source=source[:255]) for row in rows],
+        batch_size=FX_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['currency', 'valid_from'],
+        update_fields=['rate', 'source', 'loaded_at'],
+    )
+    changed = {}
+    for row in rows:
+        if row.currency not in changed or row.valid_from < changed[row.currency]:
+            changed[row.currency] = row.valid_from
+    if getattr(_local, 'rates', None):
+        _local.rates = {}
+    return changed
@@ -0,0 +1,143 @@
+"""
+Compact line-item storage for invoices
+Keeps article data in flat integer arrays instead of one model instance per line
+"""
+from array import array
+
+from django.conf import settings
+
+from .models import Article
+from .money import from_cents, to_cents
+from .pricing import price_line, price_lines
+
+
+class ArticleRow:
+    """
+    Lightweight read-only line item exposing the same attributes
+    as Article in templates and serializers
+    """
+    __slots__ = ('id', 'name', 'quantity', 'unit_price_cents', 'discount_bp', 'tax_rate_bp')
+
+    def __init__(self, id, name, quantity, unit_price_cents, discount_bp=0, tax_rate_bp=0):
+        self.id = id
+        self.name = name
+        self.quantity = quantity
+        self.unit_price_cents = unit_price_cents
+        self.discount_bp = discount_bp
+        self.tax_rate_bp = tax_rate_bp
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_price(self):
+        return price_line(self.quantity, self.unit_price_cents, self.discount_bp, self.tax_rate_bp)
+
+    @property
+    def total_cents(self):
+        """Line total in cents, after discount and tax"""
+        return self.get_price().total
+
+    @property
+    def unit_price(self):
+        return from_cents(self.unit_price_cents)
+
+    @property
+    def get_total(self):
+        """Calculate total for this line item"""
+        return from_cents(self.total_cents)
+
+    def __str__(self):
+        return f"{self.name} (x{self.quantity})"
+
+
+class CompactArticles:
+    """
+    Array-backed collection of an invoice's articles.
+
+    Rows are loaded with a single values_list() query and stored column-wise;
+    ArticleRow objects are only created while iterating.
+    """
+    FIELDS = ('id', 'name', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp')
+
+    def __init__(self, rows=()):
+        self.ids = array('q')
+        self.quantities = array('q')
+        self.unit_prices = array('q')
+        self.discounts = array('q')
+        self.tax_rates = array('q')
+        self.names = []
+        for pk, name, quantity, unit_price, discount_bp, tax_rate_bp in rows:
+            self.ids.append(pk)
+            self.names.append(name)
+            self.quantities.append(quantity)
+            self.unit_prices.append(to_cents(unit_price))
+            self.discounts.append(discount_bp)
+            self.tax_rates.append(tax_rate_bp)
+
+    @classmethod
+    def for_invoice(cls, invoice_id, model=Article):
+        """Load the articles of an invoice without instantiating models"""
+        rows = model.objects.filter(invoice_id=invoice_id).order_by(
+            'created_at', 'id'
+        ).values_list(*cls.FIELDS)
+        return cls(rows.iterator(chunk_size=2000))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self._row(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._row(index)
+
+    def _row(self, i):
+        return ArticleRow(
+            self.ids[i], self.names[i], self.quantities[i], self.unit_prices[i], self.discounts[i], self.tax_rates[i]
+        )
+
+    def count(self):
+        return len(self)
+
+    def get_pricing(self, adjustment_cents=0):
+        """Price all lines in one pass (fact_app.pricing.InvoicePricing)"""
+        return price_lines(self.quantities, self.unit_prices, self.discounts, self.tax_rates, adjustment_cents)
+
+    @property
+    def total_cents(self):
+        """Sum of all line totals in cents"""
+        return self.get_pricing().total
+
+    @property
+    def get_total(self):
+        """Invoice total as a 2-decimal Decimal"""
+        return from_cents(self.total_cents)
+
+
+def use_compact_articles():
+    """Whether detail, API and PDF views should use CompactArticles"""
+    return getattr(settings, 'INVOICE_COMPACT_ARTICLES', False)
+
+
+def get_invoice_lines(invoice, compact=None):
+    """
+    Return (articles, pricing) for an invoice.
+
+    Args:
+        invoice: Invoice or ArchivedInvoice instance
+        compact: Force compact mode on/off (default: INVOICE_COMPACT_ARTICLES setting)
+
+    Returns:
+        Tuple of an iterable of article-like rows and the
+        fact_app.pricing.InvoicePricing of the invoice
+    """
+    if compact is None:
+        compact = use_compact_articles()
+    if compact:
+        articles = CompactArticles.for_invoice(invoice.pk, model=invoice.articles.model)
+        return articles, articles.get_pricing(to_cents(invoice.adjustment))
+    return invoice.articles.all(), invoice.get_pricing()
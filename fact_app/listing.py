@@ -0,0 +1,96 @@
+"""
+Customer invoice listing
+One customer's invoices, newest first, a page at a time. Pages use keyset
+pagination: each one starts after the (invoice_date_time, id) of the
+previous page, so the last page of a 50k invoice customer costs the same
+as the first.
+
+Pages only read columns stored in invoice_customer_date_idx (the total is
+the stored Invoice.total, not a sum over the articles), so on PostgreSQL
+they are index-only scans.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Invoice
+
+LISTING_DEFAULT_LIMIT = 50
+LISTING_MAX_LIMIT = 500
+
+# Columns of invoice_customer_date_idx (keys and INCLUDE)
+LISTING_FIELDS = ('id', 'number', 'invoice_date_time', 'total', 'currency', 'amount_paid', 'paid', 'invoice_type')
+
+
+def encode_page_cursor(invoice_date_time, invoice_id):
+    """Opaque cursor from the last row of a page"""
+    raw = json.dumps([invoice_date_time.isoformat(), invoice_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_page_cursor(cursor):
+    """
+    Inverse of encode_page_cursor()
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, invoice_id = json.loads(raw)
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None or not isinstance(invoice_id, int):
+            raise ValueError
+        return timestamp, invoice_id
+    except (binascii.Error, TypeError, ValueError, AttributeError):
+        raise ValueError("Invalid cursor.")
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def customer_invoice_page(customer_id, after=None, limit=LISTING_DEFAULT_LIMIT, paid=None,
+                          invoice_type=None, start=None, end=None):
+    """
+    A page of a customer's invoices, newest first.
+
+    Args:
+        after: Cursor returned with the previous page (None for the first page)
+        paid: Only paid (True) or unpaid (False) invoices
+        invoice_type: Only invoices of this type
+        start, end: Only invoices dated between these days (inclusive)
+
+    Returns:
+        Dictionary with the invoice rows (dicts of LISTING_FIELDS), the next cursor and has_more
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    queryset = Invoice.objects.filter(customer_id=customer_id)
+    if paid is not None:
+        queryset = queryset.filter(paid=paid)
+    if invoice_type:
+        queryset = queryset.filter(invoice_type=invoice_type)
+    if start is not None:
+        queryset = queryset.filter(invoice_date_time__gte=_day_start(start))
+    if end is not None:
+        queryset = queryset.filter(invoice_date_time__lt=_day_start(end + datetime.timedelta(days=1)))
+    if after:
+        timestamp, invoice_id = decode_page_cursor(after)
+        queryset = queryset.filter(
+            Q(invoice_date_time__lt=timestamp) | Q(invoice_date_time=timestamp, id__lt=invoice_id)
+        )
+    rows = list(queryset.order_by('-invoice_date_time', '-id').values(*LISTING_FIELDS)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'invoices': rows,
+        'cursor': encode_page_cursor(rows[-1]['invoice_date_time'], rows[-1]['id']) if has_more else None,
+        'has_more': has_more,
+    }
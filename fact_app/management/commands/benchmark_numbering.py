@@ -0,0 +1,92 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from fact_app.models import InvoiceSequence
+from fact_app.numbering import allocate_numbers
+
+# Scratch sequence (year 0 is never a real invoice year), deleted afterwards
+BENCHMARK_YEAR = 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Allocate numbers from many threads at once and report throughput and gaps. "
+        "Each allocation follows a simulated invoice write transaction of --write-ms: "
+        "'deferred' allocates after it commits (what invoice creation does), "
+        "'inline' allocates at its start, holding the counter lock during the write. "
+        "Meaningful on PostgreSQL; SQLite serializes all writers anyway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument('--per-thread', type=int, default=50, help="Numbers allocated by each thread")
+        parser.add_argument('--write-ms', type=float, default=5.0, help="Simulated invoice write duration")
+        parser.add_argument('--mode', choices=['deferred', 'inline', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        if InvoiceSequence.objects.filter(year=BENCHMARK_YEAR).exists():
+            raise CommandError("A year 0 sequence already exists: is another benchmark running?")
+        modes = ['deferred', 'inline'] if options['mode'] == 'both' else [options['mode']]
+        try:
+            for mode in modes:
+                self.run(mode, options['threads'], options['per_thread'], options['write_ms'] / 1000)
+        finally:
+            InvoiceSequence.objects.filter(year=BENCHMARK_YEAR).delete()
+
+    def run(self, mode, threads, per_thread, write_seconds):
+        InvoiceSequence.objects.filter(year=BENCHMARK_YEAR).delete()
+        numbers, waits, errors = [], [], []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(threads)
+
+        def simulated_write():
+            # Stands for inserting the invoice and its articles
+            connection.cursor().execute('SELECT 1')
+            time.sleep(write_seconds)
+
+        def allocate():
+            started = time.perf_counter()
+            with transaction.atomic():
+                number = allocate_numbers(BENCHMARK_YEAR, '')[0]
+                if mode == 'inline':
+                    simulated_write()
+            return number, time.perf_counter() - started
+
+        def worker():
+            try:
+                start_barrier.wait()
+                for _ in range(per_thread):
+                    if mode == 'deferred':
+                        with transaction.atomic():
+                            simulated_write()
+                    number, waited = allocate()
+                    with lock:
+                        numbers.append(number)
+                        waits.append(waited)
+            except Exception as exc:  # reported below, the benchmark goes on
+                with lock:
+                    errors.append(exc)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        numbers.sort()
+        waits.sort()
+        gap_free = numbers == list(range(1, len(numbers) + 1))
+        p99 = waits[int(len(waits) * 0.99) - 1] if waits else 0
+        self.stdout.write(
+            f"{mode:>8}: {len(numbers)} numbers in {elapsed:.2f}s ({len(numbers) / elapsed:.0f}/s), "
+            f"allocation p99 {p99 * 1000:.1f} ms, gap-free: {'yes' if gap_free else 'NO'}, errors: {len(errors)}"
+        )
+        if errors:
+            self.stdout.write(f"          first error: {errors[0]!r}")
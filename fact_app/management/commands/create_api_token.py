@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fact_app.tokens import create_api_token
+
+
+class Command(BaseCommand):
+    help = "Create an API token acting as a user; the key is printed once and cannot be read back"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', required=True, help="What the token is for, e.g. the client's name")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username'], is_active=True).first()
+        if user is None:
+            raise CommandError(f"No active user {options['username']!r}")
+        token, key = create_api_token(user, options['name'])
+        self.stdout.write(self.style.SUCCESS(f"Created API token {token.pk} for {user.username}"))
+        self.stdout.write(key)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fact_app.dedupe import DEDUPE_KEYS, find_duplicate_clusters, merge_duplicate_clusters, rebuild_dedupe_keys
+from fact_app.models import Customer
+
+
+class Command(BaseCommand):
+    help = "List (or merge with --merge) customers sharing a normalized email, phone or name + zip code"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keys', default='email,phone',
+            help=f"Comma-separated blocking keys among {', '.join(DEDUPE_KEYS)} (default: email,phone)",
+        )
+        parser.add_argument('--merge', action='store_true', help="Merge each cluster into its oldest customer")
+        parser.add_argument('--rebuild-keys', action='store_true', help="Recompute the normalized keys first")
+
+    def handle(self, *args, **options):
+        keys = [key.strip() for key in options['keys'].split(',') if key.strip()]
+        unknown = set(keys) - set(DEDUPE_KEYS)
+        if unknown or not keys:
+            raise CommandError(f"Unknown keys: {', '.join(sorted(unknown)) or '(none given)'}")
+        if options['rebuild_keys']:
+            self.stdout.write(f"Updated the keys of {rebuild_dedupe_keys()} customers")
+
+        clusters = find_duplicate_clusters(keys)
+        if not options['merge']:
+            for ids in clusters:
+                customers = Customer.objects.filter(id__in=ids).order_by('id').only('id', 'name', 'email', 'phone')
+                self.stdout.write(' | '.join(f"#{c.pk} {c.name} <{c.email}> {c.phone}" for c in customers))
+            self.stdout.write(self.style.SUCCESS(
+                f"{len(clusters)} duplicate clusters ({sum(map(len, clusters))} customers); use --merge to merge them"
+            ))
+            return
+
+        merged = merge_duplicate_clusters(clusters)
+        self.stdout.write(self.style.SUCCESS(
+            f"Merged {merged['clusters']} clusters: {merged['customers']} customers removed, "
+            f"{merged['invoices']} invoices reassigned"
+        ))
@@ -0,0 +1,59 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from fact_app.fx import rate_expression, read_rate_file, store_rates
+from fact_app.models import ArchivedInvoice, Invoice
+from fact_app.reports import rebuild_revenue
+from fact_app.rollups import ROLLUP_BATCH_SIZE, refresh_customer_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Load exchange rate snapshots from CSV files (columns date,currency,rate: value of one unit "
+        "of currency in the base currency), then refresh the customer and revenue rollups they change"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="CSV files")
+
+    def handle(self, *args, **options):
+        changed = {}
+        for path in options['paths']:
+            try:
+                with open(path, newline='', encoding='utf-8') as source:
+                    rows = read_rate_file(source)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"{path}: {exc}")
+            for currency, day in store_rates(rows, os.path.basename(path)).items():
+                changed[currency] = min(day, changed.get(currency, day))
+            self.stdout.write(f"{path}: {len(rows)} rates")
+        if not changed:
+            return
+
+        # Only amounts dated on or after a new snapshot convert differently
+        customer_ids = set()
+        for model in (Invoice, ArchivedInvoice):
+            for currency, day in changed.items():
+                customer_ids.update(
+                    model.objects.filter(currency=currency, invoice_date_time__date__gte=day)
+                    .order_by().values_list('customer_id', flat=True).distinct()
+                )
+        customer_ids = sorted(customer_ids)
+        for start in range(0, len(customer_ids), ROLLUP_BATCH_SIZE):
+            with transaction.atomic():
+                refresh_customer_rollups(customer_ids[start:start + ROLLUP_BATCH_SIZE])
+        written = rebuild_revenue(start=min(changed.values()), end=None) if customer_ids else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Rates loaded for {', '.join(sorted(changed))}: refreshed {len(customer_ids)} customers "
+            f"and {written} revenue rollup rows"
+        ))
+
+        missing = (
+            Invoice.objects.order_by().annotate(fx_rate=rate_expression()).filter(fx_rate__isnull=True)
+            .values('currency').annotate(invoices=Count('id')).order_by('currency')
+        )
+        for row in missing:
+            self.stderr.write(f"No rate for {row['invoices']} {row['currency']} invoices (left out of converted totals)")
@@ -0,0 +1,68 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a fresh process imports before serving: the web app with its URLconf,
+# or the Celery app with its task modules
+TARGETS = {
+    'web': (
+        "import django_invoice.wsgi\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns"
+    ),
+    'celery': (
+        "import django\n"
+        "django.setup()\n"
+        "from django_invoice.celery import app\n"
+        "app.loader.import_default_modules()"
+    ),
+}
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+class Command(BaseCommand):
+    help = "Start a fresh process under python -X importtime and summarize where its import time goes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS), default='web')
+        parser.add_argument('--limit', type=int, default=20, help="Rows per table")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', TARGETS[options['target']]],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise CommandError(f"The profiled process failed:\n{process.stderr[-2000:]}")
+
+        modules = []
+        for line in process.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                own, cumulative, indent, name = match.groups()
+                modules.append((name, int(own), int(cumulative), len(indent) // 2))
+        if not modules:
+            raise CommandError("No import timings found in the process output")
+
+        total = sum(own for _name, own, _cumulative, _depth in modules)
+        packages = {}
+        for name, own, _cumulative, _depth in modules:
+            top = name.split('.')[0]
+            packages[top] = packages.get(top, 0) + own
+
+        limit = options['limit']
+        self.stdout.write(
+            f"{options['target']} ({settings.SETTINGS_MODULE}): {len(modules)} modules, {total / 1000:.0f} ms of imports\n"
+        )
+        self.stdout.write("Top-level packages by total import time:")
+        for top, own in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+            self.stdout.write(f"  {own / 1000:8.1f} ms  {100 * own / total:5.1f}%  {top}")
+        self.stdout.write("\nModules by own import time (cumulative in parentheses):")
+        for name, own, cumulative, _depth in sorted(modules, key=lambda module: -module[1])[:limit]:
+            self.stdout.write(f"  {own / 1000:8.1f} ms  ({cumulative / 1000:8.1f} ms)  {name}")
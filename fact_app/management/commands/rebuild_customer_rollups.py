@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from fact_app.rollups import ROLLUP_BATCH_SIZE, rebuild_customer_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute Invoice.total and the rollups stored on every Customer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        counts = rebuild_customer_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {counts['invoices']} invoice totals and {counts['customers']} customer rollups"
+        ))
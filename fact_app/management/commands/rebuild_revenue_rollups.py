@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from fact_app.reports import rebuild_revenue
+
+
+class Command(BaseCommand):
+    help = "Recompute the DailyRevenue rollups (all days, or --start/--end)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Day after the last one (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        start, end = (parse_date(options[name]) if options[name] else None for name in ('start', 'end'))
+        if (options['start'] and start is None) or (options['end'] and end is None):
+            raise CommandError("Dates must use the YYYY-MM-DD format")
+        written = rebuild_revenue(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} revenue rollup rows"))
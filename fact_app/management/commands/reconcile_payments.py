@@ -0,0 +1,46 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fact_app.models import currency_code_validator
+from fact_app.payments import read_statement_csv, reconcile_statement
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile a bank statement CSV (columns date,amount,reference) against the open invoices: "
+        "lines are matched by invoice reference, then by exact outstanding amount"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file")
+        parser.add_argument('--name', default='', help="Statement name (default: the file name)")
+        parser.add_argument('--user', help="Username recorded as the author of the payments")
+        parser.add_argument('--currency', help="Currency of the statement (default: the base currency)")
+
+    def handle(self, *args, **options):
+        currency = (options['currency'] or '').upper() or None
+        if currency is not None and not currency_code_validator.regex.match(currency):
+            raise CommandError(f"Invalid currency: {options['currency']}")
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Unknown user: {options['user']}")
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as source:
+                lines, skipped = read_statement_csv(source)
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        if skipped:
+            shown = ', '.join(map(str, skipped[:20]))
+            self.stderr.write(f"Skipped {len(skipped)} invalid rows: {shown}{'...' if len(skipped) > 20 else ''}")
+
+        batch = reconcile_statement(
+            user, lines, options['name'] or os.path.basename(options['path']), currency=currency
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Statement {batch.pk}: {batch.matched_count}/{batch.line_count} lines matched "
+            f"({batch.matched_amount} of {batch.total_amount} {batch.currency}), {len(batch.newly_paid)} invoices paid"
+        ))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from fact_app.delivery import queue_invoice_deliveries, queue_pending_deliveries
+from fact_app.models import Invoice, InvoiceDelivery
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue invoice emails to the customers (e.g. the month-end run): invoices dated between "
+        "--start and --end, optionally only those never sent; --pending requeues the pending deliveries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First invoice day (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Last invoice day (YYYY-MM-DD)")
+        parser.add_argument('--invoice-type', choices=sorted(dict(Invoice.INVOICE_TYPE)))
+        parser.add_argument('--unsent', action='store_true', help="Skip invoices already sent")
+        parser.add_argument('--pending', action='store_true', help="Only requeue the pending deliveries")
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            self.stdout.write(self.style.SUCCESS(f"Requeued {queue_pending_deliveries()} pending deliveries"))
+            return
+        start, end = (parse_date(options[name]) if options[name] else None for name in ('start', 'end'))
+        if (options['start'] and start is None) or (options['end'] and end is None):
+            raise CommandError("Dates must use the YYYY-MM-DD format")
+        if start is None or end is None:
+            raise CommandError("--start and --end are required")
+
+        invoices = Invoice.objects.filter(invoice_date_time__date__gte=start, invoice_date_time__date__lte=end)
+        if options['invoice_type']:
+            invoices = invoices.filter(invoice_type=options['invoice_type'])
+        if options['unsent']:
+            sent = InvoiceDelivery.objects.filter(status=InvoiceDelivery.STATUS_SENT).values('invoice_id')
+            invoices = invoices.exclude(id__in=sent)
+        results = queue_invoice_deliveries(invoices)
+        counts = {}
+        for status in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        summary = ', '.join(f"{count} {status}" for status, count in sorted(counts.items())) or 'no invoices'
+        self.stdout.write(self.style.SUCCESS(f"Invoice emails: {summary}"))
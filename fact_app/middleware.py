@@ -0,0 +1,28 @@
+"""
+Request middleware for Invoice app
+"""
+from .audit import audit_context
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class AuditMiddleware:
+    """
+    Run each request that may write in one transaction and write its audit
+    entries with one INSERT when it commits, attributed to the authenticated
+    user. Safe requests (downloads, long polls) hold no transaction.
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in SAFE_METHODS:
+            return self.get_response(request)
+        with audit_context() as buffer:
+            response = self.get_response(request)
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                buffer.user = user
+        return response
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:42
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fact_app', '0002_alter_article_options_alter_customer_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedInvoice',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('invoice_date_time', models.DateTimeField()),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('last_updated_date', models.DateTimeField(blank=True, null=True)),
+                ('paid', models.BooleanField(default=True)),
+                ('invoice_type', models.CharField(blank=True, choices=[('R', 'RECEIPT'), ('P', 'PROFORMA INVOICE'), ('I', 'INVOICE')], max_length=1, null=True)),
+                ('comments', models.TextField(blank=True, max_length=1000, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_invoices', to='fact_app.customer')),
+                ('save_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='archived_invoices_created', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived invoice',
+                'verbose_name_plural': 'Archived invoices',
+                'ordering': ['-invoice_date_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedArticle',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField()),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='articles', to='fact_app.archivedinvoice')),
+            ],
+            options={
+                'verbose_name': 'Archived article',
+                'verbose_name_plural': 'Archived articles',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedinvoice',
+            index=models.Index(fields=['-invoice_date_time'], name='fact_app_ar_invoice_6c128d_idx'),
+        ),
+    ]
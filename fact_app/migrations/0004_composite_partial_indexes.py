@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fact_app', '0003_archivedinvoice_archivedarticle'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='article',
+            name='fact_app_ar_invoice_27c394_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='customer',
+            name='fact_app_cu_email_9097e0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='fact_app_in_custome_d566fe_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='fact_app_in_paid_44b7e9_idx',
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='invoice',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='articles', to='fact_app.invoice'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='invoices', to='fact_app.customer'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='save_by',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='invoices_created', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['invoice', 'created_at', 'id'], include=('quantity', 'unit_price'), name='article_invoice_lines_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['customer', '-invoice_date_time'], name='invoice_customer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('paid', False)), fields=['-invoice_date_time'], name='invoice_unpaid_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['save_by', 'id'], name='invoice_save_by_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_change_timestamps(apps, schema_editor):
+    """Existing rows get a real timestamp instead of the migration time"""
+    Article = apps.get_model('fact_app', 'Article')
+    Invoice = apps.get_model('fact_app', 'Invoice')
+    Article.objects.update(updated_at=models.F('created_at'))
+    Invoice.objects.filter(last_updated_date__isnull=True).update(last_updated_date=models.F('invoice_date_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0004_composite_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('deleted', 'Deleted'), ('archived', 'Archived')], default='deleted', max_length=10)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Tombstone',
+                'verbose_name_plural': 'Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_change_timestamps, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['updated_at', 'id'], name='article_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['updated_date', 'id'], name='customer_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['last_updated_date', 'id'], name='invoice_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_changes_idx'),
+        ),
+    ]
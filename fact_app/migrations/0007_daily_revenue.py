@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:53
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0006_customer_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('invoice_type', models.CharField(blank=True, choices=[('R', 'RECEIPT'), ('P', 'PROFORMA INVOICE'), ('I', 'INVOICE')], default='', max_length=1)),
+                ('paid', models.BooleanField()),
+                ('invoice_count', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Daily revenue',
+                'verbose_name_plural': 'Daily revenue',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrevenue',
+            constraint=models.UniqueConstraint(fields=('day', 'invoice_type', 'paid'), name='daily_revenue_bucket_unique'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:58
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Normalization rules as of this migration (fact_app.dedupe may change them
+# later; rebuild_dedupe_keys() then recomputes the keys)
+BATCH_SIZE = 2000
+MIN_PHONE_DIGITS = 7
+NON_DIGITS = re.compile(r'\D')
+NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_phone(phone):
+    phone = (phone or '').strip()
+    digits = NON_DIGITS.sub('', phone)
+    if phone.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    else:
+        country_code = getattr(settings, 'CUSTOMER_PHONE_COUNTRY_CODE', '237')
+        national = digits.lstrip('0')
+        digits = national if national.startswith(country_code) and len(national) > 10 else country_code + national
+    if len(digits) < MIN_PHONE_DIGITS:
+        return ''
+    return '+' + digits[:15]
+
+
+def fold_name(name, zip_code):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char)).casefold()
+    words = sorted(word for word in NON_WORD.split(name) if word)
+    if not words:
+        return ''
+    zip_code = NON_WORD.sub('', (zip_code or '').casefold())
+    return f"{' '.join(words)}|{zip_code}"[:200]
+
+
+def backfill_dedupe_keys(apps, schema_editor):
+    """Compute the keys of existing customers before their indexes are built"""
+    Customer = apps.get_model('fact_app', 'Customer')
+    fields = ['email_key', 'phone_key', 'name_key']
+    batch = []
+    for customer in Customer.objects.order_by().only('id', 'email', 'phone', 'name', 'zip_code').iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        customer.email_key = (customer.email or '').strip().lower()
+        customer.phone_key = normalize_phone(customer.phone)
+        customer.name_key = fold_name(customer.name, customer.zip_code)
+        batch.append(customer)
+        if len(batch) >= BATCH_SIZE:
+            Customer.objects.bulk_update(batch, fields)
+            batch = []
+    Customer.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0007_daily_revenue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='email_key',
+            field=models.CharField(default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='phone_key',
+            field=models.CharField(default='', editable=False, max_length=16),
+        ),
+        migrations.RunPython(backfill_dedupe_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['email_key'], name='customer_email_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['phone_key'], name='customer_phone_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['name_key'], name='customer_name_key_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0008_customer_dedupe_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('invoice_type', models.CharField(blank=True, default='', max_length=1)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Invoice sequence',
+                'verbose_name_plural': 'Invoice sequences',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedinvoice',
+            name='number',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='number',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('number__isnull', True)), fields=['id'], name='invoice_unnumbered_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoicesequence',
+            constraint=models.UniqueConstraint(fields=('year', 'invoice_type'), name='invoice_sequence_unique'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0010_payments'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_customer_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['customer', '-invoice_date_time', '-id'], include=('number', 'total', 'amount_paid', 'paid', 'invoice_type'), name='invoice_customer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:20
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0011_customer_listing_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='article',
+            name='article_invoice_lines_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedarticle',
+            name='discount_bp',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivedarticle',
+            name='tax_rate_bp',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivedinvoice',
+            name='adjustment',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='discount_bp',
+            field=models.PositiveIntegerField(default=0, help_text='Discount in basis points (1000 = 10%)', validators=[django.core.validators.MaxValueValidator(10000)]),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='tax_rate_bp',
+            field=models.PositiveIntegerField(default=0, help_text='Tax rate in basis points, applied after the discount (1925 = 19.25%)', validators=[django.core.validators.MaxValueValidator(10000)]),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='adjustment',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Amount added to the total after tax (negative for a rebate)', max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['invoice', 'created_at', 'id'], include=('quantity', 'unit_price', 'discount_bp', 'tax_rate_bp'), name='article_invoice_lines_idx'),
+        ),
+    ]
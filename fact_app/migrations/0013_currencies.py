@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:27
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+import fact_app.money
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0012_pricing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter an ISO 4217 currency code, e.g. XAF.')])),
+                ('valid_from', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18, validators=[django.core.validators.MinValueValidator(Decimal('0'))])),
+                ('source', models.CharField(blank=True, max_length=255)),
+                ('loaded_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Exchange rate',
+                'verbose_name_plural': 'Exchange rates',
+                'ordering': ['currency', 'valid_from'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_customer_date_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedinvoice',
+            name='currency',
+            field=models.CharField(default=fact_app.money.get_base_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='currency',
+            field=models.CharField(default=fact_app.money.get_base_currency, help_text='ISO 4217 code of the invoice amounts', max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter an ISO 4217 currency code, e.g. XAF.')]),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['customer', '-invoice_date_time', '-id'], include=('number', 'total', 'currency', 'amount_paid', 'paid', 'invoice_type'), name='invoice_customer_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='fxrate',
+            constraint=models.UniqueConstraint(fields=('currency', 'valid_from'), name='fxrate_currency_day_uniq'),
+        ),
+    ]
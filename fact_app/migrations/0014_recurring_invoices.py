@@ -0,0 +1,92 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:29
+
+from decimal import Decimal
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import fact_app.money
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fact_app', '0013_currencies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringInvoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Subscription name', max_length=255)),
+                ('invoice_type', models.CharField(choices=[('R', 'RECEIPT'), ('P', 'PROFORMA INVOICE'), ('I', 'INVOICE')], default='I', max_length=1)),
+                ('currency', models.CharField(default=fact_app.money.get_base_currency, max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter an ISO 4217 currency code, e.g. XAF.')])),
+                ('adjustment', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('comments', models.TextField(blank=True, max_length=1000)),
+                ('cadence', models.CharField(choices=[('M', 'Monthly'), ('Q', 'Quarterly'), ('Y', 'Yearly')], default='M', max_length=1)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField(blank=True, help_text='Last day a period may start', null=True)),
+                ('billed_periods', models.PositiveIntegerField(default=0, editable=False)),
+                ('next_date', models.DateField(editable=False)),
+                ('active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Recurring invoice',
+                'verbose_name_plural': 'Recurring invoices',
+                'ordering': ['customer', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RecurringInvoiceLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('quantity', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.00'))])),
+                ('discount_bp', models.PositiveIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(10000)])),
+                ('tax_rate_bp', models.PositiveIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(10000)])),
+            ],
+            options={
+                'verbose_name': 'Recurring invoice line',
+                'verbose_name_plural': 'Recurring invoice lines',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='period_start',
+            field=models.DateField(blank=True, editable=False, help_text='First day of the billed period', null=True),
+        ),
+        migrations.AddField(
+            model_name='recurringinvoiceline',
+            name='recurring',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='fact_app.recurringinvoice'),
+        ),
+        migrations.AddField(
+            model_name='recurringinvoice',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recurring_invoices', to='fact_app.customer'),
+        ),
+        migrations.AddField(
+            model_name='recurringinvoice',
+            name='save_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='recurring_invoices_created', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='recurring',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='fact_app.recurringinvoice'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringinvoice',
+            index=models.Index(condition=models.Q(('active', True)), fields=['next_date', 'id'], name='recurring_due_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(condition=models.Q(('recurring__isnull', False)), fields=('recurring', 'period_start'), name='invoice_recurring_period_uniq'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fact_app', '0014_recurring_invoices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(help_text="Recipient (the customer's email when queued)", max_length=254)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('invoice', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='fact_app.invoice')),
+                ('requested_by', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoice_deliveries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Invoice delivery',
+                'verbose_name_plural': 'Invoice deliveries',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['invoice', '-created_at'], name='invoice_delivery_idx'), models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='delivery_pending_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='invoicedelivery',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('invoice',), name='delivery_one_pending_uniq'),
+        ),
+    ]
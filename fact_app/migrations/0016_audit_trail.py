@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:37
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fact_app', '0015_invoice_deliveries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('create', 'Created'), ('update', 'Updated'), ('delete', 'Deleted')], max_length=10)),
+                ('changes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audit_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Audit entry',
+                'verbose_name_plural': 'Audit entries',
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['object_type', 'object_id', 'created_at', 'id'], name='audit_object_idx'), models.Index(fields=['user', 'created_at', 'id'], name='audit_user_idx'), models.Index(fields=['created_at', 'id'], name='audit_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0016_audit_trail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recurringinvoice',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='recurring_invoices', to='fact_app.customer'),
+        ),
+    ]
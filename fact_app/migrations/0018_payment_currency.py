@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:47
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import fact_app.money
+
+
+def backfill_payment_currency(apps, schema_editor):
+    """Matched payments take the currency of their (live or archived) invoice"""
+    Payment = apps.get_model('fact_app', 'Payment')
+    Invoice = apps.get_model('fact_app', 'Invoice')
+    ArchivedInvoice = apps.get_model('fact_app', 'ArchivedInvoice')
+    currency = {
+        model: models.Subquery(model.objects.filter(pk=models.OuterRef('invoice_id')).values('currency')[:1])
+        for model in (Invoice, ArchivedInvoice)
+    }
+    Payment.objects.filter(invoice_id__isnull=False).update(
+        currency=Coalesce(currency[Invoice], currency[ArchivedInvoice], models.F('currency'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0017_recurring_customer_protect'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='currency',
+            field=models.CharField(default=fact_app.money.get_base_currency, max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter an ISO 4217 currency code, e.g. XAF.')]),
+        ),
+        migrations.AddField(
+            model_name='paymentbatch',
+            name='currency',
+            field=models.CharField(default=fact_app.money.get_base_currency, max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter an ISO 4217 currency code, e.g. XAF.')]),
+        ),
+        migrations.RunPython(backfill_payment_currency, migrations.RunPython.noop),
+    ]
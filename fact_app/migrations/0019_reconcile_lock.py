@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:53
+
+from django.db import migrations, models
+
+
+def unmatch_orphaned_payments(apps, schema_editor):
+    """Payments of invoices deleted before they were unmatched on delete go back to review"""
+    Payment = apps.get_model('fact_app', 'Payment')
+    Invoice = apps.get_model('fact_app', 'Invoice')
+    ArchivedInvoice = apps.get_model('fact_app', 'ArchivedInvoice')
+    Payment.objects.filter(invoice_id__isnull=False).exclude(
+        models.Exists(Invoice.objects.filter(pk=models.OuterRef('invoice_id')))
+    ).exclude(
+        models.Exists(ArchivedInvoice.objects.filter(pk=models.OuterRef('invoice_id')))
+    ).update(invoice=None, match='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0018_payment_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconcileLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Reconcile lock',
+                'verbose_name_plural': 'Reconcile locks',
+            },
+        ),
+        migrations.RunPython(unmatch_orphaned_payments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0019_reconcile_lock'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='invoicedelivery',
+            name='delivery_one_pending_uniq',
+        ),
+        migrations.AddField(
+            model_name='invoicedelivery',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invoicedelivery',
+            name='invoice',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='deliveries', to='fact_app.invoice'),
+        ),
+        migrations.AlterField(
+            model_name='invoicedelivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedelivery',
+            index=models.Index(condition=models.Q(('status', 'sending')), fields=['claimed_at'], name='delivery_sending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoicedelivery',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'sending'])), fields=('invoice',), name='delivery_one_pending_uniq'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:12
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Round, TruncDate
+
+# Conversion rules as of this migration (fact_app.fx may change them later;
+# rebuild_customer_rollups then rewrites every share)
+BATCH_SIZE = 2000
+ZERO = Decimal('0.00')
+
+
+def backfill_invoice_rollups(apps, schema_editor):
+    """Record the current share of every invoice, which the stored customer rollups already include"""
+    FxRate = apps.get_model('fact_app', 'FxRate')
+    InvoiceRollup = apps.get_model('fact_app', 'InvoiceRollup')
+    base_currency = getattr(settings, 'BASE_CURRENCY', 'XAF')
+    snapshot = FxRate.objects.filter(
+        currency=models.OuterRef('currency'),
+        valid_from__lte=TruncDate(
+            models.ExpressionWrapper(models.OuterRef('invoice_date_time'), output_field=models.DateTimeField())
+        ),
+    ).order_by('-valid_from').values('rate')[:1]
+    rate = models.Case(
+        models.When(currency=base_currency, then=models.Value(Decimal(1))),
+        default=models.Subquery(snapshot),
+        output_field=models.DecimalField(max_digits=18, decimal_places=8),
+    )
+
+    def converted(amount):
+        return Round(amount * rate, 2, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+
+    def shares(model, archived):
+        rows = model.objects.order_by().values('id', 'customer_id', 'invoice_date_time').annotate(
+            billed=converted(models.F('total')),
+            due=converted(models.F('total') - models.F('amount_paid')),
+            is_paid=models.Value(True) if archived else models.F('paid'),
+        )
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            yield InvoiceRollup(
+                invoice_id=row['id'], customer_id=row['customer_id'], paid=row['is_paid'],
+                billed=row['billed'] or ZERO, outstanding=ZERO if row['is_paid'] else row['due'] or ZERO,
+                invoice_date_time=row['invoice_date_time'],
+            )
+
+    for model, archived in ((apps.get_model('fact_app', 'Invoice'), False),
+                            (apps.get_model('fact_app', 'ArchivedInvoice'), True)):
+        batch = []
+        for share in shares(model, archived):
+            batch.append(share)
+            if len(batch) >= BATCH_SIZE:
+                InvoiceRollup.objects.bulk_create(batch)
+                batch = []
+        InvoiceRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fact_app', '0020_delivery_claims'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceRollup',
+            fields=[
+                ('invoice_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('customer_id', models.BigIntegerField()),
+                ('paid', models.BooleanField()),
+                ('billed', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('outstanding', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('invoice_date_time', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Invoice rollup',
+                'verbose_name_plural': 'Invoice rollups',
+                'indexes': [models.Index(fields=['customer_id', '-invoice_date_time'], name='invoice_rollup_customer_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_invoice_rollups, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,26 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
+from django.core.serializers.json import DjangoJSONEncoder
 from decimal import Decimal
 
+from .money import aggregate_total_cents, from_cents, get_base_currency, to_cents
+from .pricing import MAX_RATE_BP, price_line, price_rows
+
+
+currency_code_validator = RegexValidator(r'^[A-Z]{3}$', "Enter an ISO 4217 currency code, e.g. XAF.")
+
+
+def _price_invoice_articles(invoice):
+    """Price the (possibly prefetched) articles of a live or archived invoice"""
+    return price_rows(
+        ((article.quantity, to_cents(article.unit_price), article.discount_bp, article.tax_rate_bp)
+         for article in invoice.articles.all()),
+        to_cents(invoice.adjustment),
+    )
+
 
 class Customer(models.Model):
     """
@@ -58,25 +75,53 @@ class Customer(models.Model):
         related_name='customers_created'
     )
 
+    # Rollups over live and archived invoices, maintained by fact_app.rollups
+    invoice_count = models.PositiveIntegerField(default=0, editable=False)
+    paid_invoice_count = models.PositiveIntegerField(default=0, editable=False)
+    total_billed = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+    total_outstanding = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+    last_invoice_date = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Normalized keys for duplicate detection, set on save by fact_app.dedupe
+    email_key = models.CharField(max_length=254, default='', editable=False)
+    phone_key = models.CharField(max_length=16, default='', editable=False)
+    name_key = models.CharField(max_length=200, default='', editable=False)
+
     class Meta:
         verbose_name = "Customer"
         verbose_name_plural = "Customers"
         ordering = ['-created_date']
+        # email needs no extra index: unique=True already creates one
         indexes = [
-            models.Index(fields=['email']),
             models.Index(fields=['-created_date']),
+            # Change feed order
+            models.Index(fields=['updated_date', 'id'], name='customer_changes_idx'),
+            # Customers by revenue
+            models.Index(fields=['-total_billed', 'id'], name='customer_revenue_idx'),
+            # Duplicate lookups (forms, imports) and blocking for the dedupe tool
+            models.Index(fields=['email_key'], name='customer_email_key_idx'),
+            models.Index(fields=['phone_key'], name='customer_phone_key_idx'),
+            models.Index(fields=['name_key'], name='customer_name_key_idx'),
         ]
 
     def __str__(self):
         return f"{self.name} ({self.email})"
     
     def get_total_invoices(self):
-        """Get total invoice amount for this customer"""
-        return sum(inv.get_total for inv in self.invoices.all())
+        """
+        Get total invoice amount for this customer (archived invoices included)
+        in the base currency. Computed from the articles; total_billed holds
+        the maintained rollup.
+        """
+        from .fx import aggregate_converted_total_cents, converted_expression
+
+        live, _unconverted = aggregate_converted_total_cents(self.invoices.all())
+        archived = self.archived_invoices.aggregate(total=models.Sum(converted_expression('total')))['total']
+        return from_cents(live) + (archived or Decimal('0.00'))
     
     def get_paid_invoices(self):
-        """Get all paid invoices for this customer"""
-        return self.invoices.filter(paid=True).count()     
+        """Get all paid invoices for this customer (archived invoices are always paid)"""
+        return self.invoices.filter(paid=True).count() + self.archived_invoices.count()     
 
 
 
@@ -92,17 +137,20 @@ class Invoice(models.Model):
         ('I', _('INVOICE'))
     )
 
+    # customer and save_by lead composite indexes (see Meta), so they need no index of their own
     customer = models.ForeignKey(
         Customer,
         on_delete=models.PROTECT,
-        related_name='invoices'
+        related_name='invoices',
+        db_index=False
     )
     save_by = models.ForeignKey(
         User,
         on_delete=models.PROTECT,
         related_name='invoices_created',
         null=True,
-        blank=True
+        blank=True,
+        db_index=False
     )
     invoice_date_time = models.DateTimeField(auto_now_add=True)
     total = models.DecimalField(
@@ -113,28 +161,107 @@ class Invoice(models.Model):
     )
     last_updated_date = models.DateTimeField(null=True, blank=True, auto_now=True)
     paid = models.BooleanField(default=False)
+    # Sum of the payments received, maintained by fact_app.payments
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    adjustment = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        help_text="Amount added to the total after tax (negative for a rebate)"
+    )
+    currency = models.CharField(
+        max_length=3,
+        default=get_base_currency,
+        validators=[currency_code_validator],
+        help_text="ISO 4217 code of the invoice amounts"
+    )
     invoice_type = models.CharField(max_length=1, choices=INVOICE_TYPE, null=True, blank=True)
     comments = models.TextField(null=True, max_length=1000, blank=True)
+    # Sequential number per year and type, assigned right after creation (fact_app.numbering)
+    number = models.CharField(max_length=32, null=True, blank=True, unique=True, editable=False)
+    # Set on invoices generated from a recurring template (fact_app.recurring)
+    recurring = models.ForeignKey(
+        'RecurringInvoice',
+        on_delete=models.SET_NULL,
+        related_name='invoices',
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False
+    )
+    period_start = models.DateField(null=True, blank=True, editable=False, help_text="First day of the billed period")
 
     class Meta:
         verbose_name = "Invoice"
         verbose_name_plural = "Invoices"
         ordering = ['-invoice_date_time']
         indexes = [
-            models.Index(fields=['customer']),
             models.Index(fields=['-invoice_date_time']),
-            models.Index(fields=['paid']),
+            # A customer's invoices, newest first (id breaks ties for keyset pagination).
+            # On PostgreSQL the listed columns are stored in the index, so the
+            # customer listing (fact_app.listing) is an index-only scan.
+            models.Index(
+                fields=['customer', '-invoice_date_time', '-id'],
+                include=['number', 'total', 'currency', 'amount_paid', 'paid', 'invoice_type'],
+                name='invoice_customer_date_idx'
+            ),
+            # Unpaid invoices by date; paid ones (the vast majority) stay out of the index
+            models.Index(
+                fields=['-invoice_date_time'],
+                condition=models.Q(paid=False),
+                name='invoice_unpaid_date_idx'
+            ),
+            # Invoices owned by a user (bulk update scope, user deletion checks), in id order
+            models.Index(fields=['save_by', 'id'], name='invoice_save_by_idx'),
+            # Change feed order
+            models.Index(fields=['last_updated_date', 'id'], name='invoice_changes_idx'),
+            # Invoices still waiting for their number
+            models.Index(fields=['id'], condition=models.Q(number__isnull=True), name='invoice_unnumbered_idx'),
+        ]
+        constraints = [
+            # One invoice per template and period: generation can be re-run safely
+            models.UniqueConstraint(
+                fields=['recurring', 'period_start'],
+                condition=models.Q(recurring__isnull=False),
+                name='invoice_recurring_period_uniq'
+            ),
         ]
 
+    is_archived = False
+
     def __str__(self):
         return f"{self.customer.name} - {self.invoice_date_time.strftime('%Y-%m-%d')} ({self.get_invoice_type_display()})"
 
+    @property
+    def reference(self):
+        """Invoice number, or the id-based reference until the number is assigned"""
+        return self.number or f"INV-{self.pk:05d}"
+
+    @property
+    def total_cents(self):
+        """Total of related articles plus the adjustment, in integer cents"""
+        annotated = getattr(self, 'articles_total_cents', None)
+        if annotated is not None:
+            return annotated
+        if 'articles' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.get_pricing().total
+        return aggregate_total_cents(self.articles.all()) + to_cents(self.adjustment)
+
+    def get_pricing(self):
+        """fact_app.pricing.InvoicePricing of the invoice's articles"""
+        return _price_invoice_articles(self)
+
     @property
     def get_total(self):
         """Calculate total from related articles"""
-        articles = self.articles.all()
-        total = sum(Decimal(str(article.get_total)) for article in articles) if articles else Decimal('0.00')
-        return total
+        return from_cents(self.total_cents)
+
+    @property
+    def outstanding(self):
+        """Amount still due (stored total minus payments), zero once paid"""
+        if self.paid:
+            return Decimal('0.00')
+        return max(self.total - self.amount_paid, Decimal('0.00'))
     
     def mark_as_paid(self):
         """Mark invoice as paid"""
@@ -160,7 +287,8 @@ class Article(models.Model):
     invoice = models.ForeignKey(
         Invoice,
         on_delete=models.CASCADE,
-        related_name='articles'
+        related_name='articles',
+        db_index=False
     )
     name = models.CharField(
         max_length=255,
@@ -176,23 +304,611 @@ class Article(models.Model):
         validators=[MinValueValidator(Decimal('0.00'))],
         help_text="Price per unit"
     )
+    discount_bp = models.PositiveIntegerField(
+        default=0,
+        validators=[MaxValueValidator(MAX_RATE_BP)],
+        help_text="Discount in basis points (1000 = 10%)"
+    )
+    tax_rate_bp = models.PositiveIntegerField(
+        default=0,
+        validators=[MaxValueValidator(MAX_RATE_BP)],
+        help_text="Tax rate in basis points, applied after the discount (1925 = 19.25%)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Article'
         verbose_name_plural = 'Articles'
         ordering = ['created_at']
         indexes = [
-            models.Index(fields=['invoice']),
+            # Change feed order
+            models.Index(fields=['updated_at', 'id'], name='article_changes_idx'),
+            # Lines of an invoice in display order. On PostgreSQL, the priced
+            # columns are stored in the index so totals are index-only scans.
+            models.Index(
+                fields=['invoice', 'created_at', 'id'],
+                include=['quantity', 'unit_price', 'discount_bp', 'tax_rate_bp'],
+                name='article_invoice_lines_idx'
+            ),
         ]
 
     def __str__(self):
         return f"{self.name} (x{self.quantity})"
 
+    @property
+    def total_cents(self):
+        """Line total in integer cents, after discount and tax"""
+        return self.get_price().total
+
+    def get_price(self):
+        """fact_app.pricing.LinePrice of the line"""
+        return price_line(self.quantity, to_cents(self.unit_price), self.discount_bp, self.tax_rate_bp)
+
     @property
     def get_total(self):
         """Calculate total for this line item"""
-        return self.quantity * self.unit_price 
+        return from_cents(self.total_cents)
         
 
 
+class ArchivedInvoice(models.Model):
+    """
+    Cold storage for old paid invoices.
+    Rows keep the primary key they had in Invoice and are read-only.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.PROTECT,
+        related_name='archived_invoices'
+    )
+    save_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='archived_invoices_created',
+        null=True,
+        blank=True
+    )
+    invoice_date_time = models.DateTimeField()
+    total = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    last_updated_date = models.DateTimeField(null=True, blank=True)
+    paid = models.BooleanField(default=True)
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    adjustment = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    currency = models.CharField(max_length=3, default=get_base_currency)
+    invoice_type = models.CharField(max_length=1, choices=Invoice.INVOICE_TYPE, null=True, blank=True)
+    comments = models.TextField(null=True, max_length=1000, blank=True)
+    number = models.CharField(max_length=32, null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    is_archived = True
+
+    class Meta:
+        verbose_name = "Archived invoice"
+        verbose_name_plural = "Archived invoices"
+        ordering = ['-invoice_date_time']
+        indexes = [
+            models.Index(fields=['-invoice_date_time']),
+        ]
+
+    def __str__(self):
+        return f"{self.customer.name} - {self.invoice_date_time.strftime('%Y-%m-%d')} ({self.get_invoice_type_display()})"
+
+    @property
+    def reference(self):
+        return self.number or f"INV-{self.pk:05d}"
+
+    @property
+    def total_cents(self):
+        """Total frozen when the invoice was archived, in integer cents"""
+        return to_cents(self.total)
+
+    @property
+    def get_total(self):
+        return self.total
+
+    @property
+    def outstanding(self):
+        return Decimal('0.00')
+
+    def get_pricing(self):
+        return _price_invoice_articles(self)
+
+    def get_article_count(self):
+        return self.articles.count()
+
+
+class ArchivedArticle(models.Model):
+    """
+    Line items of archived invoices
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    invoice = models.ForeignKey(
+        ArchivedInvoice,
+        on_delete=models.CASCADE,
+        related_name='articles'
+    )
+    name = models.CharField(max_length=255)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+    discount_bp = models.PositiveIntegerField(default=0)
+    tax_rate_bp = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Archived article'
+        verbose_name_plural = 'Archived articles'
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.name} (x{self.quantity})"
+
+    @property
+    def total_cents(self):
+        return self.get_price().total
+
+    def get_price(self):
+        return price_line(self.quantity, to_cents(self.unit_price), self.discount_bp, self.tax_rate_bp)
+
+    @property
+    def get_total(self):
+        return from_cents(self.total_cents)
+
+
+class InvoiceSequence(models.Model):
+    """
+    Last number issued per (year, invoice type).
+    Numbers are taken under a row lock in the transaction that stores them,
+    so a rolled back allocation gives its numbers back: no gaps.
+    """
+
+    year = models.PositiveIntegerField()
+    invoice_type = models.CharField(max_length=1, blank=True, default='')
+    last_number = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Invoice sequence'
+        verbose_name_plural = 'Invoice sequences'
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'invoice_type'], name='invoice_sequence_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.year}/{self.invoice_type or '-'}: {self.last_number}"
+
+
+class PaymentBatch(models.Model):
+    """
+    One reconciled bank statement (see fact_app.payments.reconcile_statement)
+    """
+
+    name = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    save_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='payment_batches_created',
+        null=True,
+        blank=True
+    )
+    # A statement is one bank account: all its lines are in this currency
+    currency = models.CharField(max_length=3, default=get_base_currency, validators=[currency_code_validator])
+    line_count = models.PositiveIntegerField(default=0)
+    matched_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    matched_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Payment batch'
+        verbose_name_plural = 'Payment batches'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name or f'Statement {self.pk}'} ({self.matched_count}/{self.line_count} matched)"
+
+
+class Payment(models.Model):
+    """
+    Money received, applied to an invoice (partial payments add up in
+    Invoice.amount_paid) or left unmatched (invoice is NULL) for review.
+
+    invoice has no database constraint: archived invoices keep their id,
+    so their payments still point to them. The payments of a deleted invoice
+    are unmatched (fact_app.payments.unmatch_payments).
+    """
+    MATCH_MANUAL = 'manual'
+    MATCH_REFERENCE = 'reference'
+    MATCH_AMOUNT = 'amount'
+    MATCH_TYPES = (
+        (MATCH_MANUAL, _('Manual')),
+        (MATCH_REFERENCE, _('Reference')),
+        (MATCH_AMOUNT, _('Amount')),
+    )
+
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='payments',
+        null=True,
+        blank=True,
+        db_index=False
+    )
+    batch = models.ForeignKey(
+        PaymentBatch,
+        on_delete=models.PROTECT,
+        related_name='payments',
+        null=True,
+        blank=True
+    )
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))]
+    )
+    # The invoice's currency when matched: payments only settle invoices in their currency
+    currency = models.CharField(max_length=3, default=get_base_currency, validators=[currency_code_validator])
+    received_on = models.DateField(default=timezone.localdate)
+    reference = models.CharField(max_length=255, blank=True, default='')
+    match = models.CharField(max_length=10, choices=MATCH_TYPES, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    save_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='payments_created',
+        null=True,
+        blank=True,
+        db_index=False
+    )
+
+    class Meta:
+        verbose_name = 'Payment'
+        verbose_name_plural = 'Payments'
+        ordering = ['received_on', 'id']
+        indexes = [
+            # An invoice's payments (amount_paid recomputation)
+            models.Index(fields=['invoice', 'received_on'], name='payment_invoice_idx'),
+            # Lines left for manual review
+            models.Index(fields=['id'], condition=models.Q(invoice__isnull=True), name='payment_unmatched_idx'),
+        ]
+
+    def __str__(self):
+        target = f"invoice {self.invoice_id}" if self.invoice_id else "unmatched"
+        return f"{self.amount} on {self.received_on} ({target})"
+
+
+class ReconcileLock(models.Model):
+    """
+    One row per statement currency, locked while a statement in that
+    currency is reconciled: reconciliations run one at a time
+    """
+
+    currency = models.CharField(max_length=3, unique=True)
+
+    class Meta:
+        verbose_name = 'Reconcile lock'
+        verbose_name_plural = 'Reconcile locks'
+
+    def __str__(self):
+        return self.currency
+
+
+class FxRate(models.Model):
+    """
+    Exchange rate snapshot: the value of one unit of a currency in the base
+    currency (BASE_CURRENCY setting), from valid_from until the next snapshot
+    of that currency. Loaded from files by the load_fx_rates command.
+    """
+
+    currency = models.CharField(max_length=3, validators=[currency_code_validator])
+    valid_from = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8, validators=[MinValueValidator(Decimal('0'))])
+    source = models.CharField(max_length=255, blank=True)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Exchange rate'
+        verbose_name_plural = 'Exchange rates'
+        ordering = ['currency', 'valid_from']
+        constraints = [
+            # Also serves the rate lookups: currency = %s AND valid_from <= %s ORDER BY valid_from DESC
+            models.UniqueConstraint(fields=['currency', 'valid_from'], name='fxrate_currency_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.valid_from}: {self.rate}"
+
+
+class RecurringInvoice(models.Model):
+    """
+    Template of a subscription invoice, billed every cadence period from
+    start_date (until end_date when set) by fact_app.recurring
+    """
+
+    CADENCE_MONTHLY = 'M'
+    CADENCE_QUARTERLY = 'Q'
+    CADENCE_YEARLY = 'Y'
+    CADENCE_CHOICES = (
+        (CADENCE_MONTHLY, _('Monthly')),
+        (CADENCE_QUARTERLY, _('Quarterly')),
+        (CADENCE_YEARLY, _('Yearly')),
+    )
+
+    # Deleting a customer must not silently drop its subscriptions (merges move them first)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='recurring_invoices')
+    save_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='recurring_invoices_created')
+    name = models.CharField(max_length=255, help_text="Subscription name")
+    invoice_type = models.CharField(max_length=1, choices=Invoice.INVOICE_TYPE, default='I')
+    currency = models.CharField(max_length=3, default=get_base_currency, validators=[currency_code_validator])
+    adjustment = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    comments = models.TextField(max_length=1000, blank=True)
+    cadence = models.CharField(max_length=1, choices=CADENCE_CHOICES, default=CADENCE_MONTHLY)
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True, help_text="Last day a period may start")
+    # Periods billed so far; next_date is the start of the next one (kept in sync by fact_app.recurring)
+    billed_periods = models.PositiveIntegerField(default=0, editable=False)
+    next_date = models.DateField(editable=False)
+    active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Recurring invoice'
+        verbose_name_plural = 'Recurring invoices'
+        ordering = ['customer', 'id']
+        indexes = [
+            # Templates due for billing; finished and paused ones stay out of the index
+            models.Index(fields=['next_date', 'id'], condition=models.Q(active=True), name='recurring_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_cadence_display()})"
+
+    def save(self, *args, **kwargs):
+        # Billing starts on start_date; later edits of start_date only move unbilled templates
+        if not self.billed_periods:
+            self.next_date = self.start_date
+        super().save(*args, **kwargs)
+
+
+class RecurringInvoiceLine(models.Model):
+    """
+    Line copied to every invoice generated from a recurring template
+    """
+
+    recurring = models.ForeignKey(RecurringInvoice, on_delete=models.CASCADE, related_name='lines')
+    name = models.CharField(max_length=255)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    unit_price = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal('0.00'))])
+    discount_bp = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(MAX_RATE_BP)])
+    tax_rate_bp = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(MAX_RATE_BP)])
+
+    class Meta:
+        verbose_name = 'Recurring invoice line'
+        verbose_name_plural = 'Recurring invoice lines'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+
+
+class InvoiceDelivery(models.Model):
+    """
+    Sending of an invoice by email to its customer (fact_app.delivery).
+    Pending deliveries are claimed (sending) by Celery tasks and retried
+    until DELIVERY_MAX_ATTEMPTS attempts failed.
+
+    invoice has no database constraint: archived invoices keep their id,
+    so their delivery history stays. The deliveries of a deleted invoice
+    are deleted with it (fact_app.delivery.delete_invoice_deliveries).
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_SENDING, _('Sending')),
+        (STATUS_SENT, _('Sent')),
+        (STATUS_FAILED, _('Failed')),
+    )
+
+    # invoice leads the invoice_delivery_idx index, so it needs no index of its own
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='deliveries',
+        db_index=False
+    )
+    email = models.EmailField(help_text="Recipient (the customer's email when queued)")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    requested_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name='invoice_deliveries', null=True, blank=True, db_index=False
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    # When a sending task last claimed it (status sending, or pending after a failed attempt)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Invoice delivery'
+        verbose_name_plural = 'Invoice deliveries'
+        ordering = ['-created_at']
+        indexes = [
+            # Deliveries of an invoice, newest first
+            models.Index(fields=['invoice', '-created_at'], name='invoice_delivery_idx'),
+            # Deliveries still to send; sent and failed ones stay out of the index
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='delivery_pending_idx'),
+            # Claims left by a worker that died (requeued by queue_stale_deliveries)
+            models.Index(fields=['claimed_at'], condition=models.Q(status='sending'), name='delivery_sending_idx'),
+        ]
+        constraints = [
+            # Queueing an invoice twice does not send it twice
+            models.UniqueConstraint(
+                fields=['invoice'], condition=models.Q(status__in=['pending', 'sending']),
+                name='delivery_one_pending_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Invoice {self.invoice_id} to {self.email} ({self.status})"
+
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted (or archived) customer, invoice or article,
+    so change feed consumers can drop their copy
+    """
+    ACTION_DELETED = 'deleted'
+    ACTION_ARCHIVED = 'archived'
+    ACTIONS = (
+        (ACTION_DELETED, _('Deleted')),
+        (ACTION_ARCHIVED, _('Archived')),
+    )
+
+    object_type = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS, default=ACTION_DELETED)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Tombstone'
+        verbose_name_plural = 'Tombstones'
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_changes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} ({self.action})"
+
+
+class DailyRevenue(models.Model):
+    """
+    Revenue rollup: invoices and amounts per day, invoice type and payment status.
+    Maintained by fact_app.reports; archived invoices are included (as paid).
+    """
+
+    day = models.DateField()
+    invoice_type = models.CharField(max_length=1, choices=Invoice.INVOICE_TYPE, blank=True, default='')
+    paid = models.BooleanField()
+    invoice_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Daily revenue'
+        verbose_name_plural = 'Daily revenue'
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'invoice_type', 'paid'], name='daily_revenue_bucket_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.invoice_type or '-'} {'paid' if self.paid else 'unpaid'}: {self.total}"
+
+
+class InvoiceRollup(models.Model):
+    """
+    What an invoice (live or archived) currently adds to its customer's
+    rollups, in the base currency (fact_app.rollups). A changed invoice moves
+    the rollups by the difference with this row, instead of a recompute of
+    the customer. No foreign keys: the row outlives a deleted invoice until
+    its share is withdrawn.
+    """
+
+    invoice_id = models.BigIntegerField(primary_key=True)
+    customer_id = models.BigIntegerField()
+    paid = models.BooleanField()
+    billed = models.DecimalField(max_digits=14, decimal_places=2)
+    outstanding = models.DecimalField(max_digits=14, decimal_places=2)
+    invoice_date_time = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Invoice rollup'
+        verbose_name_plural = 'Invoice rollups'
+        indexes = [
+            # A customer's shares, and its last invoice date from the top of the index
+            models.Index(fields=['customer_id', '-invoice_date_time'], name='invoice_rollup_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"Invoice {self.invoice_id} -> customer {self.customer_id}: {self.billed}"
+
+
+class AuditEntry(models.Model):
+    """
+    Append-only record of a change to a customer, invoice or article
+    (fact_app.audit): changes maps each audited field to [old, new].
+    Entries are never updated or deleted.
+    """
+
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTIONS = (
+        (ACTION_CREATE, _('Created')),
+        (ACTION_UPDATE, _('Updated')),
+        (ACTION_DELETE, _('Deleted')),
+    )
+
+    object_type = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # user leads the audit_user_idx index, so it needs no index of its own
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name='audit_entries', null=True, blank=True, db_index=False
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Audit entry'
+        verbose_name_plural = 'Audit entries'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # History of one object, by user, and of a period: all read newest first by (created_at, id)
+            models.Index(fields=['object_type', 'object_id', 'created_at', 'id'], name='audit_object_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='audit_user_idx'),
+            models.Index(fields=['created_at', 'id'], name='audit_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} {self.action} ({self.created_at:%Y-%m-%d %H:%M})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Audit entries cannot be modified.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Audit entries cannot be deleted.")
+
+
+class ApiToken(models.Model):
+    """
+    Key of an API client, sent as "Authorization: Token <key>" and acting as
+    its user (fact_app.tokens). Only the SHA-256 of the key is stored.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'API token'
+        verbose_name_plural = 'API tokens'
+        ordering = ['-created_date']
+
+    def __str__(self):
+        return f"{self.name} ({self.user})"
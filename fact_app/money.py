@@ -0,0 +1,137 @@
+"""
+Money helpers for invoice totals
+All totals are computed in integer cents; amounts are rounded exactly once,
+when they enter the system through to_cents(). Line discounts and taxes
+follow the rounding rule of fact_app.pricing.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .pricing import BASIS_POINTS
+
+CENTS_PER_UNIT = 100
+TWO_PLACES = Decimal('0.01')
+
+# Display symbol of the currencies that have one; others show their ISO code
+CURRENCY_SYMBOLS = {
+    'XAF': 'FCFA',
+    'XOF': 'FCFA',
+    'EUR': '€',
+    'USD': '$',
+    'GBP': '£',
+}
+
+
+def get_base_currency():
+    """BASE_CURRENCY setting: currency of reports, rollups and converted totals"""
+    return getattr(settings, 'BASE_CURRENCY', 'XAF')
+
+
+def currency_symbol(currency):
+    return CURRENCY_SYMBOLS.get(currency, currency)
+
+
+def format_amount(amount, currency):
+    """'1234.50 FCFA' style display of an amount"""
+    return f"{amount} {currency_symbol(currency)}"
+
+
+def to_cents(amount):
+    """
+    Convert an amount to integer cents.
+
+    This is the only rounding point: values with more than two decimal
+    places are rounded half-up to the nearest cent.
+
+    Args:
+        amount: Decimal, int or numeric string
+
+    Returns:
+        Integer number of cents
+    """
+    if isinstance(amount, int):
+        return amount * CENTS_PER_UNIT
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    if amount.as_tuple().exponent < -2:
+        amount = amount.quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+    return int(amount.scaleb(2))
+
+
+def from_cents(cents):
+    """Convert integer cents to a Decimal with two decimal places"""
+    return Decimal(cents).scaleb(-2)
+
+
+def format_cents(cents):
+    """Serialize integer cents as a plain '1234.50' string"""
+    return str(from_cents(cents))
+
+
+def _amount_cents(field):
+    return Cast(Round(F(field) * CENTS_PER_UNIT), BigIntegerField())
+
+
+def _rounded_share_expression(amount, rate):
+    # Same as pricing.rounded_share(): amounts are never negative, so the
+    # truncating integer division of PostgreSQL and SQLite rounds down
+    return ExpressionWrapper(
+        (amount * F(rate) + BASIS_POINTS // 2) / BASIS_POINTS,
+        output_field=BigIntegerField(),
+    )
+
+
+def cents_expression(prefix=''):
+    """
+    SQL expression for the total of an Article row in integer cents,
+    rounded exactly like fact_app.pricing.price_line().
+
+    Args:
+        prefix: Lookup prefix to reach Article fields, e.g. 'articles__'
+    """
+    gross = ExpressionWrapper(
+        F(f'{prefix}quantity') * _amount_cents(f'{prefix}unit_price'),
+        output_field=BigIntegerField(),
+    )
+    net = ExpressionWrapper(
+        gross - _rounded_share_expression(gross, f'{prefix}discount_bp'),
+        output_field=BigIntegerField(),
+    )
+    return ExpressionWrapper(net + _rounded_share_expression(net, f'{prefix}tax_rate_bp'), output_field=BigIntegerField())
+
+
+def sum_cents_expression(prefix=''):
+    """SQL aggregate summing article totals in integer cents (0 when empty)"""
+    return Coalesce(
+        Sum(cents_expression(prefix), output_field=BigIntegerField()),
+        0,
+        output_field=BigIntegerField(),
+    )
+
+
+def adjustment_cents_expression(prefix=''):
+    """SQL expression for the adjustment of an Invoice row in integer cents"""
+    return _amount_cents(f'{prefix}adjustment')
+
+
+def annotate_totals(queryset):
+    """
+    Annotate an Invoice queryset with articles_total_cents (its article lines
+    plus its adjustment) so that Invoice.get_total does not query articles
+    for each row.
+    """
+    return queryset.annotate(
+        articles_total_cents=ExpressionWrapper(
+            sum_cents_expression('articles__') + adjustment_cents_expression(),
+            output_field=BigIntegerField(),
+        )
+    )
+
+
+def aggregate_total_cents(articles):
+    """Sum an Article queryset in integer cents with one query"""
+    return articles.aggregate(total=sum_cents_expression())['total']
+
@@ -0,0 +1,143 @@
+"""
+Invoice numbering
+Invoices get a number per (year, invoice type) in date order: I-2026-00001,
+I-2026-00002, ... The counter lives in an InvoiceSequence row. Allocation
+leaves no gaps (a rolled back invoice takes no number), but numbers are
+never reused: deleting a numbered invoice leaves a gap in its sequence, by
+design. Cancel an invoice already sent with a correcting invoice rather
+than deleting it.
+
+The counter row is locked only by a short transaction run right after the
+invoice's own transaction commits, never while the invoice and its articles
+are being written: concurrent invoice creations only queue for the few
+milliseconds the allocation takes. A batch of invoices takes its numbers
+with a single lock per (year, type).
+
+Invoices whose numbering failed keep number=NULL and are numbered by the
+assign_invoice_numbers_task beat job.
+"""
+import logging
+import threading
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from .events import INVOICE_UPDATED, publish_invoice_event
+from .models import Invoice, InvoiceSequence
+
+logger = logging.getLogger(__name__)
+
+NUMBER_PREFIXES = {'I': 'I', 'P': 'P', 'R': 'R', '': 'N'}
+NUMBER_FORMAT = '{prefix}-{year}-{number:05d}'
+NUMBERING_BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+def format_invoice_number(year, invoice_type, number):
+    return NUMBER_FORMAT.format(prefix=NUMBER_PREFIXES[invoice_type or ''], year=year, number=number)
+
+
+def allocate_numbers(year, invoice_type, count=1):
+    """
+    Take the next count numbers of a sequence. Must run inside a transaction:
+    the counter stays locked until it commits.
+
+    Returns:
+        range of the allocated numbers
+    """
+    invoice_type = invoice_type or ''
+    sequences = InvoiceSequence.objects.select_for_update()
+    sequence = sequences.filter(year=year, invoice_type=invoice_type).first()
+    if sequence is None:
+        # First number of the year: concurrent creators race on the insert, one wins
+        InvoiceSequence.objects.bulk_create(
+            [InvoiceSequence(year=year, invoice_type=invoice_type)], ignore_conflicts=True
+        )
+        sequence = sequences.get(year=year, invoice_type=invoice_type)
+    first = sequence.last_number + 1
+    sequence.last_number += count
+    sequence.save(update_fields=['last_number'])
+    return range(first, sequence.last_number + 1)
+
+
+def _sequence_key(invoice):
+    return timezone.localdate(invoice.invoice_date_time).year, invoice.invoice_type or ''
+
+
+def assign_invoice_numbers(invoice_ids):
+    """
+    Number the given invoices that have no number yet, in date order
+    (then id order, for invoices created at the same instant).
+
+    Returns:
+        Number of invoices numbered
+    """
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    numbered = 0
+    for start in range(0, len(invoice_ids), NUMBERING_BATCH_SIZE):
+        chunk = invoice_ids[start:start + NUMBERING_BATCH_SIZE]
+        with transaction.atomic():
+            # Locking the invoices makes a concurrent assigner skip them once we commit
+            invoices = list(
+                Invoice.objects.select_for_update()
+                .filter(id__in=chunk, number__isnull=True)
+                .order_by('invoice_date_time', 'id')
+                .only('id', 'invoice_type', 'invoice_date_time')
+            )
+            now = timezone.now()
+            # Counters are always locked in the same (year, type) order: no deadlocks
+            for (year, invoice_type), group in groupby(sorted(invoices, key=_sequence_key), key=_sequence_key):
+                group = list(group)
+                for invoice, number in zip(group, allocate_numbers(year, invoice_type, len(group))):
+                    invoice.number = format_invoice_number(year, invoice_type, number)
+                    # bulk_update() bypasses auto_now: stamp the change for the feed and caches
+                    invoice.last_updated_date = now
+            Invoice.objects.bulk_update(invoices, ['number', 'last_updated_date'])
+            if invoices:
+                publish_invoice_event(INVOICE_UPDATED, [invoice.pk for invoice in invoices])
+        numbered += len(invoices)
+    return numbered
+
+
+def assign_pending_invoice_numbers():
+    """
+    Number every invoice still without a number (e.g. after a failed post-commit assignment).
+
+    Returns:
+        Number of invoices numbered
+    """
+    invoice_ids = list(
+        Invoice.objects.filter(number__isnull=True).order_by('invoice_date_time', 'id').values_list('id', flat=True)
+    )
+    numbered = assign_invoice_numbers(invoice_ids)
+    if numbered:
+        logger.info("Numbered %d pending invoices", numbered)
+    return numbered
+
+
+class _PendingInvoices:
+    """Invoices created in the current transaction"""
+
+    def __init__(self):
+        self.invoice_ids = set()
+        self.flushed = False
+
+    def flush(self):
+        # Registered once per invoice: only the first call after commit does the work
+        if self.flushed:
+            return
+        self.flushed = True
+        assign_invoice_numbers(sorted(self.invoice_ids))
+
+
+def number_after_commit(invoice_ids):
+    """Number these invoices once the current transaction commits"""
+    pending = getattr(_local, 'pending', None)
+    if pending is None or pending.flushed:
+        pending = _local.pending = _PendingInvoices()
+    pending.invoice_ids.update(invoice_ids)
+    # Ids of a rolled back transaction no longer exist when the next one flushes: they are skipped.
+    # robust: a failure must not fail the request; assign_invoice_numbers_task catches up.
+    transaction.on_commit(pending.flush, robust=True)
@@ -0,0 +1,309 @@
+"""
+Payments
+Money received is stored as Payment rows, entered one by one
+(record_payment) or reconciled from a bank statement (reconcile_statement).
+Invoice.amount_paid is recomputed from the payments and an invoice becomes
+paid once they cover its total.
+
+Reconciling matches statement lines to open invoices in memory: one scan of
+the unpaid invoices fills hash maps keyed by invoice reference and by
+outstanding amount, so each line costs a dictionary lookup. The results are
+written with bulk INSERTs and chunked UPDATEs, in one transaction.
+
+Amounts are only compared within one currency: a payment carries the
+currency of its invoice, and a statement (one bank account) is matched
+against the open invoices in its own currency only. Statements in one
+currency are reconciled one at a time (ReconcileLock row lock).
+
+The payments of a deleted invoice are kept, unmatched, for review.
+"""
+import csv
+import logging
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .audit import record_updates
+from .changes import stamp_on_commit
+from .events import INVOICE_UPDATED, publish_invoice_event
+from .models import Invoice, Payment, PaymentBatch, ReconcileLock
+from .money import from_cents, get_base_currency, to_cents
+from .numbering import NUMBER_PREFIXES
+from .rollups import mark_invoice_rows_dirty
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_BATCH_SIZE = 2000
+PAYMENT_UPDATE_CHUNK = 500
+# Lines per API request; larger statements go through the reconcile_payments command
+STATEMENT_MAX_LINES = 10000
+ZERO = Decimal('0.00')
+_REFERENCE_MAX_LENGTH = Payment._meta.get_field('reference').max_length
+
+# Invoice numbers (I-2026-00042) and id-based references (INV-00042) in free text
+REFERENCE_PATTERN = re.compile(
+    r'\b(?:(?:%s)-\d{4}-\d{5,}|INV-(\d+))\b' % '|'.join(sorted(set(NUMBER_PREFIXES.values()))),
+    re.IGNORECASE,
+)
+
+StatementLine = namedtuple('StatementLine', ['received_on', 'amount', 'reference'])
+
+
+def parse_amount(value):
+    """Positive Decimal amount with at most 2 decimals, raising ValueError otherwise"""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, Decimal)):
+        raise ValueError("must be a decimal string or a number")
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError("must be a decimal string or a number")
+    if not amount.is_finite() or amount <= 0 or amount.as_tuple().exponent < -2:
+        raise ValueError("must be positive with at most 2 decimal places")
+    if amount >= Decimal('1e10'):
+        raise ValueError("is too large")
+    return amount
+
+
+def parse_statement_line(data):
+    """
+    Validate one statement line: {"amount": "120.00", "reference": "...", "date": "2026-01-31"}
+
+    Raises:
+        ValueError: With a message naming the invalid field
+    """
+    if not isinstance(data, dict):
+        raise ValueError("must be an object")
+    try:
+        amount = parse_amount(data.get('amount'))
+    except ValueError as exc:
+        raise ValueError(f"amount {exc}")
+    reference = data.get('reference') or ''
+    if not isinstance(reference, str):
+        raise ValueError("reference must be a string")
+    received_on = data.get('date')
+    if received_on:
+        received_on = parse_date(received_on) if isinstance(received_on, str) else None
+        if received_on is None:
+            raise ValueError("date must be a YYYY-MM-DD date")
+    return StatementLine(received_on or timezone.localdate(), amount, reference.strip()[:_REFERENCE_MAX_LENGTH])
+
+
+def read_statement_csv(source):
+    """
+    Read statement lines from a CSV file with columns date,amount,reference.
+
+    Returns:
+        Tuple (lines, skipped row numbers)
+    """
+    reader = csv.DictReader(source)
+    missing = {'amount', 'reference'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+    lines, skipped = [], []
+    for row_number, row in enumerate(reader, start=2):
+        try:
+            lines.append(parse_statement_line(row))
+        except ValueError:
+            skipped.append(row_number)
+    return lines, skipped
+
+
+def refresh_amount_paid(invoice_ids):
+    """
+    Recompute Invoice.amount_paid from the payments and mark the invoices
+    they now cover as paid. Never marks an invoice unpaid: it may have been
+    settled outside the recorded payments (mark_as_paid).
+
+    Returns:
+        List of the ids of the invoices that became paid
+    """
+    invoice_ids = list(invoice_ids)
+    received = (
+        Payment.objects.filter(invoice_id=OuterRef('pk')).order_by()
+        .values('invoice_id').annotate(received=Sum('amount')).values('received')
+    )
+    amount = DecimalField(max_digits=12, decimal_places=2)
+    newly_paid = []
+    now = timezone.now()
+    # Stamped before chunks that may run long inside the caller's transaction: re-stamped at commit if so
+    stamp_on_commit(Invoice, invoice_ids, now)
+    for start in range(0, len(invoice_ids), PAYMENT_UPDATE_CHUNK):
+        chunk = invoice_ids[start:start + PAYMENT_UPDATE_CHUNK]
+        # QuerySet.update() bypasses auto_now: stamp the change feed explicitly
+        Invoice.objects.filter(id__in=chunk).update(
+            amount_paid=Coalesce(Subquery(received, output_field=amount), Value(ZERO), output_field=amount),
+            last_updated_date=now,
+        )
+        covered = list(
+            Invoice.objects.filter(id__in=chunk, paid=False, total__gt=0, amount_paid__gte=F('total'))
+            .values_list('id', flat=True)
+        )
+        if covered:
+            Invoice.objects.filter(id__in=covered).update(paid=True)
+            record_updates(Invoice, covered, {'paid': [False, True]})
+            newly_paid.extend(covered)
+    return newly_paid
+
+
+def _payments_applied(invoice_ids):
+    """Refresh amounts, rollups and open lists after payments were added to these invoices"""
+    invoice_ids = sorted(set(invoice_ids))
+    newly_paid = refresh_amount_paid(invoice_ids)
+    # QuerySet.update() sends no signals: refresh the outstanding rollups here
+    for start in range(0, len(invoice_ids), PAYMENT_UPDATE_CHUNK):
+        mark_invoice_rows_dirty(
+            Invoice.objects.filter(id__in=invoice_ids[start:start + PAYMENT_UPDATE_CHUNK])
+            .only('id', 'customer_id', 'invoice_date_time')
+        )
+    if newly_paid:
+        publish_invoice_event(INVOICE_UPDATED, newly_paid, {'paid': True})
+    partial = sorted(set(invoice_ids) - set(newly_paid))
+    if partial:
+        publish_invoice_event(INVOICE_UPDATED, partial)
+    return newly_paid
+
+
+@transaction.atomic
+def record_payment(user, invoice, amount, received_on=None, reference=''):
+    """
+    Record a (possibly partial) payment of an invoice.
+
+    Returns:
+        The Payment
+    """
+    payment = Payment.objects.create(
+        invoice=invoice,
+        amount=amount,
+        currency=invoice.currency,
+        received_on=received_on or timezone.localdate(),
+        reference=reference[:_REFERENCE_MAX_LENGTH],
+        match=Payment.MATCH_MANUAL,
+        save_by=user,
+    )
+    _payments_applied([invoice.pk])
+    logger.info("Payment of %s recorded on invoice %s by %s", amount, invoice.pk, user)
+    return payment
+
+
+def unmatch_payments(invoice_ids):
+    """Leave the payments of deleted invoices unmatched, for manual review"""
+    Payment.objects.filter(invoice_id__in=invoice_ids).update(invoice=None, match='')
+
+
+class _OpenInvoices:
+    """
+    Outstanding balances of the unpaid invoices in one currency, indexed by
+    reference and by amount
+    """
+
+    def __init__(self, currency, invoices=None):
+        self.outstanding = {}
+        self.by_number = {}
+        # Outstanding cents -> invoice ids, oldest invoice first (dicts keep insertion order)
+        self.by_amount = {}
+        invoices = Invoice.objects.all() if invoices is None else invoices
+        rows = (
+            invoices.filter(paid=False, currency=currency).order_by('invoice_date_time', 'id')
+            .values_list('id', 'number', 'total', 'amount_paid')
+        )
+        for invoice_id, number, total, amount_paid in rows.iterator(chunk_size=PAYMENT_BATCH_SIZE):
+            cents = to_cents(total) - to_cents(amount_paid)
+            self.outstanding[invoice_id] = cents
+            if number:
+                self.by_number[number.upper()] = invoice_id
+            if cents > 0:
+                self.by_amount.setdefault(cents, {})[invoice_id] = None
+
+    def match(self, cents, reference):
+        """Invoice id and match type for a statement line, or (None, '')"""
+        for found in REFERENCE_PATTERN.finditer(reference):
+            invoice_id = int(found.group(1)) if found.group(1) else self.by_number.get(found.group(0).upper())
+            if invoice_id in self.outstanding:
+                return invoice_id, Payment.MATCH_REFERENCE
+        candidates = self.by_amount.get(cents)
+        if candidates:
+            return next(iter(candidates)), Payment.MATCH_AMOUNT
+        return None, ''
+
+    def apply(self, invoice_id, cents):
+        before = self.outstanding[invoice_id]
+        after = self.outstanding[invoice_id] = before - cents
+        candidates = self.by_amount.get(before)
+        if candidates is not None:
+            candidates.pop(invoice_id, None)
+            if not candidates:
+                del self.by_amount[before]
+        if after > 0:
+            self.by_amount.setdefault(after, {})[invoice_id] = None
+
+
+def reconcile_statement(user, lines, name='', currency=None, invoices=None):
+    """
+    Apply statement lines to the open invoices in the statement currency
+    (default: the base currency), among invoices (default: all of them).
+
+    A line goes to the invoice whose number (or INV- reference) appears in its
+    reference text, partial payments included; otherwise to the oldest open
+    invoice whose outstanding amount is exactly the line amount. Other lines,
+    including those naming an invoice in another currency, are stored
+    unmatched (Payment.invoice is NULL) for manual review.
+
+    Statements in one currency are reconciled one at a time: a concurrent run
+    waits for the ReconcileLock row, then reads the balances this one left.
+
+    Returns:
+        The PaymentBatch, with newly_paid set to the ids of the invoices it settled
+    """
+    lines = list(lines)
+    currency = currency or get_base_currency()
+
+    with transaction.atomic():
+        ReconcileLock.objects.get_or_create(currency=currency)
+        ReconcileLock.objects.select_for_update().get(currency=currency)
+        open_invoices = _OpenInvoices(currency, invoices)
+        payments = []
+        matched_cents = total_cents = 0
+        for line in lines:
+            cents = to_cents(line.amount)
+            total_cents += cents
+            invoice_id, match = open_invoices.match(cents, line.reference)
+            if invoice_id is not None:
+                open_invoices.apply(invoice_id, cents)
+                matched_cents += cents
+            payments.append(Payment(
+                invoice_id=invoice_id,
+                amount=line.amount,
+                currency=currency,
+                received_on=line.received_on,
+                reference=line.reference,
+                match=match,
+                save_by=user,
+            ))
+        matched_ids = {payment.invoice_id for payment in payments if payment.invoice_id is not None}
+
+        batch = PaymentBatch.objects.create(
+            name=name[:255],
+            currency=currency,
+            save_by=user,
+            line_count=len(payments),
+            matched_count=sum(1 for payment in payments if payment.invoice_id is not None),
+            total_amount=from_cents(total_cents),
+            matched_amount=from_cents(matched_cents),
+        )
+        for payment in payments:
+            payment.batch = batch
+        Payment.objects.bulk_create(payments, batch_size=PAYMENT_BATCH_SIZE)
+        batch.newly_paid = _payments_applied(matched_ids) if matched_ids else []
+
+    logger.info(
+        "Reconciled statement %s: %d/%d lines matched, %d invoices paid, by %s",
+        batch.pk, batch.matched_count, batch.line_count, len(batch.newly_paid), user,
+    )
+    return batch
+
@@ -0,0 +1,111 @@
+"""
+Invoice PDF rendering
+PDFs are cached on disk per invoice version so they are only rendered once
+"""
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .lines import get_invoice_lines
+
+logger = logging.getLogger(__name__)
+
+PDF_OPTIONS = {
+    'page-size': 'Letter',
+    'encoding': 'UTF-8',
+    'enable-local-file-access': '',
+}
+
+
+def get_pdf_cache_dir():
+    return getattr(settings, 'INVOICE_PDF_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'invoices'))
+
+
+# Customer fields printed on the PDF. Customer.updated_date also moves with
+# the rollups (fact_app.rollups), which would re-render every invoice of the customer
+PDF_CUSTOMER_FIELDS = ('name', 'address', 'city')
+
+
+def invoice_pdf_version(invoice):
+    """
+    Short hash changing whenever the invoice or the customer details it
+    shows are modified, and every day: the PDF is dated with the day it is rendered
+    """
+    stamps = (invoice.last_updated_date, timezone.localdate())
+    customer = invoice.customer
+    raw = '|'.join(
+        [stamp.isoformat() if stamp else '' for stamp in stamps]
+        + [str(getattr(customer, field)) for field in PDF_CUSTOMER_FIELDS]
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def invoice_pdf_path(invoice):
+    """Location of the cached PDF for the current version of an invoice"""
+    return os.path.join(get_pdf_cache_dir(), f"{invoice.pk}-{invoice_pdf_version(invoice)}.pdf")
+
+
+def render_invoice_pdf(invoice):
+    """
+    Render an invoice to PDF bytes with wkhtmltopdf.
+
+    Raises:
+        OSError: If wkhtmltopdf is missing or fails
+    """
+    # Imported on first render: web and worker processes that never render start faster
+    import pdfkit
+
+    articles, pricing = get_invoice_lines(invoice)
+    amounts = pricing.amounts()
+    context = {
+        'obj': invoice,
+        'articles': articles,
+        'total': amounts['total'],
+        'pricing': amounts,
+        'date': timezone.localdate(),
+    }
+    html = get_template('invoice-pdf.html').render(context)
+    return pdfkit.from_string(html, False, PDF_OPTIONS)
+
+
+def get_cached_invoice_pdf(invoice):
+    """Return cached PDF bytes for the invoice, or None when not rendered yet"""
+    try:
+        with open(invoice_pdf_path(invoice), 'rb') as cached:
+            return cached.read()
+    except FileNotFoundError:
+        return None
+
+
+def store_invoice_pdf(invoice, pdf):
+    """Atomically write a rendered PDF to the cache and drop older versions"""
+    path = invoice_pdf_path(invoice)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(pdf)
+    os.replace(tmp_path, path)
+    for stale in glob.glob(os.path.join(directory, f"{invoice.pk}-*.pdf")):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return path
+
+
+def get_or_render_invoice_pdf(invoice):
+    """Serve the invoice PDF from the cache, rendering and storing it if needed"""
+    pdf = get_cached_invoice_pdf(invoice)
+    if pdf is None:
+        pdf = render_invoice_pdf(invoice)
+        store_invoice_pdf(invoice, pdf)
+        logger.debug("Rendered PDF for invoice %s", invoice.pk)
+    return pdf
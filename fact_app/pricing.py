@@ -0,0 +1,132 @@
+"""
+Invoice pricing engine
+Computes line totals, taxes and invoice totals from integer columns
+(quantities, unit prices in cents, discount and tax rates in basis points),
+one column operation at a time over the whole invoice or batch of invoices.
+
+Rounding is defined once, here, for every line:
+
+    gross    = quantity * unit_price
+    discount = round_half_up(gross * discount_bp / 10000)
+    net      = gross - discount
+    tax      = round_half_up(net * tax_rate_bp / 10000)
+    total    = net + tax
+
+and an invoice total is the sum of its line totals plus its adjustment
+(a signed amount in cents, added after tax). All values are integer cents:
+results are exact and do not depend on the order of the lines.
+money.cents_expression() computes the same line total in SQL.
+"""
+from array import array
+from collections import namedtuple
+from decimal import Decimal
+from operator import add, mul, sub
+
+# Rates are stored in basis points: 1925 is 19.25%
+BASIS_POINTS = 10000
+MAX_RATE_BP = BASIS_POINTS
+
+LinePrice = namedtuple('LinePrice', ['gross', 'discount', 'tax', 'total'])
+
+
+def rounded_share(amount_cents, rate_bp):
+    """rate_bp basis points of a non-negative amount, rounded half-up to the cent"""
+    return (amount_cents * rate_bp + BASIS_POINTS // 2) // BASIS_POINTS
+
+
+def price_line(quantity, unit_price_cents, discount_bp=0, tax_rate_bp=0):
+    """Price a single line (LinePrice of integer cents)"""
+    gross = quantity * unit_price_cents
+    discount = rounded_share(gross, discount_bp)
+    tax = rounded_share(gross - discount, tax_rate_bp)
+    return LinePrice(gross, discount, tax, gross - discount + tax)
+
+
+class InvoicePricing:
+    """
+    Priced lines of one invoice: integer cents columns (gross, discounts,
+    taxes, totals, in line order) and the invoice sums.
+    """
+
+    def __init__(self, gross, discounts, taxes, totals, tax_rates, adjustment=0):
+        self.gross = gross
+        self.discounts = discounts
+        self.taxes = taxes
+        self.totals = totals
+        self.tax_rates = tax_rates
+        self.adjustment = adjustment
+        self.subtotal = sum(gross)
+        self.discount = sum(discounts)
+        self.tax = sum(taxes)
+        self.total = sum(totals) + adjustment
+
+    def __len__(self):
+        return len(self.totals)
+
+    def line(self, index):
+        return LinePrice(self.gross[index], self.discounts[index], self.taxes[index], self.totals[index])
+
+    @property
+    def tax_by_rate(self):
+        """Tax cents per tax rate (basis points), lowest rate first"""
+        taxes = {}
+        for rate, tax in zip(self.tax_rates, self.taxes):
+            taxes[rate] = taxes.get(rate, 0) + tax
+        return dict(sorted(taxes.items()))
+
+    def amounts(self):
+        """The invoice sums as 2-decimal Decimals (templates and serializers)"""
+        return {
+            name: Decimal(getattr(self, name)).scaleb(-2)
+            for name in ('subtotal', 'discount', 'tax', 'adjustment', 'total')
+        }
+
+
+def _line_columns(quantities, unit_prices, discounts, tax_rates):
+    gross = array('q', map(mul, quantities, unit_prices))
+    discount = array('q', map(rounded_share, gross, discounts))
+    net = array('q', map(sub, gross, discount))
+    tax = array('q', map(rounded_share, net, tax_rates))
+    return gross, discount, tax, array('q', map(add, net, tax))
+
+
+def price_lines(quantities, unit_prices, discounts, tax_rates, adjustment=0):
+    """
+    Price the lines of one invoice.
+
+    Args:
+        quantities, unit_prices, discounts, tax_rates: Equal-length sequences of
+            integers (unit prices in cents, rates in basis points), e.g. array('q')
+        adjustment: Invoice adjustment in cents
+
+    Returns:
+        InvoicePricing
+    """
+    return InvoicePricing(*_line_columns(quantities, unit_prices, discounts, tax_rates), tax_rates, adjustment)
+
+
+def price_rows(rows, adjustment=0):
+    """price_lines() over (quantity, unit_price_cents, discount_bp, tax_rate_bp) rows"""
+    columns = tuple(array('q') for _ in range(4))
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+    return price_lines(*columns, adjustment=adjustment)
+
+
+def price_invoices(invoice_ids, quantities, unit_prices, discounts, tax_rates, adjustments):
+    """
+    Totals of many invoices at once (imports, recalculation).
+
+    Args:
+        invoice_ids: Invoice of each line, a column parallel to the line columns
+        adjustments: Dictionary of invoice id -> adjustment cents; every invoice
+            to price must be a key, including those without lines
+
+    Returns:
+        Dictionary of invoice id -> total cents
+    """
+    totals = dict(adjustments)
+    for invoice_id, line_total in zip(invoice_ids, _line_columns(quantities, unit_prices, discounts, tax_rates)[3]):
+        totals[invoice_id] += line_total
+    return totals
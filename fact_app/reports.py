@@ -0,0 +1,183 @@
+"""
+Revenue reporting
+Revenue per day, invoice type and payment status is kept in DailyRevenue,
+so charts over years of data aggregate a few thousand rollup rows instead
+of scanning invoices. Amounts are in the base currency (fact_app.fx).
+
+Days are recomputed (not incremented) when their invoices change: see
+fact_app.rollups for the dirty tracking that calls refresh_revenue_days().
+"""
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .fx import converted_expression
+from .models import ArchivedInvoice, DailyRevenue, Invoice
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+REVENUE_REBUILD_DAYS = 31
+
+
+def invoice_day(invoice):
+    """Rollup day of an invoice (in the current time zone)"""
+    return timezone.localdate(invoice.invoice_date_time)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _bucket_rows(queryset, paid=None):
+    """Yield ((day, invoice_type, paid), count, total) for an invoice queryset"""
+    fields = ['day', 'invoice_type'] if paid is not None else ['day', 'invoice_type', 'paid']
+    rows = queryset.order_by().annotate(day=TruncDate('invoice_date_time')).values(*fields).annotate(
+        invoice_count=Count('id'),
+        amount=Coalesce(
+            Sum(converted_expression('total')), Value(0), output_field=DecimalField(max_digits=14, decimal_places=2)
+        ),
+    )
+    for row in rows:
+        yield (row['day'], row['invoice_type'] or '', row.get('paid', paid)), row['invoice_count'], row['amount']
+
+
+@transaction.atomic
+def refresh_revenue_range(start, end):
+    """
+    Recompute the DailyRevenue rows of the days in [start, end).
+
+    Concurrent refreshes of the same day (two commits touching today) do not
+    conflict: the existing rows are locked before the invoices are read, so
+    the second refresh waits and reads what the first one committed, and
+    buckets are upserted (INSERT ... ON CONFLICT) rather than deleted and
+    re-inserted. Only the buckets left without invoices are deleted.
+
+    Returns:
+        Number of rollup rows written
+    """
+    existing = {
+        (row.day, row.invoice_type, row.paid): row.pk
+        for row in DailyRevenue.objects.select_for_update().filter(day__gte=start, day__lt=end)
+        .only('id', 'day', 'invoice_type', 'paid')
+    }
+    bounds = {'invoice_date_time__gte': _day_start(start), 'invoice_date_time__lt': _day_start(end)}
+    buckets = {}
+    sources = (
+        _bucket_rows(Invoice.objects.filter(**bounds)),
+        _bucket_rows(ArchivedInvoice.objects.filter(**bounds), paid=True),
+    )
+    for rows in sources:
+        for key, count, amount in rows:
+            bucket = buckets.setdefault(key, [0, 0])
+            bucket[0] += count
+            bucket[1] += amount
+
+    emptied = [pk for key, pk in existing.items() if key not in buckets]
+    if emptied:
+        DailyRevenue.objects.filter(id__in=emptied).delete()
+    DailyRevenue.objects.bulk_create(
+        [
+            DailyRevenue(day=day, invoice_type=invoice_type, paid=paid, invoice_count=count, total=amount)
+            for (day, invoice_type, paid), (count, amount) in sorted(buckets.items())
+        ],
+        update_conflicts=True,
+        unique_fields=['day', 'invoice_type', 'paid'],
+        update_fields=['invoice_count', 'total'],
+    )
+    return len(buckets)
+
+
+def refresh_revenue_days(days):
+    """Recompute the DailyRevenue rows of the given days"""
+    for day in sorted(set(days)):
+        refresh_revenue_range(day, day + datetime.timedelta(days=1))
+
+
+def rebuild_revenue(start=None, end=None, step_days=REVENUE_REBUILD_DAYS):
+    """
+    Recompute DailyRevenue for a date range (default: all invoices), one step at a time.
+
+    Returns:
+        Number of rollup rows written
+    """
+    if start is None or end is None:
+        dates = [
+            value for model in (Invoice, ArchivedInvoice)
+            for value in model.objects.aggregate(
+                first=Min('invoice_date_time'), last=Max('invoice_date_time')
+            ).values()
+            if value
+        ]
+        if not dates:
+            DailyRevenue.objects.all().delete()
+            return 0
+        start = start or timezone.localdate(min(dates))
+        end = end or timezone.localdate(max(dates)) + datetime.timedelta(days=1)
+    written = 0
+    day = start
+    while day < end:
+        step_end = min(day + datetime.timedelta(days=step_days), end)
+        written += refresh_revenue_range(day, step_end)
+        day = step_end
+    logger.info("Rebuilt %d revenue rollup rows from %s to %s", written, start, end)
+    return written
+
+
+def revenue_series(start, end, granularity='day', invoice_type=None, paid=None):
+    """
+    Revenue per period between start and end (inclusive), from DailyRevenue only.
+
+    Args:
+        start, end: Dates
+        granularity: 'day', 'week' (periods start on Monday) or 'month'
+        invoice_type: Only this invoice type (default: all, broken down by type)
+        paid: Only paid (True) or unpaid (False) invoices (default: both)
+
+    Returns:
+        List of dicts with period, invoice_type, invoice_count, total, paid_total, unpaid_total
+
+    Raises:
+        ValueError: If granularity is unknown
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'.")
+    queryset = DailyRevenue.objects.filter(day__gte=start, day__lte=end)
+    if invoice_type is not None:
+        queryset = queryset.filter(invoice_type=invoice_type)
+    if paid is not None:
+        queryset = queryset.filter(paid=paid)
+    trunc = GRANULARITIES[granularity]
+    period = trunc('day') if trunc else F('day')
+    amount = DecimalField(max_digits=14, decimal_places=2)
+    rows = (
+        queryset.order_by()
+        .annotate(period=period)
+        .values('period', 'invoice_type')
+        .annotate(
+            invoice_count=Sum('invoice_count'),
+            amount=Sum('total'),
+            paid_total=Coalesce(Sum('total', filter=Q(paid=True)), Value(0), output_field=amount),
+            unpaid_total=Coalesce(Sum('total', filter=Q(paid=False)), Value(0), output_field=amount),
+        )
+        .order_by('period', 'invoice_type')
+    )
+    return [
+        {
+            'period': row['period'],
+            'invoice_type': row['invoice_type'],
+            'invoice_count': row['invoice_count'],
+            'total': row['amount'],
+            'paid_total': row['paid_total'],
+            'unpaid_total': row['unpaid_total'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,345 @@
+"""
+Customer rollups
+Keeps Invoice.total, the per-customer counters stored on Customer
+(invoice_count, paid_invoice_count, total_billed, total_outstanding,
+last_invoice_date) and the DailyRevenue rows (fact_app.reports) up to date.
+
+Signals and bulk helpers mark invoices/customers/days as dirty; the dirty ones are
+refreshed once, right after the transaction commits. Customer rollups are
+updated incrementally: each invoice's current share of its customer's rollups
+is kept in an InvoiceRollup row, and a changed invoice moves the rollups by
+the difference, under a lock on the customer row. An article edit costs a few
+rows, whatever the number of invoices of the customer. The full recompute
+(refresh_customer_rollups) is left to merges, exchange rate loads and the
+rebuild command.
+"""
+import logging
+import threading
+from array import array
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .fx import converted_expression
+from .models import Article, ArchivedInvoice, Customer, Invoice, InvoiceRollup
+from .money import from_cents, to_cents
+from .pricing import price_invoices
+from .reports import invoice_day, refresh_revenue_days
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_BATCH_SIZE = 500
+ZERO = Decimal('0.00')
+ROLLUP_FIELDS = ['invoice_count', 'paid_invoice_count', 'total_billed', 'total_outstanding', 'last_invoice_date']
+# Rollup changes are customer changes for the change feed (fact_app.changes)
+ROLLUP_UPDATE_FIELDS = ROLLUP_FIELDS + ['updated_date']
+SHARE_FIELDS = ['customer_id', 'paid', 'billed', 'outstanding', 'invoice_date_time']
+
+_local = threading.local()
+
+
+class _DirtySet:
+    """Invoices, customers and revenue days changed in the current transaction"""
+
+    def __init__(self):
+        self.total_ids = set()
+        self.invoice_ids = set()
+        self.customer_ids = set()
+        self.days = set()
+        self.flushed = False
+
+    def flush(self):
+        # Registered once per change: only the first call after commit does the work
+        if self.flushed:
+            return
+        self.flushed = True
+        with transaction.atomic():
+            # A changed invoice total changes its customer's and its day's amounts
+            for invoice in refresh_invoice_totals(self.total_ids):
+                self.invoice_ids.add(invoice.pk)
+                self.days.add(invoice_day(invoice))
+            apply_invoice_rollups(self.invoice_ids)
+            refresh_customer_rollups(self.customer_ids)
+            refresh_revenue_days(self.days)
+
+
+def _mark_dirty(total_ids=(), invoice_ids=(), customer_ids=(), days=()):
+    dirty = getattr(_local, 'dirty', None)
+    if dirty is None or dirty.flushed:
+        dirty = _local.dirty = _DirtySet()
+    dirty.total_ids.update(total_ids)
+    dirty.invoice_ids.update(invoice_ids)
+    dirty.customer_ids.update(customer_ids)
+    dirty.days.update(days)
+    # A rolled back transaction drops its callbacks but leaves its ids here:
+    # they are simply refreshed with the next transaction (refreshing is idempotent).
+    # robust: a failure is logged and must not fail a request whose data is committed;
+    # the nightly reconcile_invoice_totals task catches up.
+    transaction.on_commit(dirty.flush, robust=True)
+
+
+def mark_invoices_dirty(invoice_ids):
+    """Recompute these invoice totals (and their customers' rollups) after commit"""
+    _mark_dirty(total_ids=invoice_ids)
+
+
+def mark_customers_dirty(customer_ids):
+    """Recompute these customers' rollups from all their invoices after commit"""
+    _mark_dirty(customer_ids=customer_ids)
+
+
+def mark_invoice_rows_dirty(invoices):
+    """Update the customer rollups and revenue days of these invoices after commit"""
+    invoices = list(invoices)
+    _mark_dirty(
+        invoice_ids=[invoice.pk for invoice in invoices],
+        days=[invoice_day(invoice) for invoice in invoices],
+    )
+
+
+def refresh_invoice_totals(invoice_ids):
+    """
+    Store the total computed from articles in Invoice.total, pricing each
+    chunk of invoices in one pass of fact_app.pricing
+
+    Returns:
+        List of the invoices whose total changed
+    """
+    invoice_ids = list(invoice_ids)
+    changed = []
+    for start in range(0, len(invoice_ids), ROLLUP_BATCH_SIZE):
+        chunk = invoice_ids[start:start + ROLLUP_BATCH_SIZE]
+        invoices = list(
+            Invoice.objects.filter(id__in=chunk).only('id', 'total', 'adjustment', 'customer_id', 'invoice_date_time')
+        )
+        lines = (
+            Article.objects.filter(invoice_id__in=chunk).order_by()
+            .values_list('invoice_id', 'quantity', 'unit_price', 'discount_bp', 'tax_rate_bp')
+        )
+        columns = tuple(array('q') for _ in range(5))
+        for invoice_id, quantity, unit_price, discount_bp, tax_rate_bp in lines.iterator(chunk_size=2000):
+            for column, value in zip(columns, (invoice_id, quantity, to_cents(unit_price), discount_bp, tax_rate_bp)):
+                column.append(value)
+        totals = price_invoices(*columns, {invoice.pk: to_cents(invoice.adjustment) for invoice in invoices})
+        batch = []
+        for invoice in invoices:
+            total = from_cents(totals[invoice.pk])
+            if invoice.total != total:
+                invoice.total = total
+                batch.append(invoice)
+        if batch:
+            Invoice.objects.bulk_update(batch, ['total'])
+            changed.extend(batch)
+    return changed
+
+
+def _shares(live, archived):
+    """
+    Current share of the given live and archived invoices (querysets) in
+    their customers' rollups, converted to the base currency in SQL
+    (fact_app.fx). An amount without an exchange rate counts as zero.
+
+    Yields:
+        Unsaved InvoiceRollup rows
+    """
+    rows = live.order_by().values('id', 'customer_id', 'paid', 'invoice_date_time').annotate(
+        billed=converted_expression('total'),
+        # Partial payments (fact_app.payments) reduce what is still due
+        due=converted_expression(F('total') - F('amount_paid')),
+    )
+    for row in rows.iterator(chunk_size=2000):
+        yield InvoiceRollup(
+            invoice_id=row['id'], customer_id=row['customer_id'], paid=row['paid'],
+            billed=row['billed'] or ZERO, outstanding=ZERO if row['paid'] else row['due'] or ZERO,
+            invoice_date_time=row['invoice_date_time'],
+        )
+    # Archived invoices are always paid
+    rows = archived.order_by().values('id', 'customer_id', 'invoice_date_time').annotate(
+        billed=converted_expression('total'),
+    )
+    for row in rows.iterator(chunk_size=2000):
+        yield InvoiceRollup(
+            invoice_id=row['id'], customer_id=row['customer_id'], paid=True,
+            billed=row['billed'] or ZERO, outstanding=ZERO, invoice_date_time=row['invoice_date_time'],
+        )
+
+
+def _current_shares(invoice_ids):
+    return {
+        share.invoice_id: share
+        for share in _shares(Invoice.objects.filter(id__in=invoice_ids), ArchivedInvoice.objects.filter(id__in=invoice_ids))
+    }
+
+
+def _lock_customers(customer_ids):
+    customers = Customer.objects.select_for_update().filter(id__in=customer_ids).order_by('id')
+    return {customer.pk: customer for customer in customers.only('id', *ROLLUP_FIELDS)}
+
+
+def _add_share(customer, share, sign):
+    customer.invoice_count += sign
+    customer.paid_invoice_count += sign if share.paid else 0
+    customer.total_billed += sign * share.billed
+    customer.total_outstanding += sign * share.outstanding
+
+
+def apply_invoice_rollups(invoice_ids):
+    """
+    Move the rollups of the customers of these invoices by the difference
+    between each invoice's current share and its InvoiceRollup row (a
+    deleted invoice withdraws its share, a moved one changes customer).
+    Call it inside a transaction: the customer rows stay locked until commit.
+
+    Returns:
+        Number of customers updated
+    """
+    invoice_ids = sorted(invoice_ids)
+    updated = 0
+    for start in range(0, len(invoice_ids), ROLLUP_BATCH_SIZE):
+        chunk = invoice_ids[start:start + ROLLUP_BATCH_SIZE]
+        # Customers are locked before the InvoiceRollup rows, as in refresh_customer_rollups()
+        customer_ids = {share.customer_id for share in _current_shares(chunk).values()}
+        customer_ids.update(InvoiceRollup.objects.filter(invoice_id__in=chunk).values_list('customer_id', flat=True))
+        customers = _lock_customers(customer_ids)
+        applied = {row.invoice_id: row for row in InvoiceRollup.objects.select_for_update().filter(invoice_id__in=chunk)}
+        # Read again under the locks: a concurrent change committed meanwhile is included
+        current = _current_shares(chunk)
+        late = {share.customer_id for share in [*current.values(), *applied.values()]} - customers.keys()
+        if late:
+            # Moved to another customer meanwhile (rare): locked out of order
+            customers.update(_lock_customers(late))
+
+        changed, stale_dates, upserts, withdrawn = set(), set(), [], []
+        for invoice_id in chunk:
+            old, new = applied.get(invoice_id), current.get(invoice_id)
+            if old is not None and new is not None and all(
+                getattr(old, field) == getattr(new, field) for field in SHARE_FIELDS
+            ):
+                continue
+            if old is not None:
+                withdrawn.append(invoice_id)
+                customer = customers.get(old.customer_id)
+                if customer is not None:
+                    _add_share(customer, old, -1)
+                    changed.add(customer.pk)
+                    moved_back = new is None or new.customer_id != old.customer_id or (
+                        new.invoice_date_time < old.invoice_date_time
+                    )
+                    if moved_back and old.invoice_date_time == customer.last_invoice_date:
+                        # It may have been the last invoice: read the next one from the index
+                        stale_dates.add(customer.pk)
+            if new is not None:
+                upserts.append(new)
+                customer = customers.get(new.customer_id)
+                if customer is not None:
+                    _add_share(customer, new, 1)
+                    changed.add(customer.pk)
+                    if customer.last_invoice_date is None or new.invoice_date_time > customer.last_invoice_date:
+                        customer.last_invoice_date = new.invoice_date_time
+        if not changed and not upserts and not withdrawn:
+            continue
+        InvoiceRollup.objects.filter(invoice_id__in=withdrawn).delete()
+        InvoiceRollup.objects.bulk_create(upserts)
+        if stale_dates:
+            last_dates = dict(
+                InvoiceRollup.objects.filter(customer_id__in=stale_dates).order_by().values('customer_id')
+                .annotate(last=Max('invoice_date_time')).values_list('customer_id', 'last')
+            )
+            for customer_id in stale_dates:
+                customers[customer_id].last_invoice_date = last_dates.get(customer_id)
+        now = timezone.now()
+        batch = [customers[customer_id] for customer_id in sorted(changed)]
+        for customer in batch:
+            customer.updated_date = now
+        Customer.objects.bulk_update(batch, ROLLUP_UPDATE_FIELDS)
+        updated += len(batch)
+    return updated
+
+
+def refresh_customer_rollups(customer_ids):
+    """
+    Recompute the stored rollups of the given customers from all their live
+    and archived invoices (which are always paid), rewriting their
+    InvoiceRollup rows. Used when many shares change at once (merges,
+    exchange rate loads, rebuilds); call it inside a transaction.
+
+    Returns:
+        Number of customers updated
+    """
+    customer_ids = sorted(customer_ids)
+    updated = 0
+    for start in range(0, len(customer_ids), ROLLUP_BATCH_SIZE):
+        chunk = customer_ids[start:start + ROLLUP_BATCH_SIZE]
+        live = Invoice.objects.filter(customer_id__in=chunk)
+        archived = ArchivedInvoice.objects.filter(customer_id__in=chunk)
+        # Invoices moved here whose share still counts for their previous customer
+        moved = list(
+            InvoiceRollup.objects.filter(
+                Q(invoice_id__in=live.values('id')) | Q(invoice_id__in=archived.values('id'))
+            ).exclude(customer_id__in=chunk).values_list('invoice_id', flat=True)
+        )
+        if moved:
+            apply_invoice_rollups(moved)
+        customers = list(Customer.objects.select_for_update().filter(id__in=chunk).order_by('id').only('id', *ROLLUP_FIELDS))
+        InvoiceRollup.objects.filter(customer_id__in=chunk).delete()
+        batch = []
+        for share in _shares(live, archived):
+            batch.append(share)
+            if len(batch) >= 2000:
+                InvoiceRollup.objects.bulk_create(batch)
+                batch = []
+        InvoiceRollup.objects.bulk_create(batch)
+        totals = {
+            row['customer_id']: row
+            for row in InvoiceRollup.objects.filter(customer_id__in=chunk).order_by().values('customer_id').annotate(
+                invoices=Count('invoice_id'),
+                paid_invoices=Count('invoice_id', filter=Q(paid=True)),
+                billed=Sum('billed'),
+                outstanding=Sum('outstanding'),
+                last_date=Max('invoice_date_time'),
+            )
+        }
+        changed = []
+        now = timezone.now()
+        for customer in customers:
+            row = totals.get(customer.pk, {})
+            values = {
+                'invoice_count': row.get('invoices', 0),
+                'paid_invoice_count': row.get('paid_invoices', 0),
+                'total_billed': row.get('billed') or ZERO,
+                'total_outstanding': row.get('outstanding') or ZERO,
+                'last_invoice_date': row.get('last_date'),
+            }
+            if any(getattr(customer, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(customer, field, value)
+                customer.updated_date = now
+                changed.append(customer)
+        Customer.objects.bulk_update(changed, ROLLUP_UPDATE_FIELDS)
+        updated += len(customers)
+    return updated
+
+
+def rebuild_customer_rollups(batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Recompute every invoice total and customer rollup from scratch.
+
+    Returns:
+        Dictionary with the number of invoices and customers processed
+    """
+    customers = 0
+    # Every share is written again below; this also drops those of invoices gone unnoticed
+    InvoiceRollup.objects.all().delete()
+    invoice_ids = list(Invoice.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(invoice_ids), batch_size):
+        refresh_invoice_totals(invoice_ids[start:start + batch_size])
+    invoices = len(invoice_ids)
+
+    customer_ids = list(Customer.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(customer_ids), batch_size):
+        with transaction.atomic():
+            customers += refresh_customer_rollups(customer_ids[start:start + batch_size])
+    logger.info("Rebuilt rollups of %d invoices and %d customers", invoices, customers)
+    return {'invoices': invoices, 'customers': customers}
@@ -3,16 +3,34 @@ Django signals for Invoice app
 Handles automatic actions when models are saved or deleted
 """
 import logging
-from django.db.models.signals import post_save, post_delete, pre_delete
+from django.contrib.auth.models import Group, User
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
 
 from .models import Invoice, Article, Customer
+from .archive import is_archiving
+from .audit import record_deleted, record_saved, remember_previous_values
+from .backends import invalidate_user_cache
+from .changes import STAMP_FIELDS, record_deletion, stamp_on_commit
+from .dedupe import DEDUPE_SOURCE_FIELDS, set_dedupe_keys
+from .delivery import delete_invoice_deliveries
+from .events import INVOICE_CREATED, INVOICE_DELETED, INVOICE_UPDATED, publish_invoice_event
+from .fx import end_rate_cache, start_rate_cache
+from .numbering import number_after_commit
+from .payments import unmatch_payments
+from .rollups import mark_invoice_rows_dirty, mark_invoices_dirty
 
 logger = logging.getLogger(__name__)
 
 
+# Exchange rates looked up while serving a request are read once per currency
+request_started.connect(start_rate_cache, dispatch_uid='fact_app_start_rate_cache')
+request_finished.connect(end_rate_cache, dispatch_uid='fact_app_end_rate_cache')
+
+
 @receiver(post_save, sender=Article)
 def update_invoice_on_article_save(sender, instance, created, **kwargs):
     """
@@ -20,7 +38,8 @@ def update_invoice_on_article_save(sender, instance, created, **kwargs):
     """
     if instance.invoice:
         instance.invoice.save(update_fields=['last_updated_date'])
-        logger.debug(f"Invoice {instance.invoice.id} updated after article save")
+        mark_invoices_dirty([instance.invoice_id])
+        logger.debug("Invoice %s updated after article save", instance.invoice_id)
 
 
 @receiver(post_delete, sender=Article)
@@ -28,9 +47,33 @@ def update_invoice_on_article_delete(sender, instance, **kwargs):
     """
     Update invoice's last_updated_date when an article is deleted
     """
+    origin = kwargs.get('origin')
+    if isinstance(origin, Invoice) or getattr(origin, 'model', None) is Invoice:
+        # The article is cascade-deleted with its invoice
+        return
     if instance.invoice:
         instance.invoice.save(update_fields=['last_updated_date'])
-        logger.debug(f"Invoice {instance.invoice.id} updated after article delete")
+        mark_invoices_dirty([instance.invoice_id])
+        logger.debug("Invoice %s updated after article delete", instance.invoice_id)
+
+
+@receiver(pre_save, sender=Customer)
+def update_customer_dedupe_keys(sender, instance, **kwargs):
+    """
+    Keep the normalized duplicate-detection keys in sync with the customer
+    """
+    set_dedupe_keys(instance)
+
+
+@receiver(post_save, sender=Customer)
+def save_customer_dedupe_keys(sender, instance, created, update_fields=None, **kwargs):
+    """
+    save(update_fields=[...]) only writes the listed fields: write the keys too
+    """
+    if update_fields and set(update_fields) & DEDUPE_SOURCE_FIELDS:
+        Customer.objects.filter(pk=instance.pk).update(
+            email_key=instance.email_key, phone_key=instance.phone_key, name_key=instance.name_key
+        )
 
 
 @receiver(post_save, sender=Customer)
@@ -39,7 +82,16 @@ def log_customer_creation(sender, instance, created, **kwargs):
     Log customer creation
     """
     if created:
-        logger.info(f"New customer created: {instance.name} (ID: {instance.id})")
+        logger.info("New customer created: %s (ID: %s)", instance.name, instance.id)
+
+
+@receiver(post_save, sender=Invoice)
+def number_new_invoice(sender, instance, created, **kwargs):
+    """
+    Give a new invoice its sequential number once it is committed
+    """
+    if created:
+        number_after_commit([instance.pk])
 
 
 @receiver(post_save, sender=Invoice)
@@ -47,21 +99,179 @@ def log_invoice_creation(sender, instance, created, **kwargs):
     """
     Log invoice creation
     """
-    if created:
+    # Reading instance.customer may query: only do it when the message is emitted
+    if created and logger.isEnabledFor(logging.INFO):
         logger.info(
-            f"New invoice created: Invoice-{instance.id} for {instance.customer.name} "
-            f"(Type: {instance.get_invoice_type_display()})"
+            "New invoice created: Invoice-%s for %s (Type: %s)",
+            instance.id, instance.customer.name, instance.get_invoice_type_display()
         )
 
 
+@receiver(pre_save, sender=Invoice)
+def track_invoice_changes(sender, instance, update_fields=None, **kwargs):
+    """
+    Remember the audited values before the save
+    """
+    remember_previous_values(instance, update_fields)
+
+
+@receiver(post_save, sender=Invoice)
+def refresh_rollups_on_invoice_save(sender, instance, update_fields=None, **kwargs):
+    """
+    Refresh the customer's rollups (counts, amounts, last invoice date; the
+    previous customer's too when the invoice moved) and the revenue of the
+    invoice's day
+    """
+    mark_invoice_rows_dirty([instance])
+    if update_fields is None or 'adjustment' in update_fields:
+        # The adjustment is part of the stored total
+        mark_invoices_dirty([instance.pk])
+    if update_fields is None:
+        # A full save writes the in-memory total back: recompute it from the articles
+        mark_invoices_dirty([instance.pk])
+
+
+@receiver(post_delete, sender=Invoice)
+def refresh_rollups_on_invoice_delete(sender, instance, **kwargs):
+    """
+    Refresh the customer's rollups and the day's revenue once the invoice is gone
+    """
+    mark_invoice_rows_dirty([instance])
+
+
+# Fields whose new value is sent along with the event; other changes
+# (e.g. the article total via last_updated_date) make clients reload
+LIVE_INVOICE_FIELDS = {'paid', 'comments'}
+
+
+@receiver(post_save, sender=Invoice)
+def publish_invoice_saved(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Push the change to open invoice lists
+    """
+    if created:
+        publish_invoice_event(INVOICE_CREATED, [instance.pk])
+        return
+    changed = LIVE_INVOICE_FIELDS & set(update_fields) if update_fields else set()
+    changes = {field: getattr(instance, field) for field in changed}
+    publish_invoice_event(INVOICE_UPDATED, [instance.pk], changes or None)
+
+
+@receiver(post_delete, sender=Invoice)
+def publish_invoice_deleted(sender, instance, **kwargs):
+    """
+    Push the deletion to open invoice lists
+    """
+    publish_invoice_event(INVOICE_DELETED, [instance.pk])
+
+
+@receiver(post_delete, sender=Invoice)
+def release_invoice_payments(sender, instance, **kwargs):
+    """
+    Keep the payments of a deleted invoice, unmatched, for review, and drop
+    its deliveries (an archived invoice keeps both)
+    """
+    if not is_archiving():
+        unmatch_payments([instance.pk])
+        delete_invoice_deliveries([instance.pk])
+
+
 @receiver(pre_delete, sender=Customer)
 def check_customer_invoices(sender, instance, **kwargs):
     """
     Warn if trying to delete customer with invoices
     """
+    if not logger.isEnabledFor(logging.WARNING):
+        return
     invoice_count = instance.invoices.count()
     if invoice_count > 0:
         logger.warning(
-            f"Customer {instance.name} (ID: {instance.id}) with {invoice_count} invoices "
-            f"is being deleted"
+            "Customer %s (ID: %s) with %d invoices is being deleted",
+            instance.name, instance.id, invoice_count
         )
+
+
+@receiver(pre_save, sender=Customer)
+@receiver(pre_save, sender=Article)
+def track_audited_changes(sender, instance, update_fields=None, **kwargs):
+    """
+    Remember the audited values before the save
+    """
+    remember_previous_values(instance, update_fields)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Article)
+def audit_saved(sender, instance, created, **kwargs):
+    """
+    Record the creation or the changed fields in the audit trail
+    """
+    record_saved(instance, created)
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Article)
+def audit_deleted(sender, instance, **kwargs):
+    """
+    Record the deletion in the audit trail
+    """
+    record_deleted(instance)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Article)
+def restamp_late_commit(sender, instance, **kwargs):
+    """
+    Re-stamp the row for the change feed if its transaction commits late
+    """
+    stamp_on_commit(sender, [instance.pk], getattr(instance, STAMP_FIELDS[sender]))
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Article)
+def record_tombstone(sender, instance, **kwargs):
+    """
+    Leave a tombstone so change feed consumers drop the deleted row
+    """
+    record_deletion(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drop the cached user when it is saved or deleted
+    """
+    invalidate_user_cache(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_cached_user_permissions(sender, instance, action, pk_set, **kwargs):
+    """
+    Drop cached permissions when a user's groups or permissions change
+    """
+    if isinstance(instance, User):
+        if action.startswith('post_'):
+            invalidate_user_cache(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        # group.user_set.add()/remove(): pk_set holds the affected users
+        for user_id in pk_set:
+            invalidate_user_cache(user_id)
+    elif action == 'pre_clear':
+        for user_id in instance.user_set.values_list('pk', flat=True):
+            invalidate_user_cache(user_id)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_cached_group_permissions(sender, instance, action, **kwargs):
+    """
+    Drop cached permissions of all members when a group's permissions change
+    """
+    if action.startswith('post_') and isinstance(instance, Group):
+        for user_id in instance.user_set.values_list('pk', flat=True):
+            invalidate_user_cache(user_id)
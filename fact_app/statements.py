@@ -0,0 +1,271 @@
+"""
+Customer statements
+A statement lists a customer's invoices (debits) and payments (credits) over
+a period, with the balance after each entry. Balances are never summed
+across currencies: a statement covers one currency, and a customer billed
+in several currencies gets one statement per currency.
+
+Each ledger (live invoices, archived invoices, payments) is read once in date
+order with its cumulative amount computed by the database (SUM() OVER), and
+the three streams are merged as they are read: balances need no extra query
+per row and a statement of any size is never held in memory. Proforma
+invoices are not debts and are left out.
+
+PDFs are rendered in chunks of STATEMENT_CHUNK_SIZE rows: each chunk is a
+small HTML file and wkhtmltopdf concatenates them.
+"""
+import csv
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import tempfile
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F, Q, Sum, Window
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import ArchivedInvoice, Invoice, Payment
+from .money import get_base_currency
+from .pdf import PDF_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_CHUNK_SIZE = 500
+ZERO = Decimal('0.00')
+
+StatementEntry = namedtuple(
+    'StatementEntry', ['day', 'kind', 'id', 'reference', 'description', 'debit', 'credit', 'balance']
+)
+
+CSV_HEADER = ['date', 'type', 'reference', 'description', 'debit', 'credit', 'balance']
+
+
+def get_statement_dir():
+    return getattr(settings, 'STATEMENT_DIR', os.path.join(settings.MEDIA_ROOT, 'statements'))
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def previous_month():
+    """(first day, last day) of the month before the current one"""
+    end = timezone.localdate().replace(day=1) - datetime.timedelta(days=1)
+    return end.replace(day=1), end
+
+
+def statement_currencies(customer_id):
+    """Currencies of a customer's (live and archived) invoices and payments, sorted"""
+    archived = ArchivedInvoice.objects.filter(customer_id=customer_id)
+    currencies = set()
+    for queryset in (
+        Invoice.objects.filter(customer_id=customer_id),
+        archived,
+        Payment.objects.filter(Q(invoice__customer_id=customer_id) | Q(invoice_id__in=archived.values('id'))),
+    ):
+        currencies.update(queryset.order_by().values_list('currency', flat=True).distinct())
+    return sorted(currencies)
+
+
+def default_statement_currency(currencies):
+    """The base currency, unless the customer only deals in other currencies"""
+    base = get_base_currency()
+    return base if base in currencies or not currencies else currencies[0]
+
+
+class Statement:
+    """
+    Account statement of a customer between two days (inclusive), in one
+    currency (default: the base currency)
+    """
+
+    def __init__(self, customer, start, end, currency=None):
+        self.customer = customer
+        self.start = start
+        self.end = end
+        self.currency = currency or get_base_currency()
+        self._after = _day_start(start)
+        self._before = _day_start(end + datetime.timedelta(days=1))
+
+    def _invoices(self, model):
+        queryset = model.objects.filter(customer_id=self.customer.pk, currency=self.currency).exclude(invoice_type='P')
+        return queryset.order_by()
+
+    def _payments(self):
+        archived = ArchivedInvoice.objects.filter(customer_id=self.customer.pk).values('id')
+        return Payment.objects.filter(
+            Q(invoice__customer_id=self.customer.pk) | Q(invoice_id__in=archived), currency=self.currency
+        ).order_by()
+
+    def _balance_until(self, day_start, received_before):
+        debits = [
+            self._invoices(model).filter(invoice_date_time__lt=day_start).aggregate(total=Sum('total'))['total']
+            for model in (Invoice, ArchivedInvoice)
+        ]
+        credits = self._payments().filter(received_on__lt=received_before).aggregate(total=Sum('amount'))['total']
+        return sum(debit or ZERO for debit in debits) - (credits or ZERO)
+
+    @property
+    def opening_balance(self):
+        if not hasattr(self, '_opening_balance'):
+            self._opening_balance = self._balance_until(self._after, self.start)
+        return self._opening_balance
+
+    @property
+    def closing_balance(self):
+        if not hasattr(self, '_closing_balance'):
+            self._closing_balance = self._balance_until(self._before, self.end + datetime.timedelta(days=1))
+        return self._closing_balance
+
+    def _invoice_stream(self, model, stream):
+        rows = (
+            self._invoices(model)
+            .filter(invoice_date_time__gte=self._after, invoice_date_time__lt=self._before)
+            .annotate(running=Window(Sum('total'), order_by=[F('invoice_date_time').asc(), F('id').asc()]))
+            .order_by('invoice_date_time', 'id')
+            .values_list('id', 'number', 'invoice_date_time', 'invoice_type', 'total', 'running')
+        )
+        types = dict(Invoice.INVOICE_TYPE)
+        for invoice_id, number, date_time, invoice_type, total, running in rows.iterator(chunk_size=2000):
+            # Invoices come before the payments of the same day
+            yield (timezone.localdate(date_time), 0, invoice_id), stream, (
+                number or f"INV-{invoice_id:05d}", str(types.get(invoice_type, '')), total, running,
+            )
+
+    def _payment_stream(self):
+        rows = (
+            self._payments()
+            .filter(received_on__gte=self.start, received_on__lte=self.end)
+            .annotate(running=Window(Sum('amount'), order_by=[F('received_on').asc(), F('id').asc()]))
+            .order_by('received_on', 'id')
+            .values_list('id', 'received_on', 'reference', 'amount', 'running')
+        )
+        for payment_id, received_on, reference, amount, running in rows.iterator(chunk_size=2000):
+            yield (received_on, 1, payment_id), 'payments', (f"PAY-{payment_id:05d}", reference, amount, running)
+
+    def entries(self):
+        """Yield the StatementEntry rows of the period in date order"""
+        opening = self.opening_balance
+        # Cumulative amount of each ledger so far, from its window function
+        running = {'invoices': ZERO, 'archived': ZERO, 'payments': ZERO}
+        streams = heapq.merge(
+            self._invoice_stream(Invoice, 'invoices'),
+            self._invoice_stream(ArchivedInvoice, 'archived'),
+            self._payment_stream(),
+            key=lambda item: item[0],
+        )
+        for (day, _rank, pk), stream, (reference, description, amount, cumulative) in streams:
+            running[stream] = cumulative
+            balance = opening + running['invoices'] + running['archived'] - running['payments']
+            if stream == 'payments':
+                yield StatementEntry(day, 'payment', pk, reference, description, None, amount, balance)
+            else:
+                yield StatementEntry(day, 'invoice', pk, reference, description, amount, None, balance)
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def iter_statement_csv(statement):
+    """Yield the statement as CSV lines, for a StreamingHttpResponse"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    yield writer.writerow([statement.start.isoformat(), 'opening', '', '', '', '', statement.opening_balance])
+    balance = statement.opening_balance
+    for entry in statement.entries():
+        balance = entry.balance
+        yield writer.writerow([
+            entry.day.isoformat(), entry.kind, entry.reference, entry.description,
+            entry.debit if entry.debit is not None else '',
+            entry.credit if entry.credit is not None else '',
+            entry.balance,
+        ])
+    yield writer.writerow([statement.end.isoformat(), 'closing', '', '', '', '', balance])
+
+
+def _chunks(entries, size):
+    """Lists of up to size entries (a single empty list when there are none)"""
+    chunk = []
+    yielded = False
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            yielded = True
+            chunk = []
+    if chunk or not yielded:
+        yield chunk
+
+
+def render_statement_pdf(statement, chunk_size=STATEMENT_CHUNK_SIZE):
+    """
+    Render a statement to PDF bytes, chunk_size rows per HTML file.
+
+    Raises:
+        OSError: If wkhtmltopdf is missing or fails
+    """
+    import pdfkit
+
+    template = get_template('statement-pdf.html')
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        balance = statement.opening_balance
+        chunks = _chunks(statement.entries(), chunk_size)
+        chunk = next(chunks)
+        # Look one chunk ahead to know which one is the last
+        for following in itertools.chain(chunks, [None]):
+            if chunk:
+                balance = chunk[-1].balance
+            path = os.path.join(directory, f"{len(paths):05d}.html")
+            with open(path, 'w', encoding='utf-8') as page:
+                page.write(template.render({
+                    'statement': statement,
+                    'customer': statement.customer,
+                    'entries': chunk,
+                    'first': not paths,
+                    'last': following is None,
+                    'closing_balance': balance,
+                }))
+            paths.append(path)
+            chunk = following
+        return pdfkit.from_file(paths, False, PDF_OPTIONS)
+
+
+def statement_pdf_path(customer_id, start, end, currency):
+    return os.path.join(get_statement_dir(), f"{start.isoformat()}_{end.isoformat()}", f"{customer_id}_{currency}.pdf")
+
+
+def store_statement_pdf(statement, pdf):
+    """Atomically write a rendered statement"""
+    path = statement_pdf_path(statement.customer.pk, statement.start, statement.end, statement.currency)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(pdf)
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_or_render_statement_pdf(statement):
+    """
+    The stored PDF of a past period (written by the monthly run), or a fresh
+    rendering. Periods reaching today are always rendered: they still change.
+    """
+    path = statement_pdf_path(statement.customer.pk, statement.start, statement.end, statement.currency)
+    if statement.end < timezone.localdate():
+        try:
+            with open(path, 'rb') as stored:
+                return stored.read()
+        except FileNotFoundError:
+            pass
+    return render_statement_pdf(statement)
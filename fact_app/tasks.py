@@ -0,0 +1,390 @@
+"""
+Celery tasks for Invoice app
+Heavy work (PDF rendering, reports, exports, imports, reconciliation,
+recurring billing, emails) runs on workers instead of the request path.
+
+Every task is idempotent, so retries and duplicate deliveries are safe.
+Set CELERY_TASK_ALWAYS_EAGER=True to run tasks inline (tests, local development).
+"""
+import csv
+import datetime
+import logging
+import os
+import tempfile
+
+from celery import group, shared_task
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, InterfaceError, OperationalError, transaction
+from django.utils import timezone
+
+from .archive import archive_paid_invoices
+from .audit import record_created
+from .changes import prune_tombstones
+from .dedupe import normalize_email, set_dedupe_keys
+from .delivery import queue_stale_deliveries, send_deliveries
+from .models import Customer, Invoice
+from .numbering import assign_pending_invoice_numbers
+from .money import annotate_totals, format_cents, from_cents
+from .pdf import get_cached_invoice_pdf, invoice_pdf_path, render_invoice_pdf, store_invoice_pdf
+from .recurring import due_recurring_ids, generate_recurring_invoices
+from .reports import invoice_day, refresh_revenue_days
+from .statements import (
+    Statement, previous_month, render_statement_pdf, statement_currencies, statement_pdf_path, store_statement_pdf,
+)
+from .rollups import refresh_customer_rollups
+from .utils import get_invoice_statistics
+
+logger = logging.getLogger(__name__)
+
+STATISTICS_CACHE_KEY = 'fact_app:invoice_statistics'
+STATISTICS_CACHE_TIMEOUT = 60 * 15
+# Customers per statement rendering task of the monthly run
+STATEMENT_FANOUT_CHUNK = 200
+# Recurring invoice templates per generation task
+RECURRING_FANOUT_CHUNK = 500
+# Sending tasks per worker (each sends a batch of fact_app.delivery.DELIVERY_BATCH_SIZE emails)
+EMAIL_RATE_LIMIT = getattr(settings, 'INVOICE_EMAIL_RATE_LIMIT', '60/m')
+
+# Shared retry policy: exponential backoff with jitter on transient errors
+# (lost connections, lock timeouts, I/O). Constraint violations and other
+# data errors would fail the same way on every retry.
+RETRY_POLICY = {
+    'autoretry_for': (OperationalError, InterfaceError, OSError),
+    'dont_autoretry_for': (IntegrityError,),
+    'retry_backoff': True,
+    'retry_backoff_max': 600,
+    'retry_jitter': True,
+    'max_retries': 5,
+}
+
+
+def _export_dir():
+    return getattr(settings, 'INVOICE_EXPORT_DIR', os.path.join(settings.MEDIA_ROOT, 'exports'))
+
+
+@shared_task(rate_limit='30/m', **RETRY_POLICY)
+def render_invoice_pdf_task(invoice_id):
+    """
+    Render and cache the PDF of an invoice.
+    Does nothing when the current version is already cached.
+
+    Returns:
+        Path of the cached PDF, or None if the invoice no longer exists
+    """
+    invoice = Invoice.objects.select_related('customer', 'save_by').filter(pk=invoice_id).first()
+    if invoice is None:
+        logger.warning("PDF requested for missing invoice %s", invoice_id)
+        return None
+    path = invoice_pdf_path(invoice)
+    if get_cached_invoice_pdf(invoice) is None:
+        store_invoice_pdf(invoice, render_invoice_pdf(invoice))
+        logger.info("PDF rendered for invoice %s", invoice_id)
+    return path
+
+
+@shared_task(**RETRY_POLICY)
+def refresh_invoice_statistics():
+    """Recompute global invoice statistics and store them in the cache"""
+    stats = get_invoice_statistics()
+    stats['refreshed_at'] = timezone.now().isoformat()
+    cache.set(STATISTICS_CACHE_KEY, stats, STATISTICS_CACHE_TIMEOUT)
+    return {key: str(value) for key, value in stats.items()}
+
+
+def get_cached_invoice_statistics():
+    """Invoice statistics from the cache, computed inline on a cache miss"""
+    stats = cache.get(STATISTICS_CACHE_KEY)
+    if stats is None:
+        refresh_invoice_statistics()
+        stats = cache.get(STATISTICS_CACHE_KEY) or get_invoice_statistics()
+    return stats
+
+
+@shared_task(rate_limit='6/m', **RETRY_POLICY)
+def generate_invoice_export(start_date=None, end_date=None):
+    """
+    Write invoices (optionally within a date range) to a CSV file.
+
+    The file name only depends on the range and it is replaced atomically,
+    so re-running the task overwrites the same export.
+
+    Returns:
+        Path of the CSV file
+    """
+    queryset = Invoice.objects.select_related('customer').order_by('invoice_date_time', 'id')
+    if start_date:
+        queryset = queryset.filter(invoice_date_time__date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(invoice_date_time__date__lte=end_date)
+
+    directory = _export_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"invoices_{start_date or 'start'}_{end_date or 'end'}.csv")
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as tmp:
+        writer = csv.writer(tmp)
+        writer.writerow(['id', 'date', 'customer', 'email', 'type', 'paid', 'total'])
+        for invoice in annotate_totals(queryset).iterator(chunk_size=2000):
+            writer.writerow([
+                invoice.pk,
+                invoice.invoice_date_time.isoformat(),
+                invoice.customer.name,
+                invoice.customer.email,
+                invoice.invoice_type or '',
+                invoice.paid,
+                format_cents(invoice.total_cents),
+            ])
+    os.replace(tmp_path, path)
+    logger.info("Invoice export written to %s", path)
+    return path
+
+
+# A missing file will not appear by retrying: fail at once
+@shared_task(**dict(RETRY_POLICY, dont_autoretry_for=(IntegrityError, FileNotFoundError)))
+def import_customers_csv(path, user_id, batch_size=1000):
+    """
+    Import customers from a CSV file with columns
+    name,email,phone,address,sex,age,city,zip_code.
+
+    Rows whose email already exists (ignoring case) are skipped, so the import
+    can be re-run. New customers sharing a phone number or a name and zip code
+    with an existing one are created and counted as possible duplicates
+    (see the dedupe_customers command).
+
+    Returns:
+        Dictionary with the number of rows read, customers created and possible duplicates
+
+    Raises:
+        FileNotFoundError: If the file does not exist (not retried)
+    """
+    user = User.objects.get(pk=user_id)
+    fields = ['name', 'email', 'phone', 'address', 'sex', 'age', 'city', 'zip_code']
+    read = created = possible_duplicates = 0
+
+    def flush(batch):
+        existing = set(
+            Customer.objects.filter(email_key__in=[customer.email_key for customer in batch])
+            .values_list('email_key', flat=True)
+        )
+        new = [customer for customer in batch if customer.email_key not in existing]
+        phones = set(
+            Customer.objects.filter(phone_key__in=[customer.phone_key for customer in new if customer.phone_key])
+            .values_list('phone_key', flat=True)
+        )
+        names = set(
+            Customer.objects.filter(name_key__in=[customer.name_key for customer in new if customer.name_key])
+            .values_list('name_key', flat=True)
+        )
+        with transaction.atomic():
+            Customer.objects.bulk_create(new, ignore_conflicts=True)
+            # ignore_conflicts leaves the primary keys unset: read the inserted rows back to audit them
+            inserted = list(Customer.objects.filter(email_key__in=[customer.email_key for customer in new]))
+            record_created(inserted)
+        return len(inserted), sum(1 for customer in new if customer.phone_key in phones or customer.name_key in names)
+
+    with open(path, newline='', encoding='utf-8') as source:
+        batch = {}
+        for row in csv.DictReader(source):
+            read += 1
+            values = {field: (row.get(field) or '').strip() for field in fields}
+            if not values['email'] or not values['name']:
+                continue
+            values['age'] = int(values['age']) if values['age'].isdigit() else None
+            # bulk_create() sends no pre_save signal: compute the dedupe keys here
+            batch[normalize_email(values['email'])] = set_dedupe_keys(Customer(save_by=user, **values))
+            if len(batch) >= batch_size:
+                new, duplicates = flush(list(batch.values()))
+                created += new
+                possible_duplicates += duplicates
+                batch = {}
+        if batch:
+            new, duplicates = flush(list(batch.values()))
+            created += new
+            possible_duplicates += duplicates
+
+    logger.info(
+        "Customer import %s: %d rows read, %d customers created, %d possible duplicates",
+        path, read, created, possible_duplicates,
+    )
+    return {'read': read, 'created': created, 'possible_duplicates': possible_duplicates}
+
+
+@shared_task(**RETRY_POLICY)
+def reconcile_invoice_totals(batch_size=1000):
+    """
+    Store the total computed from articles in Invoice.total
+    for every invoice where they differ, then refresh the rollups
+    of the affected customers and days. The revenue of yesterday and
+    today, the days edited concurrently, is always refreshed.
+
+    Returns:
+        Number of invoices corrected
+    """
+    fixed = 0
+    pending = []
+    customer_ids = set()
+    days = set()
+    queryset = annotate_totals(Invoice.objects.order_by()).only('id', 'total', 'customer_id', 'invoice_date_time')
+    for invoice in queryset.iterator(chunk_size=batch_size):
+        total = from_cents(invoice.articles_total_cents)
+        if invoice.total != total:
+            invoice.total = total
+            pending.append(invoice)
+            customer_ids.add(invoice.customer_id)
+            days.add(invoice_day(invoice))
+        if len(pending) >= batch_size:
+            with transaction.atomic():
+                Invoice.objects.bulk_update(pending, ['total'])
+            fixed += len(pending)
+            pending = []
+    if pending:
+        with transaction.atomic():
+            Invoice.objects.bulk_update(pending, ['total'])
+        fixed += len(pending)
+    today = timezone.localdate()
+    days.update({today - datetime.timedelta(days=1), today})
+    with transaction.atomic():
+        refresh_customer_rollups(customer_ids)
+        refresh_revenue_days(days)
+    if fixed:
+        logger.info("Reconciled stored totals of %d invoices", fixed)
+    return fixed
+
+
+@shared_task(**RETRY_POLICY)
+def assign_invoice_numbers_task():
+    """
+    Number the invoices whose number was not assigned after their creation.
+
+    Returns:
+        Number of invoices numbered
+    """
+    return assign_pending_invoice_numbers()
+
+
+@shared_task(**RETRY_POLICY)
+def archive_paid_invoices_task(batch_size=500, max_batches=None):
+    """
+    Move paid invoices older than INVOICE_ARCHIVE_AFTER_DAYS to the archive tables.
+    Batches commit one by one, so a retry resumes where the last run stopped.
+
+    Returns:
+        Number of invoices archived
+    """
+    return archive_paid_invoices(batch_size=batch_size, max_batches=max_batches)
+
+
+@shared_task(**RETRY_POLICY)
+def prune_tombstones_task():
+    """
+    Delete the change feed tombstones older than TOMBSTONE_RETENTION_DAYS.
+
+    Returns:
+        Number of tombstones deleted
+    """
+    return prune_tombstones()
+
+
+@shared_task(rate_limit='30/m', **RETRY_POLICY)
+def render_customer_statements_task(customer_ids, start, end):
+    """
+    Render and store the statements of a chunk of customers for a period.
+    Statements already stored are skipped, so a retry resumes the chunk.
+
+    Returns:
+        Number of statements rendered
+    """
+    start, end = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    rendered = 0
+    for customer in Customer.objects.filter(id__in=customer_ids).order_by('id'):
+        # One statement per currency the customer deals in
+        for currency in statement_currencies(customer.pk):
+            if os.path.exists(statement_pdf_path(customer.pk, start, end, currency)):
+                continue
+            statement = Statement(customer, start, end, currency)
+            store_statement_pdf(statement, render_statement_pdf(statement))
+            rendered += 1
+    logger.info("Rendered %d statements for %s..%s", rendered, start, end)
+    return rendered
+
+
+@shared_task(**RETRY_POLICY)
+def generate_monthly_statements(start=None, end=None, chunk_size=STATEMENT_FANOUT_CHUNK):
+    """
+    Queue the statements of every customer with invoices for a period
+    (default: the previous month), chunk_size customers per task so the
+    rendering spreads over the workers.
+
+    Returns:
+        Number of tasks queued
+    """
+    if start is None or end is None:
+        start, end = (day.isoformat() for day in previous_month())
+    customer_ids = list(Customer.objects.filter(invoice_count__gt=0).order_by('id').values_list('id', flat=True))
+    tasks = [
+        render_customer_statements_task.s(customer_ids[index:index + chunk_size], start, end)
+        for index in range(0, len(customer_ids), chunk_size)
+    ]
+    if tasks:
+        group(tasks).apply_async()
+    logger.info("Queued %d statement tasks (%d customers) for %s..%s", len(tasks), len(customer_ids), start, end)
+    return len(tasks)
+
+
+@shared_task(**RETRY_POLICY)
+def generate_recurring_chunk_task(recurring_ids, day):
+    """
+    Bill the periods due on day for a chunk of recurring templates.
+    Periods already billed are skipped, so a retry resumes the chunk.
+
+    Returns:
+        Number of invoices created
+    """
+    return generate_recurring_invoices(recurring_ids, datetime.date.fromisoformat(day))
+
+
+@shared_task(**RETRY_POLICY)
+def generate_recurring_invoices_task(day=None, chunk_size=RECURRING_FANOUT_CHUNK):
+    """
+    Queue the generation of the recurring invoices due on day (default:
+    today), chunk_size templates per task so the billing spreads over the workers.
+
+    Returns:
+        Number of tasks queued
+    """
+    day = day or timezone.localdate().isoformat()
+    recurring_ids = list(due_recurring_ids(datetime.date.fromisoformat(day)))
+    tasks = [
+        generate_recurring_chunk_task.s(recurring_ids[index:index + chunk_size], day)
+        for index in range(0, len(recurring_ids), chunk_size)
+    ]
+    if tasks:
+        group(tasks).apply_async()
+    logger.info("Queued %d recurring invoice tasks (%d templates) for %s", len(tasks), len(recurring_ids), day)
+    return len(tasks)
+
+
+@shared_task(rate_limit=EMAIL_RATE_LIMIT, **RETRY_POLICY)
+def send_invoice_deliveries_task(delivery_ids):
+    """
+    Email a batch of queued invoices over one connection.
+    Deliveries already sent are skipped, so a retry only resends the failed ones.
+
+    Returns:
+        Dictionary with the number of deliveries sent and failed
+    """
+    return send_deliveries(delivery_ids)
+
+
+@shared_task(**RETRY_POLICY)
+def requeue_stale_deliveries_task():
+    """
+    Queue again the deliveries claimed by a worker that died mid-batch and
+    the pending ones whose retries ran out (mail server outage).
+
+    Returns:
+        Number of deliveries requeued
+    """
+    return queue_stale_deliveries()
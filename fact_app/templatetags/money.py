@@ -0,0 +1,17 @@
+"""
+Amount display
+
+    {% load money %}
+    {{ pricing.total|money:obj.currency }}
+"""
+from django import template
+
+from ..money import format_amount, get_base_currency
+
+register = template.Library()
+
+
+@register.filter
+def money(amount, currency=None):
+    """Amount followed by the symbol of currency (the base currency by default)"""
+    return format_amount(amount, currency or get_base_currency())
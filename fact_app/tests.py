@@ -1,3 +1,1782 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
+import logging
+import os
+import random
+import smtplib
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, transaction
+from django.db.models import ProtectedError
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import logging_config
+from django_invoice.celery import app as celery_app
+from logging_config import JsonFormatter, enable_queue_logging
+
+from . import delivery
+from .archive import archive_invoice_batch, archive_paid_invoices, get_invoice_or_archived
+from .audit import audit_context, audit_entries
+from .backends import PERMISSIONS_CACHE_KEY, USER_CACHE_KEY, CachedModelBackend
+from .changes import encode_cursor, get_changes, prune_tombstones
+from .dedupe import (
+    find_duplicate_clusters, fold_name, merge_customers, merge_duplicate_clusters, normalize_email, normalize_phone,
+)
+from .delivery import DELIVERY_MAX_ATTEMPTS, send_deliveries
+from .events import EVENTS_RETRY_AFTER, LocalEventBus, event_waiter
+from .fx import (
+    aggregate_converted_total_cents, convert, end_rate_cache, get_rate, read_rate_file, start_rate_cache, store_rates,
+)
+from .lines import CompactArticles
+from .listing import LISTING_FIELDS, customer_invoice_page, decode_page_cursor
+from .models import (
+    ArchivedArticle, ArchivedInvoice, AuditEntry, Customer, DailyRevenue, Invoice, InvoiceDelivery, Article, Payment,
+    ReconcileLock, RecurringInvoice, RecurringInvoiceLine, Tombstone,
+)
+from .numbering import assign_pending_invoice_numbers
+from .pdf import store_invoice_pdf
+from .payments import StatementLine, reconcile_statement, record_payment
+from .statements import Statement, statement_currencies
+from .money import annotate_totals, format_cents, from_cents, to_cents
+from .pricing import price_invoices, price_line, price_lines, price_rows
+from .recurring import add_months, generate_recurring_invoices
+from .reports import rebuild_revenue, refresh_revenue_range, revenue_series
+from .rollups import rebuild_customer_rollups, refresh_invoice_totals
+from .tasks import (
+    generate_invoice_export, generate_recurring_invoices_task, get_cached_invoice_statistics, import_customers_csv,
+    reconcile_invoice_totals, refresh_invoice_statistics, render_invoice_pdf_task,
+)
+from .tokens import create_api_token
+from .utils import BULK_CHUNK_SIZE, BULK_MAX_IDS, bulk_delete_invoices, bulk_update_invoices, get_customer_summary, get_invoice_statistics, invoices_for_user
+
+
+def legacy_invoice_total(lines):
+    """Decimal computation used before the money core (reference implementation)"""
+    return sum(Decimal(str(quantity * price)) for quantity, price in lines) if lines else Decimal('0.00')
+
+
+def random_price(rng):
+    return Decimal(rng.randint(0, 10 ** 9)).scaleb(-2)
+
+
+def random_lines(rng, max_lines=40):
+    return [(rng.randint(1, 10000), random_price(rng)) for _ in range(rng.randint(0, max_lines))]
+
+
+def make_customer(user, email, phone, **fields):
+    """Customer saved by user; the other fields default to a client in Douala"""
+    values = {'name': 'Client', 'address': 'Rue 1', 'sex': 'F', 'city': 'Douala', 'zip_code': '0000', **fields}
+    return Customer.objects.create(email=email, phone=phone, save_by=user, **values)
+
+
+class ListHandler(logging.Handler):
+    """Keeps the records it is given, formatted"""
+
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.setFormatter(JsonFormatter())
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(json.loads(self.format(record)))
+
+
+class LoggingTests(SimpleTestCase):
+    """JSON log lines, written by the queue listener thread"""
+
+    def record(self, **kwargs):
+        return logging.LogRecord('fact_app.tests', logging.ERROR, __file__, 1, 'Invoice %s failed', (12,), **kwargs)
+
+    def test_json_formatter(self):
+        record = self.record(exc_info=None)
+        record.invoice_id = 12
+        record.amount = Decimal('7.50')
+        line = json.loads(JsonFormatter().format(record))
+        self.assertEqual(
+            {key: line[key] for key in ('level', 'logger', 'message', 'invoice_id', 'amount')},
+            {'level': 'ERROR', 'logger': 'fact_app.tests', 'message': 'Invoice 12 failed',
+             'invoice_id': 12, 'amount': '7.50'},
+        )
+        self.assertNotIn('exception', line)
+
+        try:
+            raise ValueError('boom')
+        except ValueError as exc:
+            line = json.loads(JsonFormatter().format(self.record(exc_info=(ValueError, exc, exc.__traceback__))))
+        self.assertIn('ValueError: boom', line['exception'])
+
+    def test_queue_logging(self):
+        logger = logging.getLogger('fact_app.tests.queued')
+        logger.propagate = False
+        self.addCleanup(setattr, logger, 'propagate', True)
+        handler, warnings = ListHandler(), ListHandler(logging.WARNING)
+        logger.handlers = [handler, warnings]
+        self.addCleanup(setattr, logger, 'handlers', [])
+
+        enable_queue_logging(['fact_app.tests.queued'])
+        queue_handler, targets, listener = logging_config._QUEUED_LOGGERS.pop()
+        self.assertEqual((logger.handlers, targets), ([queue_handler], [handler, warnings]))
+
+        logger.info('Invoice %s sent', 12, extra={'invoice_id': 12})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('Invoice %s failed', 13)
+        listener.stop()
+
+        self.assertEqual([line['message'] for line in handler.lines], ['Invoice 12 sent', 'Invoice 13 failed'])
+        self.assertEqual(handler.lines[0]['invoice_id'], 12)
+        self.assertIn('ValueError: boom', handler.lines[1]['exception'])
+        # Handler levels are honoured behind the queue
+        self.assertEqual([line['message'] for line in warnings.lines], ['Invoice 13 failed'])
+
+
+class MoneyPropertyTests(SimpleTestCase):
+    """Randomized properties checking integer-cents math against Decimal math"""
+    SEED = 20260127
+    RUNS = 500
+
+    def test_cents_round_trip(self):
+        rng = random.Random(self.SEED)
+        for _ in range(self.RUNS):
+            price = random_price(rng)
+            self.assertEqual(from_cents(to_cents(price)), price)
+            self.assertEqual(format_cents(to_cents(price)), str(price))
+
+    def test_rounding_is_half_up_to_the_cent(self):
+        self.assertEqual(to_cents(Decimal('0.005')), 1)
+        self.assertEqual(to_cents(Decimal('0.004')), 0)
+        self.assertEqual(to_cents('12.345'), 1235)
+        self.assertEqual(to_cents(7), 700)
+
+    def test_invoice_total_matches_decimal(self):
+        rng = random.Random(self.SEED + 1)
+        for _ in range(self.RUNS):
+            lines = random_lines(rng)
+            # Articles set as if prefetched: the model prices them without a query
+            invoice = Invoice(pk=1)
+            invoice._prefetched_objects_cache = {
+                'articles': [Article(name='Item', quantity=quantity, unit_price=price) for quantity, price in lines],
+            }
+            expected = legacy_invoice_total(lines)
+            self.assertEqual(invoice.get_total, expected)
+            self.assertEqual(format_cents(invoice.total_cents), str(Decimal(expected).quantize(Decimal('0.01'))))
+
+
+class MoneyDatabaseTests(TestCase):
+    """SQL aggregates and model totals agree with the Decimal reference"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        user = User.objects.create(username='owner')
+        customer = make_customer(user, 'client@example.com', '6990000000')
+        cls.expected = {}
+        for _ in range(25):
+            invoice = Invoice.objects.create(customer=customer, save_by=user, invoice_type='I')
+            lines = random_lines(rng, max_lines=8)
+            Article.objects.bulk_create(
+                Article(invoice=invoice, name='Item', quantity=quantity, unit_price=price)
+                for quantity, price in lines
+            )
+            cls.expected[invoice.pk] = legacy_invoice_total(lines)
+        cls.customer = customer
+
+    def test_model_totals(self):
+        for invoice in Invoice.objects.all():
+            self.assertEqual(invoice.get_total, self.expected[invoice.pk])
+        for invoice in Invoice.objects.prefetch_related('articles'):
+            self.assertEqual(invoice.get_total, self.expected[invoice.pk])
+
+    def test_annotated_totals(self):
+        for invoice in annotate_totals(Invoice.objects.all()):
+            self.assertEqual(invoice.get_total, self.expected[invoice.pk])
+
+    def test_compact_articles(self):
+        for pk, expected in self.expected.items():
+            self.assertEqual(CompactArticles.for_invoice(pk).get_total, expected)
+
+    def test_aggregates(self):
+        total = sum(self.expected.values())
+        self.assertEqual(self.customer.get_total_invoices(), total)
+        self.assertEqual(get_invoice_statistics()['total_amount'], total)
+
+
+class PricingTests(SimpleTestCase):
+    """Rounding rule of the pricing engine"""
+
+    def test_line_rounding(self):
+        # 3 x 19.99, 10% off, 19.25% tax: 59.97 - 6.00 (5.997) + 10.39 (10.389225)
+        self.assertEqual(tuple(price_line(3, 1999, 1000, 1925)), (5997, 600, 1039, 6436))
+        # Half a cent is rounded up, on the discount and on the tax
+        self.assertEqual(tuple(price_line(1, 5, 1000, 0)), (5, 1, 0, 4))
+        self.assertEqual(tuple(price_line(1, 50, 0, 100)), (50, 0, 1, 51))
+        self.assertEqual(price_line(2, 1000, 10000, 1925).total, 0)
+
+    def test_invoice_sums(self):
+        pricing = price_lines([3, 1], [1999, 50], [1000, 0], [1925, 100], adjustment=-500)
+        self.assertEqual((pricing.subtotal, pricing.discount, pricing.tax), (6047, 600, 1040))
+        self.assertEqual(pricing.total, 6436 + 51 - 500)
+        self.assertEqual(pricing.tax_by_rate, {100: 1, 1925: 1039})
+        self.assertEqual(pricing.amounts()['adjustment'], Decimal('-5.00'))
+
+    def test_batch_matches_single_invoices(self):
+        rng = random.Random(46)
+        invoices = {
+            pk: [(rng.randint(1, 50), rng.randint(0, 10 ** 6), rng.randint(0, 5000), rng.choice([0, 550, 1925]))
+                 for _ in range(rng.randint(0, 10))]
+            for pk in range(1, 60)
+        }
+        adjustments = {pk: rng.randint(-1000, 1000) for pk in invoices}
+        rows = [(pk, *line) for pk, lines in invoices.items() for line in lines]
+        rng.shuffle(rows)
+        totals = price_invoices(*zip(*rows), adjustments)
+        for pk, lines in invoices.items():
+            self.assertEqual(totals[pk], price_rows(lines, adjustments[pk]).total)
+
+
+class PricingDatabaseTests(TestCase):
+    """SQL totals, stored totals and model totals all follow the pricing engine"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(2046)
+        user = User.objects.create(username='pricing')
+        customer = make_customer(user, 'pricing@example.com', '6990000000')
+        cls.expected = {}
+        for _ in range(20):
+            adjustment = Decimal(rng.randint(-500, 500)).scaleb(-2)
+            invoice = Invoice.objects.create(customer=customer, save_by=user, invoice_type='I', adjustment=adjustment)
+            lines = [
+                (rng.randint(1, 100), random_price(rng), rng.randint(0, 3000), rng.choice([0, 550, 1925]))
+                for _ in range(rng.randint(0, 8))
+            ]
+            Article.objects.bulk_create(
+                Article(invoice=invoice, name='Item', quantity=quantity, unit_price=price,
+                        discount_bp=discount_bp, tax_rate_bp=tax_rate_bp)
+                for quantity, price, discount_bp, tax_rate_bp in lines
+            )
+            pricing = price_rows(((q, to_cents(p), d, t) for q, p, d, t in lines), to_cents(adjustment))
+            cls.expected[invoice.pk] = from_cents(pricing.total)
+        cls.customer = customer
+
+    def test_sql_and_model_totals(self):
+        for invoice in annotate_totals(Invoice.objects.all()):
+            self.assertEqual(invoice.get_total, self.expected[invoice.pk])
+        for invoice in Invoice.objects.all():
+            self.assertEqual(invoice.get_total, self.expected[invoice.pk])
+        for invoice in Invoice.objects.prefetch_related('articles'):
+            self.assertEqual(invoice.get_total, self.expected[invoice.pk])
+            self.assertEqual(
+                CompactArticles.for_invoice(invoice.pk).get_pricing(to_cents(invoice.adjustment)).amounts()['total'],
+                self.expected[invoice.pk],
+            )
+
+    def test_stored_totals_and_aggregates(self):
+        refresh_invoice_totals(self.expected)
+        self.assertEqual(dict(Invoice.objects.values_list('id', 'total')), self.expected)
+        total = sum(self.expected.values())
+        self.assertEqual(self.customer.get_total_invoices(), total)
+        self.assertEqual(get_invoice_statistics()['total_amount'], total)
+
+
+class TaskTests(TestCase):
+    """Celery tasks run eagerly (CELERY_TASK_ALWAYS_EAGER) against the test database"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='worker')
+        self.customer = make_customer(self.user, 'tasks@example.com', '6990000000', sex='M')
+        self.invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+        Article.objects.create(invoice=self.invoice, name='Item', quantity=3, unit_price=Decimal('2.50'))
+
+    def test_reconcile_invoice_totals_is_idempotent(self):
+        self.assertEqual(reconcile_invoice_totals.delay().get(), 1)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total, Decimal('7.50'))
+        self.assertEqual(reconcile_invoice_totals.delay().get(), 0)
+
+    def test_refresh_invoice_statistics(self):
+        refresh_invoice_statistics.delay()
+        stats = get_cached_invoice_statistics()
+        self.assertEqual(stats['total_invoices'], 1)
+        self.assertEqual(stats['total_amount'], Decimal('7.50'))
+
+    def test_statements_run_on_the_reports_queue(self):
+        for name in ('generate_monthly_statements', 'render_customer_statements_task'):
+            with self.subTest(name=name):
+                self.assertEqual(celery_app.amqp.router.route({}, f'fact_app.tasks.{name}')['queue'].name, 'reports')
+
+    def test_beat_schedule_names_registered_tasks(self):
+        self.assertFalse(hasattr(settings, 'CELERY_BEAT_SCHEDULE'))
+        for name, entry in celery_app.conf.beat_schedule.items():
+            with self.subTest(name=name):
+                self.assertIn(entry['task'], celery_app.tasks)
+
+    def temporary_directory(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return directory.name
+
+    def test_render_invoice_pdf_task_caches_each_version(self):
+        with override_settings(INVOICE_PDF_CACHE_DIR=self.temporary_directory()), \
+                mock.patch('fact_app.tasks.render_invoice_pdf', return_value=b'%PDF') as render:
+            path = render_invoice_pdf_task.delay(self.invoice.pk).get()
+            self.assertEqual(render_invoice_pdf_task.delay(self.invoice.pk).get(), path)
+            self.assertEqual(render.call_count, 1)
+
+            self.invoice.comments = 'Edited'
+            self.invoice.save()
+            edited = render_invoice_pdf_task.delay(self.invoice.pk).get()
+            # The PDF is dated with the day it is rendered: a cached copy only serves that day
+            with mock.patch('django.utils.timezone.localdate', return_value=timezone.localdate() + datetime.timedelta(days=1)):
+                tomorrow = render_invoice_pdf_task.delay(self.invoice.pk).get()
+            self.assertEqual(render.call_count, 3)
+            self.assertEqual(len({path, edited, tomorrow}), 3)
+            self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(tomorrow)])
+            self.assertIsNone(render_invoice_pdf_task.delay(999999).get())
+
+    def test_generate_invoice_export(self):
+        other = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I', paid=True)
+        Invoice.objects.filter(pk=other.pk).update(invoice_date_time=timezone.now() - datetime.timedelta(days=40))
+        start = timezone.localdate() - datetime.timedelta(days=1)
+        with override_settings(INVOICE_EXPORT_DIR=self.temporary_directory()):
+            path = generate_invoice_export.delay(str(start)).get()
+            self.assertEqual(generate_invoice_export.delay(str(start)).get(), path)
+            self.assertEqual(len(os.listdir(os.path.dirname(path))), 1)
+            with open(path, newline='', encoding='utf-8') as export:
+                rows = list(csv.DictReader(export))
+            with open(generate_invoice_export.delay().get(), newline='', encoding='utf-8') as export:
+                self.assertEqual(len(list(csv.DictReader(export))), 2)
+        self.assertEqual([(row['id'], row['total']) for row in rows], [(str(self.invoice.pk), '7.50')])
+
+    def test_import_customers_csv(self):
+        path = os.path.join(self.temporary_directory(), 'customers.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as source:
+            writer = csv.writer(source)
+            writer.writerow(['name', 'email', 'phone', 'address', 'sex', 'age', 'city', 'zip_code'])
+            writer.writerow(['New', 'new@example.com', '6990000017', 'Rue 2', 'F', '30', 'Yaounde', '0001'])
+            writer.writerow(['Again', 'NEW@example.com', '6990000018', 'Rue 2', 'F', '', 'Yaounde', '0001'])
+            writer.writerow(['Existing', 'TASKS@example.com', '6990000019', 'Rue 2', 'M', '', 'Douala', '0000'])
+            writer.writerow(['Same phone', 'phone@example.com', '699 000 0000', 'Rue 3', 'M', 'x', 'Douala', '0000'])
+            writer.writerow(['', 'noname@example.com', '', '', '', '', '', ''])
+        expected = {'read': 5, 'created': 2, 'possible_duplicates': 1}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(import_customers_csv.delay(path, self.user.pk).get(), expected)
+        self.assertEqual(import_customers_csv.delay(path, self.user.pk).get(), {**expected, 'created': 0, 'possible_duplicates': 0})
+        imported = Customer.objects.get(email='NEW@example.com')
+        self.assertEqual((imported.name, imported.age, imported.save_by), ('Again', None, self.user))
+        entries = AuditEntry.objects.filter(object_type='customer', action=AuditEntry.ACTION_CREATE)
+        self.assertEqual(
+            sorted(entry.changes['email'][1] for entry in entries), ['NEW@example.com', 'phone@example.com'],
+        )
+
+    def test_import_of_a_missing_file_is_not_retried(self):
+        with mock.patch.object(import_customers_csv, 'retry') as retry, self.assertRaises(FileNotFoundError):
+            import_customers_csv.delay('/nonexistent/customers.csv', self.user.pk).get()
+        retry.assert_not_called()
+
+
+    def test_only_transient_database_errors_are_retried(self):
+        for error, retried in ((OperationalError('lost'), True), (IntegrityError('duplicate'), False)):
+            with self.subTest(error=type(error).__name__):
+                with mock.patch('fact_app.tasks.get_invoice_statistics', side_effect=error), \
+                        mock.patch.object(refresh_invoice_statistics, 'retry', side_effect=RuntimeError) as retry:
+                    with self.assertRaises(RuntimeError if retried else type(error)):
+                        refresh_invoice_statistics.delay().get()
+                self.assertEqual(retry.called, retried)
+
+class IndexUsageTests(TestCase):
+    """EXPLAIN the hot queries and check the planner picks the matching index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='planner')
+        cls.customer = make_customer(cls.user, 'plans@example.com', '6990000000')
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=cls.customer, save_by=cls.user, invoice_type='I', paid=i % 10 != 0)
+            for i in range(200)
+        )
+        cls.invoice = invoices[0]
+        Article.objects.bulk_create(
+            Article(invoice=invoice, name='Item', quantity=1, unit_price=Decimal('1.00'))
+            for invoice in invoices
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables would otherwise always be read sequentially
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            else:
+                cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_unpaid_invoices_by_date(self):
+        self.assertUsesIndex(
+            Invoice.objects.filter(paid=False).order_by('-invoice_date_time'),
+            'invoice_unpaid_date_idx',
+        )
+
+    def test_customer_invoices_by_date(self):
+        self.assertUsesIndex(
+            Invoice.objects.filter(customer=self.customer).order_by('-invoice_date_time'),
+            'invoice_customer_date_idx',
+        )
+
+    def test_customer_invoice_page(self):
+        cursor = customer_invoice_page(self.customer.pk, limit=10)['cursor']
+        timestamp, _invoice_id = decode_page_cursor(cursor)
+        self.assertUsesIndex(
+            Invoice.objects.filter(customer=self.customer, paid=False, invoice_date_time__lte=timestamp)
+            .order_by('-invoice_date_time', '-id').values(*LISTING_FIELDS),
+            'invoice_customer_date_idx',
+        )
+
+    def test_bulk_update_scope(self):
+        owned = invoices_for_user(self.user)
+        self.assertUsesIndex(owned.order_by('id').values_list('id', flat=True), 'invoice_save_by_idx')
+        plan = owned.filter(id__in=[1, 2, 3]).values_list('id', flat=True).explain()
+        self.assertNotIn('SCAN fact_app_invoice', plan, plan)
+        self.assertNotIn('Seq Scan', plan, plan)
+
+    def test_invoice_lines(self):
+        self.assertUsesIndex(
+            Article.objects.filter(invoice=self.invoice).order_by('created_at', 'id'),
+            'article_invoice_lines_idx',
+        )
+
+
+class NumberingTests(TestCase):
+    """Invoice numbers are sequential per (year, type) and in date order"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='numbers')
+        self.customer = make_customer(self.user, 'numbers@example.com', '6990000000')
+
+    def create_invoice(self, invoice_type='I'):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type=invoice_type)
+        invoice.refresh_from_db()
+        return invoice
+
+    def test_numbers_follow_each_other_per_type(self):
+        year = self.create_invoice().invoice_date_time.year
+        numbers = [self.create_invoice(invoice_type).number for invoice_type in ('I', 'P', 'I')]
+        self.assertEqual(numbers, [f'I-{year}-00002', f'P-{year}-00001', f'I-{year}-00003'])
+
+    def test_rolled_back_invoice_leaves_no_gap(self):
+        first = self.create_invoice()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+            raise RuntimeError
+        second = self.create_invoice()
+        self.assertEqual(int(second.number[-5:]), int(first.number[-5:]) + 1)
+
+    def test_pending_invoices_are_numbered(self):
+        invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='R')
+        self.assertEqual(assign_pending_invoice_numbers(), 1)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.number, f'R-{invoice.invoice_date_time.year}-00001')
+        self.assertEqual(assign_pending_invoice_numbers(), 0)
+
+    def test_pending_invoices_are_numbered_in_date_order(self):
+        later = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='R')
+        earlier = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='R')
+        an_hour_before = later.invoice_date_time - datetime.timedelta(hours=1)
+        Invoice.objects.filter(pk=earlier.pk).update(invoice_date_time=an_hour_before)
+        self.assertEqual(assign_pending_invoice_numbers(), 2)
+        later.refresh_from_db()
+        earlier.refresh_from_db()
+        self.assertLess(earlier.number, later.number)
+
+
+class InvoiceCreationApiTests(TestCase):
+    """JSON invoice creation with Idempotency-Key replays"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='creator')
+        self.client.force_login(self.user)
+        self.customer = make_customer(self.user, 'creator@example.com', '6990000001')
+        self.payload = {
+            'customer_id': self.customer.id, 'invoice_type': 'I',
+            'articles': [{'name': 'Item', 'quantity': 3, 'unit_price': '1.10'}],
+        }
+
+    def post(self, url, payload, **headers):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, payload, content_type='application/json', headers=headers)
+
+    def test_create_invoice_with_articles(self):
+        response = self.post('/api/invoices/', self.payload)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['invoice']['total'], '3.30')
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.total_cents, 330)
+        self.assertIsNotNone(invoice.number)
+
+    def test_create_invoice_with_discount_tax_and_adjustment(self):
+        payload = dict(self.payload, adjustment='-1.00', articles=[
+            {'name': 'Item', 'quantity': 3, 'unit_price': '19.99', 'discount_bp': 1000, 'tax_rate_bp': 1925},
+        ])
+        response = self.post('/api/invoices/', payload)
+        self.assertEqual(response.json()['invoice']['total'], '63.36')
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.total, Decimal('63.36'))
+        detail = self.client.get(f'/api/invoices/{invoice.pk}/').json()
+        self.assertEqual(detail['pricing']['tax'], '10.39')
+        self.assertEqual(detail['pricing']['taxes'], [{'tax_rate_bp': 1925, 'tax': '10.39'}])
+
+        too_much = dict(payload, adjustment='-100.00')
+        self.assertEqual(self.post('/api/invoices/', too_much).status_code, 400)
+
+    def test_idempotency_key_replays_the_first_response(self):
+        first = self.post('/api/invoices/', self.payload, **{'Idempotency-Key': 'abc'})
+        replay = self.post('/api/invoices/', self.payload, **{'Idempotency-Key': 'abc'})
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(Invoice.objects.count(), 1)
+
+        other = dict(self.payload, paid=True)
+        self.assertEqual(self.post('/api/invoices/', other, **{'Idempotency-Key': 'abc'}).status_code, 422)
+
+    @override_settings(IDEMPOTENCY_PENDING_TTL=30, IDEMPOTENCY_KEY_TTL=3600)
+    def test_pending_idempotency_claim_is_short_lived(self):
+        with mock.patch('fact_app.creation.cache', wraps=cache) as wrapped:
+            self.assertEqual(self.post('/api/invoices/', self.payload, **{'Idempotency-Key': 'ttl'}).status_code, 201)
+        self.assertEqual(wrapped.add.call_args.args[2], 30)
+        self.assertEqual(wrapped.set.call_args.args[2], 3600)
+        self.assertNotEqual(wrapped.get(wrapped.add.call_args.args[0]), 'pending')
+
+    def test_batch_is_all_or_nothing(self):
+        response = self.post('/api/invoices/batch/', {'invoices': [self.payload, dict(self.payload, customer_id=0)]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Invoice.objects.exists())
+
+        bad_article = dict(self.payload, articles=[{'name': 'Item', 'quantity': 0, 'unit_price': '1'}])
+        response = self.post('/api/invoices/batch/', {'invoices': [self.payload, bad_article]})
+        self.assertIn('invoices[1]', response.json()['error'])
+
+        response = self.post('/api/invoices/batch/', {'invoices': [self.payload, self.payload]})
+        self.assertEqual(len(response.json()['invoices']), 2)
+        self.assertEqual(Article.objects.count(), 2)
+
+
+    def test_api_token_authenticates_without_session_or_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post('/api/invoices/', self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Authentication required.'})
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        _token, key = create_api_token(self.user, 'ERP')
+        headers = {'Authorization': f'Token {key}'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/invoices/batch/', {'invoices': [self.payload]},
+                                   content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Invoice.objects.get().save_by, self.user)
+        self.assertEqual(client.get('/api/invoices/', headers=headers).status_code, 200)
+
+        bad = client.get('/api/invoices/', headers={'Authorization': 'Token nope'})
+        self.assertEqual((bad.status_code, bad.json()['error']), (401, 'Invalid API token.'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(client.get('/api/invoices/', headers=headers).status_code, 401)
+
+    def test_session_writes_still_need_the_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post('/api/invoices/', self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'error': 'CSRF verification failed.'})
+        self.assertEqual(client.get('/api/invoices/').status_code, 200)
+        self.assertFalse(Invoice.objects.exists())
+
+class InvoiceEditApiTests(TestCase):
+    """PATCH and bulk endpoints: scoped to the user's invoices, chunked, bounded"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='editor')
+        self.other = User.objects.create(username='stranger')
+        self.client.force_login(self.user)
+        customer = make_customer(self.user, 'editor@example.com', '6990000016')
+        self.mine = [Invoice.objects.create(customer=customer, save_by=self.user, invoice_type='I') for _ in range(3)]
+        self.theirs = Invoice.objects.create(customer=customer, save_by=self.other, invoice_type='I')
+        Article.objects.create(invoice=self.mine[0], name='Line', quantity=1, unit_price=Decimal('10.00'))
+
+    def post(self, action, payload):
+        return self.client.post(f'/api/invoices/bulk/{action}/', payload, content_type='application/json')
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return {row['id']: row['status'] for row in response.json()['results']}
+
+    def test_patch(self):
+        url = f'/api/invoices/{self.mine[0].pk}/'
+        response = self.client.patch(url, {'paid': True, 'comments': 'Paid cash'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['paid'], response.json()['comments']), (True, 'Paid cash'))
+        self.mine[0].refresh_from_db()
+        self.assertTrue(self.mine[0].paid)
+
+        self.assertEqual(self.client.patch(url, {'paid': 'yes'}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.patch(url, {'invoice_type': 'X'}, content_type='application/json').status_code, 400)
+        response = self.client.patch(f'/api/invoices/{self.theirs.pk}/', {'paid': True}, content_type='application/json')
+        # Not found: LocaleMiddleware turns the 404 into a redirect to the language-prefixed URL
+        self.assertEqual(response.status_code, 302)
+        self.theirs.refresh_from_db()
+        self.assertFalse(self.theirs.paid)
+
+    def test_bulk_status_and_comment_only_touch_the_users_invoices(self):
+        ids = [invoice.pk for invoice in self.mine] + [self.theirs.pk, 999999, self.mine[0].pk]
+        expected = {**{invoice.pk: 'updated' for invoice in self.mine}, self.theirs.pk: 'not_found', 999999: 'not_found'}
+        self.assertEqual(self.statuses(self.post('status', {'ids': ids, 'paid': True})), expected)
+        self.assertEqual(self.statuses(self.post('comment', {'ids': ids, 'comments': 'Bulk'})), expected)
+        self.assertEqual(
+            list(Invoice.objects.order_by('id').values_list('paid', 'comments')),
+            [(True, 'Bulk')] * 3 + [(False, None)],
+        )
+
+    def test_bulk_delete_only_removes_the_users_invoices(self):
+        ids = [self.mine[0].pk, self.theirs.pk]
+        self.assertEqual(self.statuses(self.post('delete', {'ids': ids})),
+                         {self.mine[0].pk: 'deleted', self.theirs.pk: 'not_found'})
+        self.assertFalse(Invoice.objects.filter(pk=self.mine[0].pk).exists())
+        self.assertFalse(Article.objects.exists())
+        self.assertTrue(Invoice.objects.filter(pk=self.theirs.pk).exists())
+
+    def test_superusers_reach_every_invoice(self):
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertEqual(self.statuses(self.post('status', {'ids': [self.theirs.pk], 'paid': True})),
+                         {self.theirs.pk: 'updated'})
+
+    def test_invalid_payloads(self):
+        for action, payload in (
+            ('status', {'ids': [self.mine[0].pk]}),
+            ('status', {'ids': [], 'paid': True}),
+            ('comment', {'ids': [True], 'comments': 'x'}),
+            ('comment', {'ids': ['1'], 'comments': 'x'}),
+            ('delete', {'ids': list(range(1, BULK_MAX_IDS + 2))}),
+        ):
+            with self.subTest(action=action, payload=str(payload)[:40]):
+                self.assertEqual(self.post(action, payload).status_code, 400)
+        self.assertEqual(Invoice.objects.count(), 4)
+
+    def test_ids_are_applied_in_chunks(self):
+        ids = [self.theirs.pk, self.mine[1].pk, self.mine[2].pk]
+        with mock.patch('fact_app.utils.BULK_CHUNK_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            results = bulk_update_invoices(self.user, ids, comments='Chunked')
+        self.assertEqual(results, {self.theirs.pk: 'not_found', self.mine[1].pk: 'updated', self.mine[2].pk: 'updated'})
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "fact_app_invoice"')]
+        self.assertEqual(len(updates), 2)
+
+        ids = list(range(1, BULK_MAX_IDS + 1))
+        with CaptureQueriesContext(connection) as queries:
+            results = bulk_delete_invoices(self.user, ids)
+        self.assertEqual(len(results), BULK_MAX_IDS)
+        self.assertEqual(sum(1 for status in results.values() if status == 'deleted'), 3)
+        lookups = [query for query in queries if query['sql'].startswith('SELECT "fact_app_invoice"."id" FROM')]
+        self.assertEqual(len(lookups), BULK_MAX_IDS // BULK_CHUNK_SIZE)
+
+
+class PaymentTests(TestCase):
+    """Partial payments and statement reconciliation"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='payments')
+        self.customer = make_customer(self.user, 'payments@example.com', '6990000002', sex='M')
+
+    def create_invoice(self, total, currency='XAF'):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(
+                customer=self.customer, save_by=self.user, invoice_type='I', currency=currency
+            )
+            Article.objects.create(invoice=invoice, name='Item', quantity=1, unit_price=Decimal(total))
+        invoice.refresh_from_db()
+        return invoice
+
+    def test_partial_payments_add_up(self):
+        invoice = self.create_invoice('100.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            record_payment(self.user, invoice, Decimal('40.00'))
+        invoice.refresh_from_db()
+        self.customer.refresh_from_db()
+        self.assertFalse(invoice.paid)
+        self.assertEqual(invoice.outstanding, Decimal('60.00'))
+        self.assertEqual(self.customer.total_outstanding, Decimal('60.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_payment(self.user, invoice, Decimal('60.00'))
+        invoice.refresh_from_db()
+        self.customer.refresh_from_db()
+        self.assertTrue(invoice.paid)
+        self.assertEqual(self.customer.total_outstanding, Decimal('0.00'))
+
+    def test_reconcile_by_reference_then_amount(self):
+        by_reference = self.create_invoice('50.00')
+        by_amount = self.create_invoice('75.25')
+        today = timezone.localdate()
+        lines = [
+            StatementLine(today, Decimal('20.00'), f'Transfer {by_reference.number.lower()} thanks'),
+            StatementLine(today, Decimal('75.25'), 'Transfer'),
+            StatementLine(today, Decimal('9.99'), 'Unknown'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            batch = reconcile_statement(self.user, lines, 'statement')
+        self.assertEqual((batch.line_count, batch.matched_count), (3, 2))
+        self.assertEqual(batch.newly_paid, [by_amount.pk])
+        by_reference.refresh_from_db()
+        self.assertEqual(by_reference.amount_paid, Decimal('20.00'))
+        self.assertFalse(by_reference.paid)
+        self.assertEqual(Payment.objects.filter(invoice__isnull=True).count(), 1)
+
+    def test_reconcile_only_matches_invoices_in_the_statement_currency(self):
+        euros = self.create_invoice('75.25', currency='EUR')
+        francs = self.create_invoice('75.25')
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            batch = reconcile_statement(self.user, [
+                StatementLine(today, Decimal('75.25'), 'Transfer'),
+                StatementLine(today, Decimal('10.00'), f'Transfer {euros.number}'),
+            ], 'statement')
+        self.assertEqual((batch.currency, batch.matched_count, batch.newly_paid), ('XAF', 1, [francs.pk]))
+        self.assertEqual(set(Payment.objects.values_list('currency', flat=True)), {'XAF'})
+        euros.refresh_from_db()
+        self.assertEqual((euros.paid, euros.amount_paid), (False, Decimal('0.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            batch = reconcile_statement(self.user, [StatementLine(today, Decimal('75.25'), 'Virement')], currency='EUR')
+        self.assertEqual(batch.newly_paid, [euros.pk])
+        self.assertEqual(record_payment(self.user, euros, Decimal('1.00')).currency, 'EUR')
+
+    def test_reconcile_api_only_matches_the_users_invoices(self):
+        other_user = User.objects.create(username='payments-other')
+        other = self.create_invoice('30.00')
+        Invoice.objects.filter(pk=other.pk).update(save_by=other_user)
+        own = self.create_invoice('30.00')
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/payments/reconcile/', {'lines': [
+                {'amount': '5.00', 'reference': f'Transfer {other.number}'},
+                {'amount': '30.00', 'reference': 'Transfer'},
+            ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['matched_count'], response.json()['paid_invoice_ids']), (1, [own.pk]))
+        other.refresh_from_db()
+        self.assertEqual(other.amount_paid, Decimal('0.00'))
+        self.assertTrue(ReconcileLock.objects.filter(currency='XAF').exists())
+
+    def test_deleted_invoices_leave_their_payments_unmatched(self):
+        single, bulk, archived = (self.create_invoice('10.00') for _ in range(3))
+        for invoice in (single, bulk, archived):
+            record_payment(self.user, invoice, Decimal('10.00'))
+        single.delete()
+        self.assertEqual(bulk_delete_invoices(self.user, [bulk.pk]), {bulk.pk: 'deleted'})
+        Invoice.objects.filter(pk=archived.pk).update(
+            invoice_date_time=timezone.now() - datetime.timedelta(days=800)
+        )
+        self.assertEqual(archive_paid_invoices(), 1)
+
+        self.assertEqual(
+            list(Payment.objects.order_by('id').values_list('invoice_id', 'match')),
+            [(None, ''), (None, ''), (archived.pk, Payment.MATCH_MANUAL)],
+        )
+
+
+class CustomerInvoicesApiTests(TestCase):
+    """Keyset pagination of a customer's invoices"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='listing')
+        cls.customer, other = Customer.objects.bulk_create([
+            Customer(
+                name=name, email=f'{name}@example.com', phone='6990000003',
+                address='Rue 1', sex='F', city='Douala', zip_code='0000', save_by=cls.user,
+            )
+            for name in ('listed', 'other')
+        ])
+        # bulk_create gives every invoice the same timestamp: pages are split on the id
+        Invoice.objects.bulk_create(
+            Invoice(customer=customer, save_by=cls.user, invoice_type='I', paid=i % 2 == 0)
+            for i in range(7)
+            for customer in (cls.customer, other)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_pages_cover_the_customer_invoices_once(self):
+        url = f'/api/customers/{self.customer.pk}/invoices/'
+        seen, after = [], ''
+        while True:
+            page = self.client.get(url, {'limit': 3, 'after': after}).json()
+            seen += [row['id'] for row in page['results']]
+            if not page['has_more']:
+                break
+            after = page['cursor']
+        expected = list(self.customer.invoices.order_by('-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+        unpaid = self.client.get(url, {'paid': 'false'}).json()['results']
+        self.assertEqual(len(unpaid), 3)
+        self.assertEqual(self.client.get(url, {'after': 'bogus'}).status_code, 400)
+
+
+class StatementTests(TestCase):
+    """Running balances of customer statements"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='statements')
+        self.client.force_login(self.user)
+        self.customer = make_customer(self.user, 'statements@example.com', '6990000004')
+        self.today = timezone.localdate()
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=self.customer, save_by=self.user, invoice_type=invoice_type, total=Decimal(total))
+            for invoice_type, total in (('I', '100.00'), ('P', '999.00'), ('R', '20.00'))
+        )
+        Payment.objects.bulk_create([
+            Payment(invoice=invoices[0], amount=Decimal('30.00'), received_on=self.today),
+            Payment(invoice=invoices[0], amount=Decimal('5.00'), received_on=self.today - datetime.timedelta(days=400)),
+        ])
+
+    def test_entries_carry_the_running_balance(self):
+        statement = Statement(self.customer, self.today - datetime.timedelta(days=30), self.today)
+        self.assertEqual(statement.opening_balance, Decimal('-5.00'))
+        entries = list(statement.entries())
+        # Proforma invoices are left out; invoices come before the payments of the same day
+        self.assertEqual([entry.kind for entry in entries], ['invoice', 'invoice', 'payment'])
+        self.assertEqual([entry.balance for entry in entries], [Decimal('95.00'), Decimal('115.00'), Decimal('85.00')])
+        self.assertEqual(statement.closing_balance, Decimal('85.00'))
+
+    def test_currencies_get_separate_statements(self):
+        invoice = Invoice.objects.create(
+            customer=self.customer, save_by=self.user, invoice_type='I', currency='EUR', total=Decimal('40.00')
+        )
+        Payment.objects.create(invoice=invoice, amount=Decimal('10.00'), currency='EUR', received_on=self.today)
+        start = self.today - datetime.timedelta(days=30)
+        self.assertEqual(statement_currencies(self.customer.pk), ['EUR', 'XAF'])
+        self.assertEqual(Statement(self.customer, start, self.today).closing_balance, Decimal('85.00'))
+        euros = Statement(self.customer, start, self.today, 'EUR')
+        self.assertEqual(euros.opening_balance, Decimal('0.00'))
+        self.assertEqual([entry.balance for entry in euros.entries()], [Decimal('40.00'), Decimal('30.00')])
+
+        response = self.client.get(f'/api/customers/{self.customer.pk}/statement/', {'currency': 'eur'})
+        data = response.json()
+        self.assertEqual((data['currency'], data['currencies'], data['closing_balance']), ('EUR', ['EUR', 'XAF'], '30.00'))
+
+    def test_csv_is_streamed(self):
+        response = self.client.get(f'/api/customers/{self.customer.pk}/statement/', {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(rows[-1].endswith('closing,,,,,85.00'))
+
+
+class CurrencyTests(TestCase):
+    """Conversion of foreign currency invoices to the base currency (XAF)"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx')
+        self.customer = make_customer(self.user, 'fx@example.com', '6990000005')
+        self.today = timezone.localdate()
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=self.customer, save_by=self.user, invoice_type='I', currency=currency, total=Decimal(total))
+            for currency, total in (('XAF', '10.01'), ('EUR', '10.01'), ('USD', '5.00'))
+        )
+        Article.objects.bulk_create(
+            Article(invoice=invoice, name='Item', quantity=1, unit_price=invoice.total) for invoice in invoices
+        )
+        self.eur = invoices[1]
+
+    def store(self, text):
+        return store_rates(read_rate_file(text.splitlines()), 'test')
+
+    def test_sql_conversion_matches_convert(self):
+        week_ago = self.today - datetime.timedelta(days=7)
+        changed = self.store(f"date,currency,rate\n{week_ago},EUR,600\n{week_ago},eur,655.957\n{self.today},EUR,700\n")
+        self.assertEqual(changed, {'EUR': week_ago})
+        Invoice.objects.filter(pk=self.eur.pk).update(invoice_date_time=timezone.now() - datetime.timedelta(days=3))
+        # The snapshot of the invoice day applies, not the latest one
+        total, unconverted = aggregate_converted_total_cents(Invoice.objects.all())
+        self.assertEqual((total, unconverted), (1001 + 656613, 1))
+        self.assertEqual(convert(Decimal('10.01'), 'EUR', self.today - datetime.timedelta(days=3)), Decimal('6566.13'))
+        self.assertIsNone(convert(Decimal('5.00'), 'USD', self.today))
+
+    def test_rate_file_errors_name_the_row(self):
+        with self.assertRaisesMessage(ValueError, 'Row 3'):
+            read_rate_file(['date,currency,rate', '2026-01-01,EUR,655.957', '2026-01-01,EUR,-1'])
+
+    def test_rates_are_read_once_per_request(self):
+        self.store(f"date,currency,rate\n{self.today - datetime.timedelta(days=30)},EUR,650\n{self.today},EUR,655\n")
+        start_rate_cache()
+        try:
+            with self.assertNumQueries(1):
+                rates = [get_rate('EUR', self.today - datetime.timedelta(days=days)) for days in range(60)]
+                self.assertEqual(get_rate('XAF', self.today), 1)
+        finally:
+            end_rate_cache()
+        self.assertEqual((rates[0], rates[1], rates[30], rates[59]), (655, 650, 650, None))
+
+    def test_load_command_refreshes_rollups(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rates.csv')
+            with open(path, 'w') as rates:
+                rates.write(f"date,currency,rate\n{self.today},EUR,655.957\n")
+            call_command('load_fx_rates', path, stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_billed, Decimal('6576.14'))
+        self.assertEqual(self.customer.invoice_count, 3)
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/invoices/{self.eur.pk}/')
+        self.assertEqual(response.json()['total_base'], '6566.13')
+
+
+class RecurringInvoiceTests(TestCase):
+    """Invoices generated from subscription templates"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='recurring')
+        self.customer = make_customer(self.user, 'recurring@example.com', '6990000006')
+        self.recurring = RecurringInvoice.objects.create(
+            customer=self.customer, save_by=self.user, name='Hosting', currency='EUR',
+            adjustment=Decimal('-1.00'), start_date=datetime.date(2026, 1, 31),
+        )
+        RecurringInvoiceLine.objects.create(
+            recurring=self.recurring, name='Plan', quantity=2, unit_price=Decimal('10.00'), tax_rate_bp=1925,
+        )
+
+    def test_month_end_anchor_does_not_drift(self):
+        self.assertEqual(add_months(datetime.date(2026, 1, 31), 1), datetime.date(2026, 2, 28))
+        self.assertEqual(add_months(datetime.date(2026, 1, 31), 2), datetime.date(2026, 3, 31))
+        self.assertEqual(add_months(datetime.date(2026, 11, 30), 3), datetime.date(2027, 2, 28))
+
+    def test_due_periods_are_billed_once(self):
+        day = datetime.date(2026, 4, 15)
+        self.assertEqual(generate_recurring_invoices_task(day.isoformat(), chunk_size=1), 1)
+        invoices = Invoice.objects.filter(recurring=self.recurring).order_by('period_start')
+        self.assertEqual(
+            [invoice.period_start for invoice in invoices],
+            [datetime.date(2026, 1, 31), datetime.date(2026, 2, 28), datetime.date(2026, 3, 31)],
+        )
+        self.assertEqual({invoice.total for invoice in invoices}, {Decimal('22.85')})
+        self.assertEqual({invoice.get_total for invoice in invoices}, {Decimal('22.85')})
+        self.assertEqual({invoice.currency for invoice in invoices}, {'EUR'})
+        self.recurring.refresh_from_db()
+        self.assertEqual((self.recurring.billed_periods, self.recurring.next_date), (3, datetime.date(2026, 4, 30)))
+
+        # Re-running bills nothing, even if the template was moved back
+        self.assertEqual(generate_recurring_invoices([self.recurring.pk], day), 0)
+        RecurringInvoice.objects.filter(pk=self.recurring.pk).update(billed_periods=1, next_date=datetime.date(2026, 2, 28))
+        self.assertEqual(generate_recurring_invoices([self.recurring.pk], day), 0)
+        self.assertEqual(Invoice.objects.filter(recurring=self.recurring).count(), 3)
+
+    def test_template_ends(self):
+        RecurringInvoice.objects.filter(pk=self.recurring.pk).update(end_date=datetime.date(2026, 2, 28))
+        self.assertEqual(generate_recurring_invoices([self.recurring.pk], datetime.date(2026, 12, 31)), 2)
+        self.recurring.refresh_from_db()
+        self.assertFalse(self.recurring.active)
+
+    def test_merging_customers_moves_templates(self):
+        duplicate = make_customer(self.user, 'recurring2@example.com', '6990000016')
+        RecurringInvoice.objects.filter(pk=self.recurring.pk).update(customer=duplicate)
+        with self.assertRaises(ProtectedError):
+            duplicate.delete()
+        merge_customers(self.customer.pk, [duplicate.pk])
+        self.assertFalse(Customer.objects.filter(pk=duplicate.pk).exists())
+        self.recurring.refresh_from_db()
+        self.assertEqual(self.recurring.customer_id, self.customer.pk)
+        self.assertEqual(self.recurring.lines.count(), 1)
+
+
+class DedupeKeyTests(SimpleTestCase):
+    """Normalized keys shared by near-duplicate customers"""
+
+    def test_normalize_email(self):
+        self.assertEqual(normalize_email('  Jean.Dupont@Example.COM '), 'jean.dupont@example.com')
+        self.assertEqual(normalize_email(None), '')
+
+    @override_settings(CUSTOMER_PHONE_COUNTRY_CODE='237')
+    def test_normalize_phone(self):
+        for phone in ('699 00 00 00', '0699-000-000', '+237 699000000', '00237699000000', '237699000000'):
+            self.assertEqual(normalize_phone(phone), '+237699000000', phone)
+        self.assertEqual(normalize_phone('+33 6 12 34 56 78'), '+33612345678')
+        self.assertEqual(normalize_phone('12'), '')
+        self.assertEqual(normalize_phone(''), '')
+        self.assertEqual(normalize_phone('06 12 34 56 78', country_code='33'), '+33612345678')
+
+    def test_fold_name(self):
+        self.assertEqual(fold_name('Élise  Dupont', '75001'), fold_name('DUPONT elise', '75 001'))
+        self.assertEqual(fold_name('Élise Dupont', '75001'), 'dupont elise|75001')
+        self.assertEqual(fold_name('---', '75001'), '')
+
+
+class DedupeTests(TestCase):
+    """Duplicate clusters found through the key indexes, and merged"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='dedupe')
+
+    def add_customer(self, name, email, phone):
+        return make_customer(self.user, email, phone, name=name, sex='M')
+
+    def test_clusters_join_customers_through_any_key(self):
+        a = self.add_customer('Jean', 'jean@example.com', '699000001')
+        b = self.add_customer('Jean D', 'JEAN@example.com ', '699000002')
+        c = self.add_customer('J. Dupont', 'dupont@example.com', '+237 699 000 002')
+        d = self.add_customer('Marie', 'marie@example.com', '699000003')
+        self.assertEqual(find_duplicate_clusters(), [[a.pk, b.pk, c.pk]])
+        self.assertEqual(find_duplicate_clusters(keys=('email',)), [[a.pk, b.pk]])
+        self.assertEqual(find_duplicate_clusters(keys=('name',)), [])
+        self.assertNotIn(d.pk, sum(find_duplicate_clusters(), []))
+
+    def test_merge_moves_invoices_and_rollups_to_the_oldest_customer(self):
+        target = self.add_customer('Jean', 'jean@example.com', '699000001')
+        duplicate = self.add_customer('Jean', 'Jean@Example.com', '699000009')
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(customer=duplicate, save_by=self.user, invoice_type='I')
+            Article.objects.create(invoice=invoice, name='Item', quantity=1, unit_price=Decimal('25.00'))
+        ArchivedInvoice.objects.create(
+            id=invoice.pk + 1000, customer=duplicate, invoice_date_time=timezone.now(), total=Decimal('5.00'),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            merged = merge_duplicate_clusters(find_duplicate_clusters())
+        self.assertEqual(merged, {'clusters': 1, 'customers': 1, 'invoices': 1})
+        self.assertFalse(Customer.objects.filter(pk=duplicate.pk).exists())
+        invoice.refresh_from_db()
+        target.refresh_from_db()
+        self.assertEqual(invoice.customer_id, target.pk)
+        self.assertEqual(ArchivedInvoice.objects.get().customer_id, target.pk)
+        self.assertEqual((target.invoice_count, target.total_billed), (2, Decimal('30.00')))
+        self.assertEqual(
+            list(AuditEntry.objects.filter(object_type='invoice', action=AuditEntry.ACTION_UPDATE)
+                 .values_list('changes', flat=True)),
+            [{'customer_id': [duplicate.pk, target.pk]}],
+        )
+        self.assertEqual(merge_customers(target.pk, [target.pk]), 0)
+
+
+class CachedModelBackendTests(TestCase):
+    """Cached users and permissions, dropped when they change"""
+
+    def setUp(self):
+        cache.clear()
+        self.backend = CachedModelBackend()
+        self.user = User.objects.create(username='cached')
+        self.permission = Permission.objects.get(codename='view_invoice')
+        self.group = Group.objects.create(name='viewers')
+
+    def perms(self):
+        # A fresh instance, like the one each request loads
+        return self.backend.get_all_permissions(self.backend.get_user(self.user.pk))
+
+    def assertDropped(self, change):
+        self.perms()
+        self.assertIsNotNone(cache.get(PERMISSIONS_CACHE_KEY % self.user.pk))
+        change()
+        self.assertIsNone(cache.get(USER_CACHE_KEY % self.user.pk))
+        self.assertIsNone(cache.get(PERMISSIONS_CACHE_KEY % self.user.pk))
+
+    def test_user_and_permissions_are_cached(self):
+        self.perms()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.perms(), set())
+
+    def test_user_changes_drop_the_cache(self):
+        def save():
+            self.user.first_name = 'Changed'
+            self.user.save()
+        self.assertDropped(save)
+        self.assertEqual(self.backend.get_user(self.user.pk).first_name, 'Changed')
+
+        self.assertDropped(self.user.delete)
+        self.assertIsNone(self.backend.get_user(self.user.pk))
+
+    def test_permission_changes_drop_the_cache(self):
+        self.assertDropped(lambda: self.user.user_permissions.add(self.permission))
+        self.assertEqual(self.perms(), {'fact_app.view_invoice'})
+        self.assertDropped(lambda: self.user.user_permissions.remove(self.permission))
+        self.assertEqual(self.perms(), set())
+
+    def test_group_changes_drop_the_cache(self):
+        self.group.permissions.add(self.permission)
+        self.assertDropped(lambda: self.user.groups.add(self.group))
+        self.assertEqual(self.perms(), {'fact_app.view_invoice'})
+        self.assertDropped(lambda: self.group.permissions.clear())
+        self.assertEqual(self.perms(), set())
+        self.assertDropped(lambda: self.group.permissions.add(self.permission))
+        self.assertEqual(self.perms(), {'fact_app.view_invoice'})
+        self.assertDropped(self.group.user_set.clear)
+        self.assertEqual(self.perms(), set())
+        self.assertDropped(lambda: self.group.user_set.add(self.user))
+        self.assertEqual(self.perms(), {'fact_app.view_invoice'})
+
+    def test_sessions_opened_with_model_backend_still_authenticate(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get('/api/invoices/').status_code, 200)
+
+
+class CustomerRollupTests(TestCase):
+    """Invoice totals and customer rollups, recomputed after commit"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='rollups')
+        self.first, self.second = (
+            make_customer(self.user, f'{name}@example.com', phone, name=name)
+            for name, phone in (('first', '6990000014'), ('second', '6990000015'))
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(customer=self.first, save_by=self.user, invoice_type='I')
+            self.article = Article.objects.create(
+                invoice=self.invoice, name='Line', quantity=2, unit_price=Decimal('10.00')
+            )
+
+    def rollups(self, customer):
+        customer.refresh_from_db()
+        return (customer.invoice_count, customer.paid_invoice_count, customer.total_billed, customer.total_outstanding)
+
+    def test_article_edits(self):
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total, Decimal('20.00'))
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('20.00'), Decimal('20.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.quantity = 3
+            self.article.save()
+            Article.objects.create(invoice=self.invoice, name='Extra', quantity=1, unit_price=Decimal('5.00'))
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('35.00'), Decimal('35.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.delete()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total, Decimal('5.00'))
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('5.00'), Decimal('5.00')))
+
+    def test_invoice_edits_and_customer_move(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.adjustment = Decimal('-5.00')
+            self.invoice.save(update_fields=['adjustment'])
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('15.00'), Decimal('15.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.paid = True
+            self.invoice.save(update_fields=['paid'])
+        self.assertEqual(self.rollups(self.first), (1, 1, Decimal('15.00'), Decimal('0.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.customer = self.second
+            self.invoice.save()
+        self.assertEqual(self.rollups(self.first), (0, 0, Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(self.rollups(self.second), (1, 1, Decimal('15.00'), Decimal('0.00')))
+        self.assertIsNone(self.first.last_invoice_date)
+        self.assertEqual(self.second.last_invoice_date, self.invoice.invoice_date_time)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.delete()
+        self.assertEqual(self.rollups(self.second), (0, 0, Decimal('0.00'), Decimal('0.00')))
+
+    def test_rolled_back_changes_leave_rollups_alone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Article.objects.create(invoice=self.invoice, name='Lost', quantity=1, unit_price=Decimal('99.00'))
+                Invoice.objects.create(customer=self.first, save_by=self.user, invoice_type='I')
+                raise RuntimeError
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('20.00'), Decimal('20.00')))
+
+        # The ids left behind by the rollback are recomputed, harmlessly, with the next change
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.create(invoice=self.invoice, name='Kept', quantity=1, unit_price=Decimal('1.00'))
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('21.00'), Decimal('21.00')))
+
+    def test_edits_cost_the_same_whatever_the_customer_size(self):
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=self.second, save_by=self.user, invoice_type='I') for _ in range(40)
+        )
+        Article.objects.bulk_create(
+            Article(invoice=invoice, name='Line', quantity=1, unit_price=Decimal('1.00')) for invoice in invoices
+        )
+        rebuild_customer_rollups()
+        small = invoices[0].articles.get()
+        counts = []
+        for article in (self.article, small):
+            article.quantity += 1
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                article.save()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.rollups(self.second), (40, 0, Decimal('41.00'), Decimal('41.00')))
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+    def test_rollup_changes_reach_the_change_feed(self):
+        self.first.refresh_from_db()
+        before = self.first.updated_date
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.paid = True
+            self.invoice.save(update_fields=['paid'])
+        self.first.refresh_from_db()
+        self.assertGreater(self.first.updated_date, before)
+        changes = get_changes(encode_cursor({'customers': (before, self.first.pk)}))
+        self.assertEqual([customer.pk for customer in changes['customers']], [self.first.pk])
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Invoice.objects.create(customer=self.second, save_by=self.user, invoice_type='I', currency='EUR')
+            Article.objects.create(invoice=other, name='Line', quantity=1, unit_price=Decimal('3.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.customer = self.first
+            other.paid = True
+            other.save()
+            self.invoice.adjustment = Decimal('2.50')
+            self.invoice.save(update_fields=['adjustment'])
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        incremental = [self.rollups(self.first), self.rollups(self.second)]
+        rebuild_customer_rollups()
+        self.assertEqual([self.rollups(self.first), self.rollups(self.second)], incremental)
+        self.assertEqual(incremental[0], (1, 0, Decimal('22.50'), Decimal('22.50')))
+
+    def test_rebuild_repairs_drifted_rollups(self):
+        Invoice.objects.filter(pk=self.invoice.pk).update(total=Decimal('1.00'))
+        Customer.objects.filter(pk=self.first.pk).update(invoice_count=7, total_billed=Decimal('1.00'))
+        self.assertEqual(rebuild_customer_rollups(batch_size=1), {'invoices': 1, 'customers': 2})
+        self.assertEqual(self.rollups(self.first), (1, 0, Decimal('20.00'), Decimal('20.00')))
+
+
+class RevenueRollupTests(TestCase):
+    """DailyRevenue buckets, refreshed after commit and rebuilt from scratch"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='revenue')
+        self.customer = make_customer(self.user, 'revenue@example.com', '6990000010')
+        self.day = datetime.date(2026, 3, 10)
+        self.moment = timezone.make_aware(datetime.datetime(2026, 3, 10, 12))
+
+    def add_invoice(self, total, paid=False, invoice_type='I'):
+        invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type=invoice_type, paid=paid)
+        Article.objects.create(invoice=invoice, name='Line', quantity=1, unit_price=Decimal(total))
+        Invoice.objects.filter(pk=invoice.pk).update(invoice_date_time=self.moment, total=Decimal(total))
+        invoice.invoice_date_time = self.moment
+        return invoice
+
+    def buckets(self):
+        return {
+            (row.invoice_type, row.paid): (row.invoice_count, row.total)
+            for row in DailyRevenue.objects.filter(day=self.day)
+        }
+
+    def test_refresh_upserts_and_drops_emptied_buckets(self):
+        invoice = self.add_invoice('100.00')
+        self.add_invoice('50.00', invoice_type='R', paid=True)
+        refresh_revenue_range(self.day, self.day + datetime.timedelta(days=1))
+        self.assertEqual(self.buckets(), {('I', False): (1, Decimal('100.00')), ('R', True): (1, Decimal('50.00'))})
+        kept = DailyRevenue.objects.get(day=self.day, invoice_type='R').pk
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.paid = True
+            invoice.save(update_fields=['paid'])
+        self.assertEqual(self.buckets(), {('I', True): (1, Decimal('100.00')), ('R', True): (1, Decimal('50.00'))})
+        # Unchanged buckets are updated in place, not deleted and re-inserted
+        self.assertTrue(DailyRevenue.objects.filter(pk=kept).exists())
+
+        Invoice.objects.all().delete()
+        refresh_revenue_range(self.day, self.day + datetime.timedelta(days=1))
+        self.assertEqual(self.buckets(), {})
+
+    def test_rebuild_includes_archived_invoices(self):
+        self.add_invoice('100.00')
+        ArchivedInvoice.objects.create(
+            id=999, customer=self.customer, save_by=self.user, invoice_date_time=self.moment,
+            total=Decimal('30.00'), invoice_type='I',
+        )
+        DailyRevenue.objects.create(day=self.day, invoice_type='P', paid=False, invoice_count=9, total=Decimal('9.00'))
+        self.assertEqual(rebuild_revenue(), 2)
+        self.assertEqual(self.buckets(), {('I', False): (1, Decimal('100.00')), ('I', True): (1, Decimal('30.00'))})
+        series = revenue_series(self.day, self.day, 'month')
+        self.assertEqual([(row['total'], row['paid_total']) for row in series], [(Decimal('130.00'), Decimal('30.00'))])
+
+
+class ArchiveTests(TestCase):
+    """Old paid invoices moved to the archive, still read and counted"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='archive')
+        self.customer = make_customer(self.user, 'archive@example.com', '6990000011', sex='M')
+        old = timezone.now() - datetime.timedelta(days=800)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.old = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I', paid=True)
+            Article.objects.create(invoice=self.old, name='Old', quantity=2, unit_price=Decimal('40.00'))
+            self.recent = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+            Article.objects.create(invoice=self.recent, name='New', quantity=1, unit_price=Decimal('15.00'))
+        Invoice.objects.filter(pk=self.old.pk).update(invoice_date_time=old)
+
+    def test_archived_invoice_is_read_through_and_still_counted(self):
+        statistics = get_invoice_statistics()
+        summary = get_customer_summary(self.customer.pk)
+        self.assertEqual(statistics['total_amount'], Decimal('95.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_paid_invoices(), 1)
+
+        self.assertFalse(Invoice.objects.filter(pk=self.old.pk).exists())
+        archived = get_invoice_or_archived(self.old.pk)
+        self.assertTrue(archived.is_archived)
+        self.assertEqual(archived.total, Decimal('80.00'))
+        self.assertEqual(list(ArchivedArticle.objects.filter(invoice=archived).values_list('name', flat=True)), ['Old'])
+        self.assertFalse(get_invoice_or_archived(self.recent.pk).is_archived)
+
+        self.customer.refresh_from_db()
+        self.assertEqual(
+            (self.customer.invoice_count, self.customer.paid_invoice_count, self.customer.total_billed),
+            (2, 1, Decimal('95.00')),
+        )
+        self.assertEqual(self.customer.get_total_invoices(), Decimal('95.00'))
+        self.assertEqual(get_invoice_statistics(), statistics)
+        after = get_customer_summary(self.customer.pk)
+        self.assertEqual(
+            {key: after[key] for key in ('total_invoices', 'paid_invoices', 'total_amount', 'unconverted_invoices')},
+            {key: summary[key] for key in ('total_invoices', 'paid_invoices', 'total_amount', 'unconverted_invoices')},
+        )
+
+    def test_conflicting_archived_row_aborts_the_batch(self):
+        ArchivedInvoice.objects.create(
+            id=self.old.pk, customer=self.customer, invoice_date_time=self.old.invoice_date_time, total=Decimal('1.00'),
+        )
+        with self.assertRaises(IntegrityError):
+            archive_invoice_batch([self.old.pk])
+        self.assertTrue(Invoice.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(ArchivedInvoice.objects.get(pk=self.old.pk).total, Decimal('1.00'))
+
+
+@override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+class ChangeFeedTests(TestCase):
+    """Incremental sync: cursors, late commits and tombstone pruning"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='feed', is_superuser=True)
+        self.customer = make_customer(self.user, 'feed@example.com', '6990000012')
+        self.invoices = [
+            Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I') for _ in range(3)
+        ]
+
+    def test_cursor_serves_each_change_once(self):
+        first = get_changes(limit=2)
+        self.assertTrue(first['has_more'])
+        self.assertEqual(first['invoices'], self.invoices[:2])
+        second = get_changes(first['cursor'], limit=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual(second['invoices'], self.invoices[2:])
+        self.assertEqual(second['customers'], [])
+
+        self.invoices[0].comments = 'Changed'
+        self.invoices[0].save()
+        deleted_id = self.invoices[1].pk
+        self.invoices[1].delete()
+        third = get_changes(second['cursor'])
+        self.assertEqual(third['invoices'], [self.invoices[0]])
+        self.assertEqual([(t.object_type, t.object_id) for t in third['deleted']], [('invoice', deleted_id)])
+        self.assertEqual(get_changes(third['cursor'])['invoices'], [])
+
+    def test_rows_of_a_late_commit_are_restamped(self):
+        ids = [invoice.pk for invoice in self.invoices]
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk_update_invoices(self.user, ids, comments='Bulk')
+        stamped = Invoice.objects.get(pk=ids[0]).last_updated_date
+        # A reader got past the rows before their transaction committed
+        cursor = get_changes()['cursor']
+
+        late = stamped + datetime.timedelta(seconds=30)
+        with mock.patch('django.utils.timezone.now', return_value=late):
+            for callback in callbacks:
+                callback()
+            self.assertEqual(set(Invoice.objects.values_list('last_updated_date', flat=True)), {late})
+            self.assertEqual([invoice.pk for invoice in get_changes(cursor)['invoices']], ids)
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=2)
+    def test_quick_commit_keeps_its_stamps(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_invoices(self.user, [self.invoices[0].pk], comments='Bulk')
+            stamped = Invoice.objects.get(pk=self.invoices[0].pk).last_updated_date
+        self.assertEqual(Invoice.objects.get(pk=self.invoices[0].pk).last_updated_date, stamped)
+
+    @override_settings(TOMBSTONE_RETENTION_DAYS=30)
+    def test_old_tombstones_are_pruned_and_old_cursors_refused(self):
+        old = timezone.now() - datetime.timedelta(days=31)
+        Tombstone.objects.create(object_type='invoice', object_id=1, deleted_at=old)
+        recent = Tombstone.objects.create(object_type='invoice', object_id=2)
+        self.assertEqual(prune_tombstones(batch_size=1), 1)
+        self.assertEqual(list(Tombstone.objects.all()), [recent])
+
+        with self.assertRaisesMessage(ValueError, 'Cursor expired'):
+            get_changes(encode_cursor({'deleted': (old, 1)}, old))
+        # Cursors written without their read time are still accepted
+        self.assertEqual(get_changes(encode_cursor({'deleted': (old, 1)}))['deleted'], [recent])
+        self.client.force_login(self.user)
+        response = self.client.get('/api/changes/', {'since': encode_cursor({}, old)})
+        self.assertEqual(response.status_code, 400)
+
+
+class DisconnectedEmailBackend(BaseEmailBackend):
+    """Email backend whose server always drops the connection"""
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+class DeliveryTests(TestCase):
+    """Invoice emails, sent through the locmem backend"""
+
+    def setUp(self):
+        self.pdf_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.pdf_dir.cleanup)
+        settings = override_settings(INVOICE_PDF_CACHE_DIR=self.pdf_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create(username='delivery')
+        self.client.force_login(self.user)
+        customer = make_customer(self.user, 'client@example.com', '6990000007')
+        silent = make_customer(self.user, '', '6990000008', name='Silent', sex='M')
+        self.invoices = [
+            Invoice.objects.create(customer=customer, save_by=self.user, invoice_type='I', currency='EUR')
+            for _ in range(3)
+        ]
+        self.no_email = Invoice.objects.create(customer=silent, save_by=self.user, invoice_type='I')
+        for invoice in self.invoices:
+            # wkhtmltopdf is not needed: attachments come from the PDF cache
+            store_invoice_pdf(Invoice.objects.select_related('customer').get(pk=invoice.pk), b'%PDF-1.4 cached')
+
+    def test_bulk_send_reuses_one_connection(self):
+        ids = [invoice.pk for invoice in self.invoices] + [self.no_email.pk, 999999]
+        with mock.patch.object(delivery, 'get_connection', wraps=delivery.get_connection) as get_connection:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/invoices/bulk/send/', {'ids': ids}, content_type='application/json')
+        self.assertEqual(response.json()['counts'], {'queued': 3, 'no_email': 1, 'not_found': 1})
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, ['client@example.com'])
+        self.assertEqual(message.attachments[0][1], b'%PDF-1.4 cached')
+        self.assertIn('€', message.body)
+        statuses = InvoiceDelivery.objects.values_list('status', flat=True)
+        self.assertEqual(list(statuses), [InvoiceDelivery.STATUS_SENT] * 3)
+
+        response = self.client.get(f'/api/invoices/{self.invoices[0].pk}/deliveries/')
+        self.assertEqual(response.json()['results'][0]['status'], 'sent')
+
+    def test_pending_delivery_is_not_queued_twice(self):
+        queued = delivery.queue_invoice_deliveries(Invoice.objects.filter(pk=self.invoices[0].pk))
+        again = delivery.queue_invoice_deliveries(Invoice.objects.filter(pk=self.invoices[0].pk))
+        self.assertEqual((queued, again), ({self.invoices[0].pk: 'queued'}, {self.invoices[0].pk: 'already_queued'}))
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(EMAIL_BACKEND='fact_app.tests.DisconnectedEmailBackend')
+    def test_failures_are_retried_then_marked_failed(self):
+        delivery.queue_invoice_deliveries(Invoice.objects.filter(pk__in=[invoice.pk for invoice in self.invoices]))
+        delivery_ids = list(InvoiceDelivery.objects.values_list('id', flat=True))
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            send_deliveries(delivery_ids)
+        # The connection dropped: the rest of the batch waits for the retry
+        self.assertEqual(
+            sorted(InvoiceDelivery.objects.values_list('attempts', flat=True)), [0, 0, 1]
+        )
+        for _ in range(DELIVERY_MAX_ATTEMPTS * len(delivery_ids)):
+            try:
+                send_deliveries(delivery_ids)
+            except smtplib.SMTPServerDisconnected:
+                continue
+            break
+        self.assertEqual(
+            set(InvoiceDelivery.objects.values_list('status', 'attempts')),
+            {(InvoiceDelivery.STATUS_FAILED, DELIVERY_MAX_ATTEMPTS)},
+        )
+
+    def test_each_result_is_recorded_as_it_is_known(self):
+        delivery.queue_invoice_deliveries(Invoice.objects.filter(pk__in=[invoice.pk for invoice in self.invoices]))
+        delivery_ids = list(InvoiceDelivery.objects.order_by('id').values_list('id', flat=True))
+        build = delivery.build_invoice_message
+        calls = []
+
+        def crash_on_second(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker lost")
+            return build(*args, **kwargs)
+
+        with mock.patch.object(delivery, 'build_invoice_message', side_effect=crash_on_second):
+            with self.assertRaises(RuntimeError):
+                send_deliveries(delivery_ids)
+        self.assertEqual(
+            list(InvoiceDelivery.objects.order_by('id').values_list('status', flat=True)),
+            [InvoiceDelivery.STATUS_SENT, InvoiceDelivery.STATUS_PENDING, InvoiceDelivery.STATUS_PENDING],
+        )
+        # The retry only sends what was not recorded as sent
+        self.assertEqual(send_deliveries(delivery_ids), {'sent': 2, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_stale_claims_are_sent_again(self):
+        delivery.queue_invoice_deliveries(Invoice.objects.filter(pk__in=[invoice.pk for invoice in self.invoices[:2]]))
+        stale, fresh = InvoiceDelivery.objects.order_by('id')
+        InvoiceDelivery.objects.filter(pk=stale.pk).update(
+            status=InvoiceDelivery.STATUS_SENDING, claimed_at=timezone.now() - delivery.DELIVERY_CLAIM_TIMEOUT * 2,
+        )
+        InvoiceDelivery.objects.filter(pk=fresh.pk).update(
+            status=InvoiceDelivery.STATUS_SENDING, claimed_at=timezone.now(),
+        )
+        # Being sent: not queued again
+        self.assertEqual(
+            delivery.queue_invoice_deliveries(Invoice.objects.filter(pk=self.invoices[1].pk)),
+            {self.invoices[1].pk: 'already_queued'},
+        )
+        with mock.patch.object(delivery, '_dispatch') as dispatch:
+            self.assertEqual(delivery.queue_stale_deliveries(), 1)
+        dispatch.assert_called_once_with([stale.pk])
+        self.assertEqual(send_deliveries([stale.pk, fresh.pk]), {'sent': 1, 'failed': 0})
+        self.assertEqual(InvoiceDelivery.objects.get(pk=fresh.pk).status, InvoiceDelivery.STATUS_SENDING)
+
+    @override_settings(EMAIL_BACKEND='fact_app.tests.DisconnectedEmailBackend')
+    def test_pending_deliveries_are_requeued_once_retries_run_out(self):
+        delivery.queue_invoice_deliveries(Invoice.objects.filter(pk__in=[invoice.pk for invoice in self.invoices]))
+        delivery_ids = list(InvoiceDelivery.objects.order_by('id').values_list('id', flat=True))
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            send_deliveries(delivery_ids)
+        # Still within the retry window (and just queued): left to the Celery retries
+        with mock.patch.object(delivery, '_dispatch') as dispatch:
+            self.assertEqual(delivery.queue_stale_deliveries(), 0)
+
+        # The retries ran out while the mail server was down: nothing was attempted for a while
+        long_ago = timezone.now() - delivery.DELIVERY_CLAIM_TIMEOUT * 2
+        InvoiceDelivery.objects.filter(pk__in=delivery_ids[:2]).update(claimed_at=long_ago)
+        # Never attempted (its task was lost) since it was queued
+        InvoiceDelivery.objects.filter(pk=delivery_ids[2]).update(claimed_at=None, created_at=long_ago)
+        self.assertEqual(
+            delivery.queue_invoice_deliveries(Invoice.objects.filter(pk=self.invoices[0].pk)),
+            {self.invoices[0].pk: 'already_queued'},
+        )
+        with mock.patch.object(delivery, '_dispatch') as dispatch:
+            self.assertEqual(delivery.queue_stale_deliveries(), 3)
+        dispatch.assert_called_once_with(delivery_ids)
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            self.assertEqual(send_deliveries(delivery_ids), {'sent': 3, 'failed': 0})
+        self.assertEqual(
+            delivery.queue_invoice_deliveries(Invoice.objects.filter(pk=self.invoices[0].pk)),
+            {self.invoices[0].pk: 'queued'},
+        )
+
+    def test_archived_invoices_keep_their_deliveries(self):
+        delivery.queue_invoice_deliveries(Invoice.objects.filter(pk__in=[invoice.pk for invoice in self.invoices[:2]]))
+        send_deliveries(InvoiceDelivery.objects.values_list('id', flat=True))
+        archived, deleted = self.invoices[:2]
+        Invoice.objects.filter(pk=archived.pk).update(
+            paid=True, invoice_date_time=timezone.now() - datetime.timedelta(days=800)
+        )
+        self.assertEqual(archive_paid_invoices(), 1)
+        deleted.delete()
+        self.assertEqual(list(InvoiceDelivery.objects.values_list('invoice_id', 'status')),
+                         [(archived.pk, InvoiceDelivery.STATUS_SENT)])
+
+
+class InvoiceEventTests(TestCase):
+    """Invoice events, merged per transaction, and the long-poll endpoint"""
+
+    def setUp(self):
+        self.bus = LocalEventBus()
+        patcher = mock.patch('fact_app.events._bus', self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='events', is_superuser=True)
+        self.client.force_login(self.user)
+        self.customer = make_customer(self.user, 'events@example.com', '6990000013', sex='M')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+
+    def events(self, after):
+        return self.bus.read(after, 0)[0]
+
+    def test_one_event_per_invoice_and_transaction(self):
+        start = self.bus.last_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+            for position in range(3):
+                Article.objects.create(invoice=invoice, name=f'Line {position}', quantity=1, unit_price=Decimal('1.00'))
+            for position in range(3):
+                Article.objects.create(
+                    invoice=self.invoice, name=f'Line {position}', quantity=1, unit_price=Decimal('1.00')
+                )
+        self.assertEqual(
+            [(event['type'], event['invoice_ids'], event.get('changes')) for event in self.events(start)],
+            [('invoice.created', [invoice.pk], None), ('invoice.updated', [self.invoice.pk], None)],
+        )
+
+        start = self.bus.last_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_invoices(self.user, [self.invoice.pk, invoice.pk], paid=True)
+            self.invoice.comments = 'Late'
+            self.invoice.save(update_fields=['comments'])
+        self.assertEqual(
+            [(event['invoice_ids'], event['changes']) for event in self.events(start)],
+            [([self.invoice.pk], {'comments': 'Late', 'paid': True}), ([invoice.pk], {'paid': True})],
+        )
+
+        start = self.bus.last_id()
+        deleted_id = invoice.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.filter(invoice=invoice).first().save()
+            invoice.delete()
+        self.assertEqual([(event['type'], event['invoice_ids']) for event in self.events(start)],
+                         [('invoice.deleted', [deleted_id])])
+
+    def test_rolled_back_changes_publish_nothing(self):
+        start = self.bus.last_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+                raise RuntimeError
+            self.invoice.save()
+        self.assertEqual([(event['type'], event['invoice_ids']) for event in self.events(start)],
+                         [('invoice.updated', [self.invoice.pk])])
+
+    def test_long_poll(self):
+        response = self.client.get('/api/invoices/events/', {'timeout': 0})
+        self.assertEqual(response.json(), {'events': [], 'cursor': self.bus.last_id(), 'reset': False})
+        cursor = response.json()['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_invoices(self.user, [self.invoice.pk], paid=True)
+        data = self.client.get('/api/invoices/events/', {'after': cursor, 'timeout': 0}).json()
+        self.assertEqual([(event['type'], event['changes']) for event in data['events']],
+                         [('invoice.updated', {'paid': True})])
+        self.assertEqual(data['cursor'], self.bus.last_id())
+        self.assertFalse(data['reset'])
+
+        # A cursor from before a restart of the process: the client reloads
+        data = self.client.get('/api/invoices/events/', {'after': '999', 'timeout': 0}).json()
+        self.assertTrue(data['reset'])
+        response = self.client.get('/api/invoices/events/', {'after': 'abc', 'timeout': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/invoices/events/', {'timeout': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+
+    @override_settings(INVOICE_EVENTS_MAX_WAITERS=1)
+    def test_polls_beyond_the_waiter_cap_do_not_wait(self):
+        with event_waiter() as waiting:
+            self.assertTrue(waiting)
+            with mock.patch.object(self.bus, 'read', wraps=self.bus.read) as read:
+                response = self.client.get('/api/invoices/events/', {'timeout': 30})
+        read.assert_called_once_with(self.bus.last_id(), 0)
+        self.assertEqual(response.json()['retry_after'], EVENTS_RETRY_AFTER)
+        self.assertEqual(response['Retry-After'], str(EVENTS_RETRY_AFTER))
+        # The slot is free again
+        response = self.client.get('/api/invoices/events/', {'timeout': 0})
+        self.assertNotIn('retry_after', response.json())
+
+class AuditTests(TestCase):
+    """Audit trail: field diffs, one INSERT per request, query API"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='auditor', is_superuser=True)
+        self.customer = make_customer(self.user, 'audit@example.com', '6990000009')
+        self.invoice = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I')
+        self.article = Article.objects.create(invoice=self.invoice, name='Item', quantity=1, unit_price=Decimal('10.00'))
+
+    def audit_inserts(self, queries):
+        table = AuditEntry._meta.db_table
+        return [query for query in queries if query['sql'].startswith(f'INSERT INTO "{table}"')]
+
+    def test_changes_are_buffered_into_one_insert(self):
+        article_id = self.article.pk
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                with audit_context(self.user):
+                    self.customer.city = 'Yaoundé'
+                    self.customer.save()
+                    self.invoice.paid = True
+                    self.invoice.save(update_fields=['paid'])
+                    self.article.unit_price = '12.5'
+                    self.article.save()
+                    Article.objects.create(invoice=self.invoice, name='Extra', quantity=2, unit_price=Decimal('1.00'))
+                    self.article.delete()
+        self.assertEqual(len(self.audit_inserts(queries.captured_queries)), 1)
+
+        entries = {
+            (entry.object_type, entry.action, entry.object_id): entry.changes
+            for entry in AuditEntry.objects.filter(user=self.user)
+        }
+        self.assertEqual(entries[('customer', 'update', self.customer.pk)], {'city': ['Douala', 'Yaoundé']})
+        self.assertEqual(entries[('invoice', 'update', self.invoice.pk)], {'paid': [False, True]})
+        self.assertEqual(entries[('article', 'update', article_id)], {'unit_price': ['10.00', '12.50']})
+        self.assertEqual(entries[('article', 'delete', article_id)]['name'], ['Item', None])
+        self.assertEqual(len(entries), 5)
+
+    def test_rolled_back_changes_are_not_audited(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with audit_context(self.user):
+                try:
+                    with transaction.atomic():
+                        self.invoice.comments = 'Rolled back'
+                        self.invoice.save()
+                        raise ValueError
+                except ValueError:
+                    pass
+                self.customer.save()
+        self.assertFalse(AuditEntry.objects.filter(object_type__in=['invoice', 'customer'], action='update').exists())
+
+    def test_failed_audit_write_fails_the_request(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(AuditEntry.objects, 'bulk_create', side_effect=DatabaseError('audit down')):
+            with self.assertRaises(DatabaseError):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(
+                        '/api/invoices/bulk/comment/', {'ids': [self.invoice.pk], 'comments': 'Late'},
+                        content_type='application/json',
+                    )
+
+    def test_bulk_update_and_query_api(self):
+        other = Invoice.objects.create(customer=self.customer, save_by=self.user, invoice_type='I', paid=True)
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/invoices/bulk/status/', {'ids': [self.invoice.pk, other.pk], 'paid': True},
+                content_type='application/json',
+            )
+        self.assertEqual(response.json()['counts'], {'updated': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/invoices/bulk/comment/', {'ids': [self.invoice.pk], 'comments': 'Late'},
+                content_type='application/json',
+            )
+        # The invoice already paid has nothing to record
+        self.assertEqual(audit_entries(object_type='invoice', object_id=other.pk)['entries'], [])
+
+        response = self.client.get('/api/audit/', {'object': f'invoice:{self.invoice.pk}', 'limit': 1})
+        data = response.json()
+        self.assertEqual(data['results'][0]['changes'], {'comments': [None, 'Late']})
+        self.assertTrue(data['has_more'])
+        response = self.client.get('/api/audit/', {'object': f'invoice:{self.invoice.pk}', 'after': data['cursor']})
+        data = response.json()
+        self.assertEqual([row['changes'] for row in data['results']], [{'paid': [False, True]}])
+        self.assertFalse(data['has_more'])
+
+        self.assertEqual(self.client.get('/api/audit/', {'object': 'payment'}).status_code, 400)
+        plain = User.objects.create(username='clerk')
+        self.client.force_login(plain)
+        self.assertEqual(self.client.get('/api/audit/').json()['results'], [])
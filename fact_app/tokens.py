@@ -0,0 +1,42 @@
+"""
+API tokens
+Clients without a browser session (scripts, integrations) authenticate with
+"Authorization: Token <key>". The key is only shown when created: the
+database keeps its SHA-256, so a leaked table gives no usable key.
+"""
+import hashlib
+import secrets
+
+from .models import ApiToken
+
+TOKEN_KEYWORD = 'Token'
+
+
+def _hash(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def create_api_token(user, name):
+    """
+    Create a token for a user
+
+    Returns:
+        Tuple (token, key); the key cannot be read back later
+    """
+    key = secrets.token_urlsafe(32)
+    return ApiToken.objects.create(user=user, name=name, key_hash=_hash(key)), key
+
+
+def get_token_user(header):
+    """
+    The active user of an Authorization header value ("Token <key>"),
+    or None when the header or the key is not valid
+    """
+    keyword, _, key = header.partition(' ')
+    key = key.strip()
+    if keyword != TOKEN_KEYWORD or not key:
+        return None
+    token = ApiToken.objects.select_related('user').filter(key_hash=_hash(key)).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
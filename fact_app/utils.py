@@ -3,7 +3,16 @@ Utility functions for invoice and customer management
 """
 import logging
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from .models import Invoice, Customer
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+from .models import ArchivedInvoice, Invoice, Customer
+from .audit import record_queryset_update
+from .changes import stamp_on_commit
+from .events import INVOICE_DELETED, INVOICE_UPDATED, invoice_events_suppressed, publish_invoice_event
+from .fx import aggregate_converted_archived_cents, aggregate_converted_total_cents
+from .money import from_cents, get_base_currency
+from .rollups import mark_invoice_rows_dirty
 
 logger = logging.getLogger(__name__)
 
@@ -45,31 +54,39 @@ def get_invoice(pk):
         Dictionary containing invoice and articles
     
     Raises:
-        Invoice.DoesNotExist: If invoice not found
+        Http404: If invoice not found (neither live nor archived)
     """
     try:
-        invoice = Invoice.objects.select_related(
-            'customer',
-            'save_by'
-        ).prefetch_related('articles').get(pk=pk)
+        from .archive import get_invoice_or_archived
+        from .lines import get_invoice_lines, use_compact_articles
+
+        queryset = Invoice.objects.select_related('customer', 'save_by')
+        if not use_compact_articles():
+            queryset = queryset.prefetch_related('articles')
+        invoice = get_invoice_or_archived(pk, queryset)
+        articles, pricing = get_invoice_lines(invoice)
+        amounts = pricing.amounts()
         
         context = {
             'obj': invoice,
-            'articles': invoice.articles.all(),
-            'total': invoice.get_total,
+            'articles': articles,
+            'total': amounts['total'],
+            'pricing': amounts,
         }
         
-        logger.debug(f"Retrieved invoice {pk} with {invoice.articles.count()} articles")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Retrieved invoice %s with %d articles", pk, len(articles))
         return context
         
-    except Invoice.DoesNotExist:
-        logger.warning(f"Invoice {pk} not found")
+    except Http404:
+        logger.warning("Invoice %s not found", pk)
         raise
 
 
 def get_customer_summary(customer_id):
     """
     Get comprehensive summary for a customer including invoice statistics.
+    Archived invoices are counted (as paid), like Customer.get_total_invoices().
     
     Args:
         customer_id: Customer primary key
@@ -80,48 +97,61 @@ def get_customer_summary(customer_id):
     try:
         customer = Customer.objects.select_related('save_by').get(pk=customer_id)
         invoices = customer.invoices.all()
+        archived = customer.archived_invoices.all()
         
-        total_invoices = invoices.count()
-        paid_invoices = invoices.filter(paid=True).count()
-        total_amount = sum(inv.get_total for inv in invoices)
+        archived_count = archived.count()
+        total_invoices = invoices.count() + archived_count
+        paid_invoices = invoices.filter(paid=True).count() + archived_count
+        total_cents, unconverted = aggregate_converted_total_cents(invoices)
+        archived_cents, archived_unconverted = aggregate_converted_archived_cents(archived)
         
         context = {
             'customer': customer,
             'total_invoices': total_invoices,
             'paid_invoices': paid_invoices,
             'unpaid_invoices': total_invoices - paid_invoices,
-            'total_amount': total_amount,
+            'total_amount': from_cents(total_cents + archived_cents),
+            'currency': get_base_currency(),
+            'unconverted_invoices': unconverted + archived_unconverted,
         }
         
         return context
         
     except Customer.DoesNotExist:
-        logger.warning(f"Customer {customer_id} not found")
+        logger.warning("Customer %s not found", customer_id)
         raise
 
 
 def get_invoice_statistics(start_date=None, end_date=None):
     """
-    Get invoice statistics for a date range.
+    Get invoice statistics for a date range, archived invoices included (as paid).
     
     Args:
         start_date: Start date for filtering (optional)
         end_date: End date for filtering (optional)
     
     Returns:
-        Dictionary with invoice statistics
+        Dictionary with invoice statistics, amounts in the base currency
+        (unconverted_invoices counts those left out for lack of an exchange rate)
     """
     queryset = Invoice.objects.all()
+    archived = ArchivedInvoice.objects.all()
     
     if start_date:
         queryset = queryset.filter(invoice_date_time__gte=start_date)
+        archived = archived.filter(invoice_date_time__gte=start_date)
     
     if end_date:
         queryset = queryset.filter(invoice_date_time__lte=end_date)
+        archived = archived.filter(invoice_date_time__lte=end_date)
     
-    total_invoices = queryset.count()
-    paid_invoices = queryset.filter(paid=True).count()
-    total_amount = sum(inv.get_total for inv in queryset)
+    archived_count = archived.count()
+    total_invoices = queryset.count() + archived_count
+    paid_invoices = total_invoices - queryset.filter(paid=False).count()
+    total_cents, unconverted = aggregate_converted_total_cents(queryset)
+    archived_cents, archived_unconverted = aggregate_converted_archived_cents(archived)
+    total_amount = from_cents(total_cents + archived_cents)
+    unconverted += archived_unconverted
     
     return {
         'total_invoices': total_invoices,
@@ -129,4 +159,107 @@ def get_invoice_statistics(start_date=None, end_date=None):
         'unpaid_invoices': total_invoices - paid_invoices,
         'total_amount': total_amount,
         'average_invoice': total_amount / total_invoices if total_invoices > 0 else 0,
-    }
\ No newline at end of file
+        'currency': get_base_currency(),
+        'unconverted_invoices': unconverted,
+    }
+
+
+# Maximum number of invoice IDs accepted by one bulk request
+BULK_MAX_IDS = 10000
+# IDs per UPDATE/DELETE statement (keeps IN lists under backend parameter limits)
+BULK_CHUNK_SIZE = 500
+
+
+def invoices_for_user(user, queryset=None):
+    """
+    Restrict an Invoice queryset to the invoices a user may modify.
+    Superusers see every invoice, other users only the ones they saved.
+    """
+    if queryset is None:
+        queryset = Invoice.objects.all()
+    if user.is_superuser:
+        return queryset
+    return queryset.filter(save_by=user)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bulk_apply(user, invoice_ids, action, status):
+    """
+    Run action(queryset) on the user's invoices among invoice_ids, one chunk at a time.
+
+    Returns:
+        Dictionary mapping each requested ID to status or 'not_found'
+    """
+    results = {}
+    scoped = invoices_for_user(user)
+    with transaction.atomic():
+        for chunk in _chunks(list(invoice_ids), BULK_CHUNK_SIZE):
+            found = set(scoped.filter(id__in=chunk).values_list('id', flat=True))
+            if found:
+                action(Invoice.objects.filter(id__in=found))
+            for invoice_id in chunk:
+                results[invoice_id] = status if invoice_id in found else 'not_found'
+    return results
+
+
+def bulk_update_invoices(user, invoice_ids, **values):
+    """
+    Update fields on many invoices with one UPDATE statement per chunk.
+
+    QuerySet.update() bypasses auto_now, so last_updated_date is set explicitly.
+
+    Args:
+        user: User performing the update (limits the invoices that can be touched)
+        invoice_ids: Iterable of invoice primary keys
+        **values: Field values to set
+
+    Returns:
+        Dictionary mapping each requested ID to 'updated' or 'not_found'
+    """
+    changes = dict(values)
+    values.setdefault('last_updated_date', timezone.now())
+
+    def update(queryset):
+        # QuerySet.update() sends no signals: record the audit trail from the current values
+        record_queryset_update(queryset, changes)
+        queryset.update(**values)
+
+    results = _bulk_apply(user, invoice_ids, update, 'updated')
+    updated = [invoice_id for invoice_id, status in results.items() if status == 'updated']
+    if updated:
+        publish_invoice_event(INVOICE_UPDATED, updated, changes)
+        # Up to BULK_MAX_IDS rows in one transaction: re-stamped at commit if it ran long
+        stamp_on_commit(Invoice, updated, values['last_updated_date'])
+        if 'paid' in values:
+            # QuerySet.update() sends no signals: refresh the paid/outstanding rollups here
+            mark_invoice_rows_dirty(
+                Invoice.objects.filter(id__in=updated).only('id', 'customer_id', 'invoice_date_time')
+            )
+    logger.info(
+        "Bulk update of %s: %d/%d invoices by %s",
+        sorted(values), sum(1 for status in results.values() if status == 'updated'), len(results), user,
+    )
+    return results
+
+
+def bulk_delete_invoices(user, invoice_ids):
+    """
+    Delete many invoices (and their articles) chunk by chunk.
+
+    Returns:
+        Dictionary mapping each requested ID to 'deleted' or 'not_found'
+    """
+    with invoice_events_suppressed():
+        results = _bulk_apply(user, invoice_ids, lambda qs: qs.delete(), 'deleted')
+    deleted = [invoice_id for invoice_id, status in results.items() if status == 'deleted']
+    if deleted:
+        publish_invoice_event(INVOICE_DELETED, deleted)
+    logger.info(
+        "Bulk delete: %d/%d invoices by %s",
+        sum(1 for status in results.values() if status == 'deleted'), len(results), user,
+    )
+    return results
@@ -1,40 +1,29 @@
 import logging
-import datetime
 from decimal import Decimal
 
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import HttpResponse
-from django.template.loader import get_template
 from django.urls import reverse_lazy
 from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 
-import pdfkit
-
 from .models import Customer, Invoice, Article
 from .forms import CustomerForm, InvoiceForm, ArticleFormSet
-from .utils import pagination, get_invoice
-from .decorators import superuser_required
+from .utils import pagination, get_invoice, bulk_update_invoices
+from .archive import get_invoice_or_archived
+from .lines import get_invoice_lines, use_compact_articles
+from .money import annotate_totals
+from .pdf import get_or_render_invoice_pdf
+from .decorators import superuser_required, SuperuserRequiredMixin
 
 logger = logging.getLogger(__name__)
 
 
-class SuperuserRequiredMixin(UserPassesTestMixin):
-    """Mixin to require superuser status"""
-    
-    def test_func(self):
-        return self.request.user.is_superuser
-    
-    def handle_no_permission(self):
-        messages.error(self.request, _("You do not have permission to access this page."))
-        return redirect('admin:login')
-
-
 class HomeView(LoginRequiredMixin, SuperuserRequiredMixin, ListView):
     """
     Main view - displays list of invoices with pagination
@@ -45,15 +34,20 @@ class HomeView(LoginRequiredMixin, SuperuserRequiredMixin, ListView):
     paginate_by = 5
     
     def get_queryset(self):
-        return Invoice.objects.select_related(
+        return annotate_totals(Invoice.objects.select_related(
             'customer',
             'save_by'
-        ).order_by('-invoice_date_time')
+        )).order_by('-invoice_date_time')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_invoices'] = self.get_queryset().count()
-        context['paid_invoices'] = self.get_queryset().filter(paid=True).count()
+        # Unpaid invoices are counted from their partial index; paid = total - unpaid
+        total_invoices = Invoice.objects.count()
+        pending_invoices = Invoice.objects.filter(paid=False).count()
+        context['total_invoices'] = total_invoices
+        context['paid_invoices'] = total_invoices - pending_invoices
+        context['pending_invoices'] = pending_invoices
+        context['completion_rate'] = 100 * (total_invoices - pending_invoices) / total_invoices if total_invoices else 0
         return context    
 
 
@@ -87,12 +81,12 @@ class AddCustomerView(LoginRequiredMixin, SuperuserRequiredMixin, CreateView):
             self.request,
             _("Customer '%(name)s' registered successfully.") % {'name': form.cleaned_data['name']}
         )
-        logger.info(f"Customer created: {form.cleaned_data['name']} by {self.request.user}")
+        logger.info("Customer created: %s by %s", form.cleaned_data['name'], self.request.user)
         return super().form_valid(form)
     
     def form_invalid(self, form):
         """Log validation errors"""
-        logger.warning(f"Customer creation failed: {form.errors}")
+        logger.warning("Customer creation failed: %s", form.errors.as_json())
         for field, errors in form.errors.items():
             for error in errors:
                 messages.error(self.request, f"{field}: {error}")
@@ -113,7 +107,7 @@ class UpdateCustomerView(LoginRequiredMixin, SuperuserRequiredMixin, UpdateView)
             self.request,
             _("Customer '%(name)s' updated successfully.") % {'name': form.cleaned_data['name']}
         )
-        logger.info(f"Customer updated: {form.cleaned_data['name']} by {self.request.user}")
+        logger.info("Customer updated: %s by %s", form.cleaned_data['name'], self.request.user)
         return super().form_valid(form)
 
 
@@ -127,7 +121,7 @@ class DeleteCustomerView(LoginRequiredMixin, SuperuserRequiredMixin, DeleteView)
     
     def delete(self, request, *args, **kwargs):
         customer_name = self.get_object().name
-        logger.info(f"Customer deleted: {customer_name} by {request.user}")
+        logger.info("Customer deleted: %s by %s", customer_name, request.user)
         messages.success(request, _("Customer deleted successfully."))
         return super().delete(request, *args, **kwargs)   
 
@@ -176,15 +170,15 @@ class AddInvoiceView(LoginRequiredMixin, SuperuserRequiredMixin, CreateView):
                 }
             )
             logger.info(
-                f"Invoice created: ID={self.object.id}, Customer={form.instance.customer.name}, "
-                f"by {self.request.user}"
+                "Invoice created: ID=%s, Customer=%s, by %s",
+                self.object.id, form.instance.customer.name, self.request.user
             )
             return super().form_valid(form)
         else:
             return self.form_invalid(form)
     
     def form_invalid(self, form):
-        logger.warning(f"Invoice creation failed: {form.errors}")
+        logger.warning("Invoice creation failed: %s", form.errors.as_json())
         for field, errors in form.errors.items():
             for error in errors:
                 messages.error(self.request, f"{field}: {error}")
@@ -201,15 +195,26 @@ class InvoiceDetailView(LoginRequiredMixin, SuperuserRequiredMixin, DetailView):
     context_object_name = 'invoice'
     
     def get_queryset(self):
-        return Invoice.objects.select_related(
+        queryset = Invoice.objects.select_related(
             'customer',
             'save_by'
-        ).prefetch_related('articles')
+        )
+        if not use_compact_articles():
+            queryset = queryset.prefetch_related('articles')
+        return queryset
+    
+    def get_object(self, queryset=None):
+        # Fall back to the archive for old paid invoices
+        return get_invoice_or_archived(self.kwargs[self.pk_url_kwarg], self.get_queryset())
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        articles, pricing = get_invoice_lines(self.object)
+        amounts = pricing.amounts()
         context['obj'] = self.object
-        context['articles'] = self.object.articles.all()
+        context['articles'] = articles
+        context['total'] = amounts['total']
+        context['pricing'] = amounts
         return context
 
 
@@ -233,8 +238,8 @@ class UpdateInvoiceStatusView(LoginRequiredMixin, SuperuserRequiredMixin, Update
             }
         )
         logger.info(
-            f"Invoice {self.object.id} status changed from {old_paid_status} to {new_paid_status} "
-            f"by {self.request.user}"
+            "Invoice %s status changed from %s to %s by %s",
+            self.object.id, old_paid_status, new_paid_status, self.request.user
         )
         return super().form_valid(form)
 
@@ -249,8 +254,7 @@ class DeleteInvoiceView(LoginRequiredMixin, SuperuserRequiredMixin, DeleteView):
     
     def delete(self, request, *args, **kwargs):
         invoice = self.get_object()
-        invoice_info = f"Invoice {invoice.id} for {invoice.customer.name}"
-        logger.info(f"Invoice deleted: {invoice_info} by {request.user}")
+        logger.info("Invoice deleted: Invoice %s for %s by %s", invoice.id, invoice.customer.name, request.user)
         messages.success(request, _("Invoice deleted successfully."))
         return super().delete(request, *args, **kwargs)
 
@@ -263,36 +267,16 @@ def get_invoice_pdf(request, pk):
     Generate and download PDF for an invoice
     """
     try:
-        invoice = get_object_or_404(
-            Invoice.objects.select_related(
-                'customer',
-                'save_by'
-            ).prefetch_related('articles'),
-            pk=pk
-        )
-        
-        context = {
-            'obj': invoice,
-            'articles': invoice.articles.all(),
-            'date': datetime.datetime.today()
-        }
+        queryset = Invoice.objects.select_related('customer', 'save_by')
+        if not use_compact_articles():
+            queryset = queryset.prefetch_related('articles')
+        invoice = get_invoice_or_archived(pk, queryset)
         
-        # Get and render template
-        template = get_template('invoice-pdf.html')
-        html = template.render(context)
-        
-        # PDF options
-        options = {
-            'page-size': 'Letter',
-            'encoding': 'UTF-8',
-            'enable-local-file-access': '',
-        }
-        
-        # Generate PDF
+        # Serve the cached PDF, rendering it when this version is not cached yet
         try:
-            pdf = pdfkit.from_string(html, False, options)
+            pdf = get_or_render_invoice_pdf(invoice)
         except Exception as e:
-            logger.error(f"PDF generation failed for invoice {pk}: {str(e)}")
+            logger.error("PDF generation failed for invoice %s: %s", pk, e)
             messages.error(
                 request,
                 _("Failed to generate PDF. Please contact support.")
@@ -304,11 +288,11 @@ def get_invoice_pdf(request, pk):
         filename = f"Invoice_{invoice.customer.name}_{invoice.invoice_date_time.strftime('%Y%m%d')}.pdf"
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         
-        logger.info(f"PDF generated for invoice {pk} by {request.user}")
+        logger.info("PDF generated for invoice %s by %s", pk, request.user)
         return response
         
     except Exception as e:
-        logger.exception(f"Unexpected error generating PDF for invoice {pk}")
+        logger.exception("Unexpected error generating PDF for invoice %s", pk)
         messages.error(request, _("An error occurred while generating the PDF."))
         return redirect('view-invoice', pk=pk)
 
@@ -320,25 +304,20 @@ def bulk_update_invoice_status(request):
     Bulk update payment status for multiple invoices
     """
     try:
-        invoice_ids = request.POST.getlist('invoice_ids')
+        invoice_ids = [int(pk) for pk in request.POST.getlist('invoice_ids')]
         new_status = request.POST.get('status') == 'True'
         
         if not invoice_ids:
             messages.warning(request, _("No invoices selected."))
             return redirect('home')
         
-        invoices = Invoice.objects.filter(
-            id__in=invoice_ids,
-            save_by=request.user
-        ) if not request.user.is_superuser else Invoice.objects.filter(id__in=invoice_ids)
-        
-        updated_count = invoices.update(paid=new_status)
+        results = bulk_update_invoices(request.user, invoice_ids, paid=new_status)
+        updated_count = sum(1 for status in results.values() if status == 'updated')
         
         messages.success(
             request,
             _("%(count)d invoice(s) updated successfully.") % {'count': updated_count}
         )
-        logger.info(f"Bulk update: {updated_count} invoices status changed to {new_status} by {request.user}")
         
     except Exception as e:
         logger.exception("Error during bulk invoice update")
@@ -1,11 +1,139 @@
 """
 Logging configuration for Django-Invoice
-Add this to your settings.py to enable proper logging
+Imported by django_invoice/settings.py (LOGGING and LOGGING_CONFIG)
+
+Log records are written as JSON lines. Handlers that write to files run in a
+background QueueListener thread, so request threads never wait on disk I/O:
+they only put the record on an in-memory queue.
 """
+import atexit
+import copy
+import json
+import logging
+import logging.config
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+
+from decouple import config
+
+BASE_DIR = Path(__file__).resolve().parent
+LOGS_DIR = os.path.join(BASE_DIR, 'logs')
+
+# Attributes present on every LogRecord; anything else was passed via extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line.
+    Values passed with extra={...} are added as top-level keys.
+    """
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exception'] = record.exc_text
+        if record.stack_info:
+            payload['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler keeping the formatted traceback and extra attributes,
+    so the handlers behind the listener can still format them
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# (queue handler, target handlers, running listener) for every queued logger
+_QUEUED_LOGGERS = []
+
+
+def _start_listener(queue_handler, handlers):
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _restart_listeners_after_fork():
+    """The listener threads do not survive fork(): give the child fresh queues and threads"""
+    for index, (queue_handler, handlers, _listener) in enumerate(_QUEUED_LOGGERS):
+        queue_handler.queue = queue.SimpleQueue()
+        _QUEUED_LOGGERS[index] = (queue_handler, handlers, _start_listener(queue_handler, handlers))
+
+
+def _stop_listeners():
+    for _queue_handler, _handlers, listener in _QUEUED_LOGGERS:
+        listener.stop()
+
+
+def enable_queue_logging(logger_names):
+    """
+    Move the handlers of the given loggers behind a queue.
+
+    Each logger gets a RecordQueueHandler feeding a QueueListener thread
+    that calls the original handlers (honouring their levels and filters).
+    """
+    for name in logger_names:
+        logger = logging.getLogger(name or None)
+        handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+        if not handlers:
+            continue
+        queue_handler = RecordQueueHandler(queue.SimpleQueue())
+        logger.handlers = [queue_handler]
+        _QUEUED_LOGGERS.append((queue_handler, handlers, _start_listener(queue_handler, handlers)))
+
+
+atexit.register(_stop_listeners)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners_after_fork)
+
+
+def configure_logging(config):
+    """
+    LOGGING_CONFIG entry point: create the log directories, apply the dictConfig,
+    then make the configured loggers non-blocking unless config['queue'] is False
+    """
+    config = dict(config)
+    use_queue = config.pop('queue', True)
+    # Done here rather than at import, so importing the settings touches no disk
+    for directory in {os.path.dirname(h['filename']) for h in config.get('handlers', {}).values() if 'filename' in h}:
+        os.makedirs(directory, exist_ok=True)
+    logging.config.dictConfig(config)
+    if use_queue:
+        enable_queue_logging(list(config.get('loggers', {})))
+
 
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    # Non-standard key read by configure_logging()
+    'queue': True,
     'formatters': {
         'verbose': {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
@@ -17,6 +145,10 @@ LOGGING = {
             'style': '{',
             'datefmt': '%Y-%m-%d %H:%M:%S',
         },
+        'json': {
+            '()': 'logging_config.JsonFormatter',
+            'datefmt': '%Y-%m-%dT%H:%M:%S%z',
+        },
     },
     'filters': {
         'require_debug_false': {
@@ -28,33 +160,36 @@ LOGGING = {
     },
     'handlers': {
         'console': {
-            'level': 'INFO',
+            'level': config('LOG_CONSOLE_LEVEL', default='INFO'),
             'class': 'logging.StreamHandler',
             'formatter': 'simple'
         },
         'file': {
             'level': 'INFO',
             'class': 'logging.handlers.RotatingFileHandler',
-            'filename': 'logs/django.log',
+            'filename': os.path.join(LOGS_DIR, 'django.log'),
             'maxBytes': 1024 * 1024 * 5,  # 5 MB
             'backupCount': 5,
-            'formatter': 'verbose',
+            'formatter': 'json',
+            'delay': True,
         },
         'fact_app_file': {
             'level': 'INFO',
             'class': 'logging.handlers.RotatingFileHandler',
-            'filename': 'logs/fact_app.log',
+            'filename': os.path.join(LOGS_DIR, 'fact_app.log'),
             'maxBytes': 1024 * 1024 * 5,  # 5 MB
             'backupCount': 5,
-            'formatter': 'verbose',
+            'formatter': 'json',
+            'delay': True,
         },
         'security_file': {
             'level': 'WARNING',
             'class': 'logging.handlers.RotatingFileHandler',
-            'filename': 'logs/security.log',
+            'filename': os.path.join(LOGS_DIR, 'security.log'),
             'maxBytes': 1024 * 1024 * 5,  # 5 MB
             'backupCount': 5,
-            'formatter': 'verbose',
+            'formatter': 'json',
+            'delay': True,
         },
     },
     'loggers': {
@@ -75,8 +210,3 @@ LOGGING = {
         },
     },
 }
-
-# Make sure logs directory exists
-import os
-LOGS_DIR = os.path.join(BASE_DIR, 'logs')
-os.makedirs(LOGS_DIR, exist_ok=True)
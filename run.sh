@@ -1,44 +1,64 @@
 #!/bin/bash
 #set -e
 cat << EOF
-  _____ _____.__ .__ 
+  _____ _____.__ .__
 _/ __ \ __\   __\| |/ ___\\__ \ | | / ___/
 \ ___/| | | | | \ \ \ ___ / __ \| |__\___ \
 \___ >__| |__| |__|\___ >____ /____/____ >
 \/ \/ \/ \/ \/
 EOF
 
-echo "Running the project"
-echo "Installing requirements..."
-pip install -r requirements.txt
+# BOOT_MODE=fast (default): the image already has the requirements installed,
+#   so start serving right away. Migrations run unless RUN_MIGRATIONS=0 (set it
+#   on autoscaled replicas and migrate once per release instead).
+# BOOT_MODE=full: previous behaviour for development boxes: install the
+#   requirements, merge migrations, run the test suite and serve with --reload.
+BOOT_MODE="${BOOT_MODE:-fast}"
+RUN_MIGRATIONS="${RUN_MIGRATIONS:-1}"
 
-echo "Running migrations..."
-python manage.py makemigrations --merge
-python manage.py migrate
+echo "Running the project (${BOOT_MODE} boot)"
 
-echo "  "
-echo "============================"
-echo "Running Test and Sonar..."
-echo "============================"
-python manage.py test
+if [ "${BOOT_MODE}" = "full" ]; then
+  echo "Installing requirements..."
+  pip install -r requirements.txt
 
-if [ $? -ne 0 ]; then
-  echo " "
-  echo "❌ Test step failed, please fix before pushing."
-  exit 1
-fi
+  echo "Running migrations..."
+  python manage.py makemigrations --merge
+  python manage.py migrate
+
+  echo "  "
+  echo "============================"
+  echo "Running Test and Sonar..."
+  echo "============================"
+  python manage.py test
 
-echo "Collection statics?yes/or pass"
-echo 'yes' | python manage.py collectstatic --noinput
+  if [ $? -ne 0 ]; then
+    echo " "
+    echo "❌ Test step failed, please fix before pushing."
+    exit 1
+  fi
 
-sleep 5
+  echo "Collection statics?yes/or pass"
+  echo 'yes' | python manage.py collectstatic --noinput
+  GUNICORN_OPTIONS="--reload"
+else
+  if [ "${RUN_MIGRATIONS}" = "1" ]; then
+    python manage.py migrate --noinput
+  fi
+  # Always collect: the source tree is bind-mounted over the image (docker-compose.yml),
+  # so a manifest left by an older release would keep serving stale SPA files.
+  # collectstatic only copies the files that changed.
+  python manage.py collectstatic --noinput
+  # Load the application once in the master: workers are forked ready to serve
+  GUNICORN_OPTIONS="--preload"
+fi
 
 echo "** Number of workers ${GUNICORN_WORKERS}"
 echo "** Version ${VERSION}"
 echo "** Starting gunicorn on multiple ports..."
 
-# Starting Gunicorn 
-gunicorn django_invoice.wsgi:application -b 0:8000 -w "${GUNICORN_WORKERS}" --log-level DEBUG --reload --threads=10 --timeout=3600 &
+# Starting Gunicorn
+gunicorn django_invoice.wsgi:application -b 0:8000 -w "${GUNICORN_WORKERS}" --log-level DEBUG ${GUNICORN_OPTIONS} --threads=10 --timeout=3600 &
 
 # Wait for all background jobs to finish
 wait
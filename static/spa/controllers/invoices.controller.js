@@ -3,8 +3,11 @@
 
   angular
     .module('invoiceApp')
-    .controller('InvoicesController', ['ApiService', function (ApiService) {
+    .controller('InvoicesController', ['$scope', '$timeout', 'ApiService', function ($scope, $timeout, ApiService) {
       const vm = this;
+      let cursor = null;
+      let stopped = false;
+      let retry = null;
 
       vm.loading = true;
       vm.q = '';
@@ -23,6 +26,50 @@
         vm.load();
       };
 
+      // Apply pushed changes in place; reload the list when rows appear,
+      // disappear or change in ways the event does not describe
+      function applyEvents(events, reset) {
+        let reload = reset;
+        events.forEach(function (event) {
+          if (event.type !== 'invoice.updated' || !event.changes) {
+            reload = true;
+            return;
+          }
+          vm.invoices.forEach(function (inv) {
+            if (event.invoice_ids.indexOf(inv.id) !== -1) {
+              angular.extend(inv, event.changes);
+            }
+          });
+        });
+        if (reload) {
+          vm.load();
+        }
+      }
+
+      function poll() {
+        if (stopped) {
+          return;
+        }
+        ApiService.pollInvoiceEvents(cursor).then(function (res) {
+          applyEvents(res.data.events, res.data.reset);
+          cursor = res.data.cursor;
+          if (res.data.retry_after) {
+            // The server has no free slot to wait for events: poll again later
+            retry = $timeout(poll, res.data.retry_after * 1000);
+          } else {
+            poll();
+          }
+        }, function () {
+          retry = $timeout(poll, 5000);
+        });
+      }
+
+      $scope.$on('$destroy', function () {
+        stopped = true;
+        $timeout.cancel(retry);
+      });
+
       vm.load();
+      poll();
     }]);
 })();
@@ -14,6 +14,34 @@
         return $http.get(base + '/invoices/' + id + '/');
       }
 
+      function updateInvoice(id, changes) {
+        return $http.patch(base + '/invoices/' + id + '/', changes);
+      }
+
+      function bulkUpdateStatus(ids, paid) {
+        return $http.post(base + '/invoices/bulk/status/', { ids: ids, paid: paid });
+      }
+
+      function bulkComment(ids, comments) {
+        return $http.post(base + '/invoices/bulk/comment/', { ids: ids, comments: comments });
+      }
+
+      function bulkDelete(ids) {
+        return $http.post(base + '/invoices/bulk/delete/', { ids: ids });
+      }
+
+      function pollInvoiceEvents(after) {
+        return $http.get(base + '/invoices/events/', { params: { after: after } });
+      }
+
+      function listChanges(since, limit) {
+        return $http.get(base + '/changes/', { params: { since: since, limit: limit } });
+      }
+
+      function revenueReport(params) {
+        return $http.get(base + '/reports/revenue/', { params: params || {} });
+      }
+
       function listCustomers(params) {
         return $http.get(base + '/customers/', { params: params || {} });
       }
@@ -22,11 +50,28 @@
         return $http.get(base + '/customers/' + id + '/');
       }
 
+      function listCustomerInvoices(id, params) {
+        return $http.get(base + '/customers/' + id + '/invoices/', { params: params || {} });
+      }
+
+      function getCustomerStatement(id, params) {
+        return $http.get(base + '/customers/' + id + '/statement/', { params: params || {} });
+      }
+
       return {
         listInvoices,
         getInvoice,
+        updateInvoice,
+        bulkUpdateStatus,
+        bulkComment,
+        bulkDelete,
+        pollInvoiceEvents,
+        listChanges,
+        revenueReport,
         listCustomers,
-        getCustomer
+        getCustomer,
+        listCustomerInvoices,
+        getCustomerStatement
       };
     }]);
 })();